@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Ettus Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import rfnocsim
+import sim_colosseum
+import argparse
+import collections
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+try:
+    import resource
+except ImportError:
+    resource = None     # Not available on Windows
+
+# Metrics reported for every workload and whether higher or lower is better
+METRICS = collections.OrderedDict([
+    ('ticks_per_s', 'higher'),              # Simulated ticks per second of run time
+    ('build_time_s', 'lower'),              # Time to instantiate and connect the network
+    ('peak_rss_mb', 'lower'),               # Peak resident set size of the worker process
+    ('retained_blocks_per_tick', 'lower'),  # Net growth of allocated memory blocks per tick (blocks that
+                                            # were allocated and freed during the run do not count)
+])
+# Default relative change (in the bad direction) that counts as a regression
+DEFAULT_THRESHOLDS = {'ticks_per_s': 0.10, 'build_time_s': 0.20,
+                      'peak_rss_mb': 0.10, 'retained_blocks_per_tick': 0.10}
+# Changes smaller than this (absolute) are noise, even if they are large relative ones
+NOISE_FLOORS = {'ticks_per_s': 0.0, 'build_time_s': 0.01,
+                'peak_rss_mb': 1.0, 'retained_blocks_per_tick': 1.0}
+
+# The Colosseum configuration that all network workloads are built from.
+# It is fixed here (not taken from the sim_colosseum defaults) so that
+# results can be compared between revisions.
+BENCH_CONFIG = {'topology': 'flb', 'dims': 3, 'radix': 4, 'concentration': 2, 'lanes_per_link': 4, 'bcast_dims': 0,
+                'domain': 'time', 'fir_taps': 4, 'fir_dly_line': 512, 'fft_size': 512, 'fft_overlap': 256,
+                'max_unroll_depth': 2, 'coeff_sets': 1, 'sync_buffers': 0, 'packet_lanes': 0, 'samp_rate': 100e6,
+                'coherence_rate': 1000, 'scheduler': 'tick', 'sim_time': 0.0}
+
+class Passthrough(rfnocsim.Function):
+    """
+    Function that forwards its input stream unmodified
+    """
+    def __init__(self, sim_core, name, latency=0):
+        rfnocsim.Function.__init__(self, sim_core, name, 1, 1)
+        self.update_latency(func=latency)
+
+    def do_func(self, args):
+        return [self.create_outdata_stream(args[0].bpi, args[0].items, args[0].count)]
+
+def build_chain():
+    # Producer -> Channel -> Function -> Channel -> Consumer
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6, scheduler='tick')
+    src = rfnocsim.Producer(sim_core, 'SRC', 4, ['samp'], latency=1)
+    ch_in = rfnocsim.Channel(sim_core, 'CH_IN', latency=10)
+    func = Passthrough(sim_core, 'FUNC', latency=5)
+    ch_out = rfnocsim.Channel(sim_core, 'CH_OUT', latency=10)
+    sink = rfnocsim.Consumer(sim_core, 'SINK')
+    sim_core.connect(src, 0, ch_in, 0)
+    sim_core.connect(ch_in, 0, func, 0)
+    sim_core.connect(func, 0, ch_out, 0)
+    sim_core.connect(ch_out, 0, sink, 0)
+    return sim_core
+
+def build_network(**params):
+    config = dict(BENCH_CONFIG)
+    config.update(params)
+    return sim_colosseum.build(config, verbose=False)
+
+# Fixed benchmark workloads: name -> (build function, simulated time (s))
+WORKLOADS = collections.OrderedDict([
+    ('chain', (build_chain, 2e-4)),
+    # A 2x2 flattened butterfly fills exactly one BEE7 blade
+    ('blade', (lambda: build_network(topology='flb_nd', dims=2, radix=2), 1e-5)),
+    ('flb', (lambda: build_network(topology='flb'), 1e-7)),
+    # Same size as the FLB. Topology_2D_4x4_Torus only builds with Python 2.
+    ('torus', (lambda: build_network(topology='torus_nd', dims=3, radix=4), 1e-7)),
+])
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+def get_allocated_blocks():
+    if hasattr(sys, 'getallocatedblocks'):     # Python 3.4+
+        return sys.getallocatedblocks()
+    return None
+
+def run_workload(name):
+    """
+    Builds and runs a single workload in this process and returns its
+    metrics. Run this in a fresh process so that the peak RSS only
+    covers the workload.
+    """
+    (build_func, sim_time) = WORKLOADS[name]
+    start = timeit.default_timer()
+    sim_core = build_func()
+    build_time = timeit.default_timer() - start
+    gc.collect()
+    blocks_before = get_allocated_blocks()
+    ticks_before = sim_core.get_ticks()
+    start = timeit.default_timer()
+    sim_core.run(sim_time)
+    run_time = timeit.default_timer() - start
+    ticks = sim_core.get_ticks() - ticks_before
+    gc.collect()
+    blocks_after = get_allocated_blocks()
+    return {
+        'components': len(sim_core.list_components()),
+        'ticks': ticks,
+        'run_time_s': run_time,
+        'ticks_per_s': ticks / run_time if run_time > 0 else None,
+        'build_time_s': build_time,
+        'peak_rss_mb': get_peak_rss_mb(),
+        'retained_blocks_per_tick': (float(blocks_after - blocks_before) / ticks
+                                  if blocks_before is not None and ticks > 0 else None),
+    }
+
+def run_benchmarks(names, repeat=1):
+    """
+    Runs every workload repeat times (each in its own process) and
+    returns the best value of every metric by workload
+    """
+    results = collections.OrderedDict()
+    for name in names:
+        best = None
+        for i in range(repeat):
+            out = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--worker', name],
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+            run = json.loads(out.decode().strip().splitlines()[-1])
+            if best is None:
+                best = run
+                continue
+            for (m, better) in METRICS.items():
+                if run[m] is not None and best[m] is not None:
+                    pick = max if better == 'higher' else min
+                    best[m] = pick(best[m], run[m])
+            if run['run_time_s'] < best['run_time_s']:
+                best['run_time_s'] = run['run_time_s']
+        results[name] = best
+        print('[INFO] %s: %s' % (name, ', '.join(
+            '%s=%s' % (m, format_value(best[m])) for m in METRICS)))
+    return results
+
+def format_value(value):
+    return 'n/a' if value is None else ('%.4g' % value)
+
+def get_revision():
+    try:
+        out = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, results, thresholds):
+    """
+    Compares benchmark results against a baseline (both as saved in the
+    JSON output). Returns a list of (workload, metric, baseline value,
+    new value, relative change) for every regression that is larger than
+    the threshold of its metric. Relative changes are positive in the
+    bad direction.
+    """
+    regressions = []
+    for (name, res) in results['workloads'].items():
+        base = baseline['workloads'].get(name)
+        if base is None:
+            continue
+        for (m, better) in METRICS.items():
+            if base.get(m) is None or res.get(m) is None:
+                continue
+            change = res[m] - base[m]
+            if better == 'higher':
+                change = -change
+            if change <= NOISE_FLOORS[m]:
+                continue
+            rel_change = change / abs(base[m]) if base[m] else float('inf')
+            if rel_change > thresholds[m]:
+                regressions.append((name, m, base[m], res[m], rel_change))
+    return regressions
+
+def parse_thresholds(specs):
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for spec in (specs or []):
+        (metric, sep, value) = spec.partition('=')
+        if not sep or metric not in METRICS:
+            raise RuntimeError('Invalid threshold: %s (expected one of %s=FRACTION)' %
+                               (spec, '|'.join(METRICS)))
+        thresholds[metric] = float(value)
+    return thresholds
+
+def main():
+    # Arguments
+    parser = argparse.ArgumentParser(description='Benchmark the rfnocsim simulation engine')
+    parser.add_argument('--workloads', type=str, default=','.join(WORKLOADS.keys()), help='Comma separated workloads to run (%s)' % ', '.join(WORKLOADS.keys()))
+    parser.add_argument('--repeat', type=int, default=3, help='Run every workload this many times and keep the best result of each metric')
+    parser.add_argument('--output', type=str, default=None, help='Save the results to this JSON file')
+    parser.add_argument('--label', type=str, default=None, help='Label for the results (defaults to the git revision)')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare the results against a JSON file saved by an earlier run and fail on regressions')
+    parser.add_argument('--threshold', type=str, action='append', metavar='METRIC=FRACTION', help='Maximum relative regression of a metric (can be repeated). Defaults: ' + ', '.join('%s=%g' % (m, DEFAULT_THRESHOLDS[m]) for m in METRICS))
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Internal: Run a single workload and report its metrics on stdout
+        print(json.dumps(run_workload(args.worker)))
+        return
+
+    names = [n for n in args.workloads.split(',') if n]
+    for n in names:
+        if n not in WORKLOADS:
+            raise RuntimeError('Invalid workload: ' + n)
+    thresholds = parse_thresholds(args.threshold)
+    results = {
+        'label': args.label or get_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'workloads': run_benchmarks(names, args.repeat),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('[INFO] Results written to ' + args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, thresholds)
+        for (name, m, old, new, rel_change) in regressions:
+            print('[WARN] %s: %s regressed from %s to %s (%.1f%% > %.1f%%)' %
+                  (name, m, format_value(old), format_value(new), rel_change * 100, thresholds[m] * 100))
+        if regressions:
+            sys.exit(1)
+        print('[INFO] No regressions against %s (%s)' % (args.baseline, baseline.get('label')))
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,7 @@
 
 import rfnocsim
 import math
+import itertools
 import ni_hw_models as hw
 
 class ColGlobals():
@@ -29,6 +30,18 @@ class ColGlobals():
     MAX_PP_HOPS = 1     # Maximum number of hops a PP will take before it is used to compute a TX sample
     ELASTIC_BUFF_FULLNESS = 0.5
 
+    @staticmethod
+    def get_sync_buff_args(sim_core, sync_buff_depth, app_settings):
+        """
+        Returns the input argument depth (in streams) that simulates sync
+        buffers of sync_buff_depth samples if app_settings['sync_buffers']
+        is set. Otherwise the buffers are only estimated and the depth is 1.
+        """
+        if not app_settings.get('sync_buffers'):
+            return 1
+        samps_per_tick = float(app_settings['samp_rate']) / sim_core.get_tick_rate()
+        return max(int(math.ceil(sync_buff_depth / samps_per_tick)), 1)
+
 class PartialContribComputer(rfnocsim.Function):
     """
     Simulation model for function that computes the contribution of radio chans on other radio chans.
@@ -46,15 +59,22 @@ class PartialContribComputer(rfnocsim.Function):
         items_per_stream: How many channels per stream can this function deinterleave?
         ticks_per_exec: How many ticks for the function to generate a full output set
     """
+    # Defaults for the implementation parameters (can be overridden in app_settings)
+    MAX_UNROLL_DEPTH = 2        # How many taps (or FFT bins) to compute in parallel?
+    COEFF_SETS = 1              # We need two copies of coefficients one live
+                                # and one buffered for dynamic reload. If both
+                                # live in BRAM, this should be 2. If the live
+                                # set lives in registers, this should be 1
+    DSP_BLOCKS_PER_MAC = 3      # DSP blocks for a scaled complex MAC
+    MAX_DSP_RATE = 400e6        # Max clock rate for a DSP48E block
+
     def __init__(self, sim_core, name, size, dst_chans, items_per_stream, app_settings):
         ticks_per_exec = 1      # This function will run once every tick. No multi-cycle paths here.
-        rfnocsim.Function.__init__(self, sim_core, name, size, int(len(dst_chans)/items_per_stream), ticks_per_exec)
+        sync_buff_depth = self.get_sync_buff_depth(app_settings)
+        rfnocsim.Function.__init__(self, sim_core, name, size, int(len(dst_chans)/items_per_stream), ticks_per_exec,
+                                   ColGlobals.get_sync_buff_args(sim_core, sync_buff_depth, app_settings))
         self.items_per_stream = items_per_stream  # Each stream contains data from n radio chans
         self.dst_chans = dst_chans              # Where should the individual products go?
-        # This block has to buffer enough data to ensure
-        # sample alignment. How deep should those buffers be?
-        sync_buff_depth = (((ColGlobals.MAX_SAMP_HOPS - ColGlobals.MIN_SAMP_HOPS) *
-            hw.Bee7Fpga.IO_LN_LATENCY * float(app_settings['samp_rate'])) / ColGlobals.ELASTIC_BUFF_FULLNESS)
 
         # Adder latency: log2(radix) adder stages + 2 pipeline flops
         latency = math.ceil(math.log(size/len(dst_chans), 2)) + 2
@@ -64,46 +84,66 @@ class PartialContribComputer(rfnocsim.Function):
         latency += ColGlobals.BPP * (self.get_tick_rate() / hw.Bee7Fpga.IO_LN_BW)
         self.estimate_resources(size*items_per_stream, len(dst_chans), app_settings, sync_buff_depth*size, latency)
 
-    def estimate_resources(self, N, M, app_settings, sync_buff_total_samps, pre_filt_latency):
-        rscrs = rfnocsim.HwRsrcs()
-
-        DSP_BLOCKS_PER_MAC = 3      # DSP blocks for a scaled complex MAC
-        MAX_DSP_RATE = 400e6        # Max clock rate for a DSP48E block
-        MAX_UNROLL_DEPTH = 2        # How many taps (or FFT bins) to compute in parallel?
-        COEFF_SETS = 1              # We need two copies of coefficients one live
-                                    # and one buffered for dynamic reload. If both
-                                    # live in BRAM, this should be 2. If the live
-                                    # set lives in registers, this should be 1
+    @staticmethod
+    def get_sync_buff_depth(app_settings):
+        """
+        Returns the depth (samples) of the buffer that each input needs to
+        ensure sample alignment
+        """
+        return (((ColGlobals.MAX_SAMP_HOPS - ColGlobals.MIN_SAMP_HOPS) *
+            hw.Bee7Fpga.IO_LN_LATENCY * float(app_settings['samp_rate'])) / ColGlobals.ELASTIC_BUFF_FULLNESS)
 
+    @classmethod
+    def get_fir_unroll(cls, app_settings):
+        """
+        Returns (unroll_factor, dsp_rate) of the FIR filters (time domain only)
+        """
         samp_rate = float(app_settings['samp_rate'])
-        dsp_cyc_per_samp = MAX_DSP_RATE / samp_rate
+        fir_taps = app_settings['fir_taps']
+        if (fir_taps <= cls.MAX_DSP_RATE / samp_rate):
+            return (1, samp_rate * fir_taps)
+        unroll_factor = math.ceil((1.0 * fir_taps) / (cls.MAX_DSP_RATE / samp_rate))
+        if (unroll_factor > app_settings.get('max_unroll_depth', cls.MAX_UNROLL_DEPTH)):
+            raise RuntimeError('Too many FIR coefficients! Reached loop unroll limit.')
+        return (unroll_factor, cls.MAX_DSP_RATE)
+
+    @classmethod
+    def get_resources(cls, N, M, app_settings, sync_buff_total_samps):
+        """
+        Returns the HwRsrcs of a function that computes an NxM product
+        (without instantiating it)
+        """
+        rscrs = rfnocsim.HwRsrcs()
+        MAX_UNROLL_DEPTH = app_settings.get('max_unroll_depth', cls.MAX_UNROLL_DEPTH)
+        COEFF_SETS = app_settings.get('coeff_sets', cls.COEFF_SETS)
 
         if app_settings['domain'] == 'time':
             fir_taps = app_settings['fir_taps']
-            if (fir_taps <= dsp_cyc_per_samp):
-                unroll_factor = 1
-                dsp_rate = samp_rate * fir_taps
-            else:
-                unroll_factor = math.ceil((1.0 * fir_taps) / dsp_cyc_per_samp)
-                dsp_rate = MAX_DSP_RATE
-                if (unroll_factor > MAX_UNROLL_DEPTH):
-                    raise self.SimCompError('Too many FIR coefficients! Reached loop unroll limit.')
-
-            rscrs.add('DSP', DSP_BLOCKS_PER_MAC * unroll_factor * N * M)
+            (unroll_factor, dsp_rate) = cls.get_fir_unroll(app_settings)
+            rscrs.add('DSP', cls.DSP_BLOCKS_PER_MAC * unroll_factor * N * M)
             rscrs.add('BRAM_18kb', math.ceil(ColGlobals.BPI * app_settings['fir_dly_line'] / hw.Bee7Fpga.BRAM_BYTES) * N * M) # FIR delay line memory
             rscrs.add('BRAM_18kb', math.ceil(ColGlobals.BPI * COEFF_SETS * fir_taps * unroll_factor * N * M / hw.Bee7Fpga.BRAM_BYTES))   # Coefficient storage
-
-            samp_per_tick = dsp_rate / self.get_tick_rate()
-            self.update_latency(func=pre_filt_latency + (fir_taps / (samp_per_tick * unroll_factor)))
         else:
             fft_size = app_settings['fft_size']
-            rscrs.add('DSP', DSP_BLOCKS_PER_MAC * N * M * MAX_UNROLL_DEPTH) # MACs
+            rscrs.add('DSP', cls.DSP_BLOCKS_PER_MAC * N * M * MAX_UNROLL_DEPTH) # MACs
             rscrs.add('BRAM_18kb', math.ceil(ColGlobals.BPI * N * M * fft_size * COEFF_SETS / hw.Bee7Fpga.BRAM_BYTES)) # Coeff storage
 
-            samp_per_tick = MAX_DSP_RATE / self.get_tick_rate()
-            self.update_latency(func=pre_filt_latency + (fft_size / samp_per_tick))
-
         rscrs.add('BRAM_18kb', math.ceil(ColGlobals.BPI * sync_buff_total_samps / hw.Bee7Fpga.BRAM_BYTES))
+        return rscrs
+
+    def estimate_resources(self, N, M, app_settings, sync_buff_total_samps, pre_filt_latency):
+        try:
+            rscrs = self.get_resources(N, M, app_settings, sync_buff_total_samps)
+        except RuntimeError as e:
+            raise self.SimCompError(str(e))
+
+        if app_settings['domain'] == 'time':
+            (unroll_factor, dsp_rate) = self.get_fir_unroll(app_settings)
+            samp_per_tick = dsp_rate / self.get_tick_rate()
+            self.update_latency(func=pre_filt_latency + (app_settings['fir_taps'] / (samp_per_tick * unroll_factor)))
+        else:
+            samp_per_tick = self.MAX_DSP_RATE / self.get_tick_rate()
+            self.update_latency(func=pre_filt_latency + (app_settings['fft_size'] / samp_per_tick))
         self.update_rsrcs(rscrs)
 
     def do_func(self, in_data):
@@ -124,6 +164,7 @@ class PartialContribComputer(rfnocsim.Function):
                 if sid != 'rx':
                     raise RuntimeError('Incorrect items. Expecting radio data (rx) but got ' + sid)
                 src_chans.extend(coords[0])
+        src_chans = tuple(src_chans)    # Shared by all generated items
         bpi = in_data[0].bpi
         count = in_data[0].count
         # Iterate through deinterleaved channels
@@ -151,15 +192,13 @@ class PartialContribCombiner(rfnocsim.Function):
     """
 
     def __init__(self, sim_core, name, radix, app_settings, reducer_filter = (None, None), items_per_stream = 2):
-        rfnocsim.Function.__init__(self, sim_core, name, radix, 1)
+        sync_buff_depth = self.get_sync_buff_depth(app_settings)
+        rfnocsim.Function.__init__(self, sim_core, name, radix, 1, 1,
+                                   ColGlobals.get_sync_buff_args(sim_core, sync_buff_depth, app_settings))
         self.radix = radix
         self.reducer_filter = reducer_filter
         self.items_per_stream = items_per_stream
-
-        # This block has to buffer enough data to ensure
-        # sample alignment. How deep should those buffers be?
-        sync_buff_depth = (((ColGlobals.MAX_PP_HOPS - ColGlobals.MIN_PP_HOPS) *
-            hw.Bee7Fpga.IO_LN_LATENCY * float(app_settings['samp_rate'])) / ColGlobals.ELASTIC_BUFF_FULLNESS)
+        self.__reducer_chans = sorted(reducer_filter[0]) if reducer_filter[0] is not None else None
         # Figure out latency based on sync buffer and delay line
         latency = math.ceil(math.log(radix, 2)) + 2     # log2(radix) adder stages + 2 pipeline flops
         # Synchronization latency based on buffer size
@@ -170,12 +209,29 @@ class PartialContribCombiner(rfnocsim.Function):
         self.update_latency(func=latency)
         self.estimate_resources(radix, sync_buff_depth)
 
-    def estimate_resources(self, radix, sync_buff_depth):
+    @staticmethod
+    def get_sync_buff_depth(app_settings):
+        """
+        Returns the depth (samples) of the buffer that each input needs to
+        ensure sample alignment
+        """
+        return (((ColGlobals.MAX_PP_HOPS - ColGlobals.MIN_PP_HOPS) *
+            hw.Bee7Fpga.IO_LN_LATENCY * float(app_settings['samp_rate'])) / ColGlobals.ELASTIC_BUFF_FULLNESS)
+
+    @staticmethod
+    def get_resources(radix, sync_buff_depth):
+        """
+        Returns the HwRsrcs of a combiner with radix inputs (without
+        instantiating it)
+        """
         rscrs = rfnocsim.HwRsrcs()
         # Assume that pipelined adders are inferred in logic (not DSP)
         # Assume that buffering uses BRAM
         rscrs.add('BRAM_18kb', math.ceil(ColGlobals.BPI * sync_buff_depth * radix / hw.Bee7Fpga.BRAM_BYTES))
-        self.update_rsrcs(rscrs)
+        return rscrs
+
+    def estimate_resources(self, radix, sync_buff_depth):
+        self.update_rsrcs(self.get_resources(radix, sync_buff_depth))
 
     def do_func(self, in_data):
         """
@@ -199,7 +255,7 @@ class PartialContribCombiner(rfnocsim.Function):
                 if coords[1][0] in out_chans:
                     out_chans[coords[1][0]].extend(coords[0])
                 else:
-                    out_chans[coords[1][0]] = coords[0]
+                    out_chans[coords[1][0]] = list(coords[0])
         # Check if keys (targets) for partial products == items_per_stream
         if len(list(out_chans.keys())) != self.items_per_stream:
             raise self.SimCompError('Inconsistent partial products. Too many targets.')
@@ -209,8 +265,9 @@ class PartialContribCombiner(rfnocsim.Function):
         contrib_chans = list(out_chans.values())[0]
         # Combine partial products and return
         out_items = []
+        reduced = (self.__reducer_chans == sorted(contrib_chans))
         for ch in list(out_chans.keys()):
-            if sorted(self.reducer_filter[0]) == sorted(contrib_chans):
+            if reduced:
                 out_items.append(rfnocsim.DataStream.submatrix_gen(self.reducer_filter[1], [ch]))
             else:
                 out_items.append(rfnocsim.DataStream.submatrix_gen('pp', [list(out_chans.values())[0], ch]))
@@ -270,12 +327,22 @@ class Topology_2D_4x4_Torus:
                 bee7fpga.sim_core.connect(func, 0, bee7fpga.serdes_o[bee7fpga.EXT_IO_LANES[bee7fpga.FP_BASE+8+i]], 0)
             bee7fpga.add_function(func)
 
+    @classmethod
+    def get_fpga_functions(cls):
+        """
+        Returns the functions that config_bitstream adds to each FPGA as a
+        list of (blade index, FPGA index, functions) without instantiating
+        them (see Topology_ND.get_fpga_functions)
+        """
+        funcs = [('computer', 32, 16, 2)] + [('combiner', 2)] * 8
+        return [(b, f, funcs) for b in range(16) for f in range(hw.Bee7Blade.NUM_FPGAS)]
+
     @classmethod
     def connect(cls, sim_core, usrps, bee7blades, hosts, app_settings):
         USRPS_PER_BLADE = 32
 
         # Create NULL source of "zero" partial products
-        null_items = ['null[(0);(0)]', 'null[(0);(0)]']
+        null_items = [rfnocsim.DataStream.submatrix_gen('null', [0, 0])] * 2
         null_src = rfnocsim.Producer(sim_core, 'NULL_SRC', 4, null_items)
         if app_settings['domain'] == 'frequency':
             null_src.set_rate(app_settings['samp_rate']*(1.0 +
@@ -331,6 +398,12 @@ class Topology_2D_4x4_Torus:
                             sim_core.connect(null_src, 0, bee7grid[(r+1)%4][c], pp_in_base + i)
 
 class Topology_3D_4x4_FLB:
+    DIM_SIZE = 4
+    # Port maps and radio numbers only depend on the address of an FPGA so
+    # they are computed once and shared by all lookups. Treat them as read-only.
+    __portmaps = dict()
+    __radio_tables = dict()
+
     @classmethod
     def get_radio_num(cls, router_addr, radio_idx, concentration):
         """
@@ -349,6 +422,23 @@ class Topology_3D_4x4_FLB:
             multiplier *= DIM_SIZE
         return radio_num + radio_idx
 
+    @classmethod
+    def get_radio_table(cls, concentration):
+        """
+        Returns a lookup table of global radio indices for all routers
+
+        radio_table = get_radio_table(concentration) where:
+        - concentration: Number of USRPs connected to each router
+        - radio_table: radio_table[X][Y][Z][radio_idx] is the global radio index
+                       of the local radio radio_idx of the router at (X,Y,Z)
+        """
+        if concentration not in cls.__radio_tables:
+            R = range(cls.DIM_SIZE)
+            cls.__radio_tables[concentration] = [[[
+                [cls.get_radio_num({'X':x,'Y':y,'Z':z}, u, concentration) for u in range(concentration)]
+                for z in R] for y in R] for x in R]
+        return cls.__radio_tables[concentration]
+
     @classmethod
     def get_portmap(cls, node_addr):
         """
@@ -365,7 +455,15 @@ class Topology_3D_4x4_FLB:
         - terminal_map: A single map that maps a dimension {X,Y,Z} to the starting
                         IO lane index for terminals (like USRPs) in that dimension.
                         A terminal is a leaf node in the network.
+        The maps are shared between calls and must not be modified.
         """
+        key = (node_addr['X'], node_addr['Y'], node_addr['Z'])
+        if key not in cls.__portmaps:
+            cls.__portmaps[key] = cls.__build_portmap(node_addr)
+        return cls.__portmaps[key]
+
+    @classmethod
+    def __build_portmap(cls, node_addr):
         router_map = dict()
         terminal_map = dict()
         # If "node_addr" is the address of the current FPGA in the (X,Y,Z) space,
@@ -442,11 +540,17 @@ class Topology_3D_4x4_FLB:
         CHANS_PER_USRP = 2  # How many radio channels does each USRP have
         ALL_CHANS = list(range(pow(DIM_WIDTH, 3) * NUM_USRPS * CHANS_PER_USRP))
 
+        # All connections are collected in an edge list and made at the end
+        edges = []
+        serdes_i = bee7fpga.serdes_i
+        serdes_o = bee7fpga.serdes_o
+        radio_table = cls.get_radio_table(NUM_USRPS)
+
         # Each FPGA will forward the sample stream from each USRP to all of its
         # X-axis neighbors
         for ri in router_map['X']:
             for li in range(MAX_USRPS):  # li = GT Lane index
-                bee7fpga.sim_core.connect(bee7fpga.serdes_i[base_usrp_lane + li], 0, bee7fpga.serdes_o[router_map['X'][ri] + li], 0)
+                edges.append((serdes_i[base_usrp_lane + li], 0, serdes_o[router_map['X'][ri] + li], 0))
 
         # Consequently, this FPGA will receive the USRP sample streams from each of
         # its X-axis neighbors. Define an internal bus to aggregate all the neighbor
@@ -458,19 +562,18 @@ class Topology_3D_4x4_FLB:
                 bee7fpga.int_samp_bus[(MAX_USRPS*i) + li] = rfnocsim.Channel(
                     bee7fpga.sim_core, '%s/_INT_SAMP_%02d' % (bee7fpga.name,(MAX_USRPS*i) + li))
                 ln_base = base_usrp_lane if i == fpga_addr['X'] else router_map['X'][i]
-                bee7fpga.sim_core.connect(bee7fpga.serdes_i[ln_base + li], 0, bee7fpga.int_samp_bus[(MAX_USRPS*i) + li], 0)
+                edges.append((serdes_i[ln_base + li], 0, bee7fpga.int_samp_bus[(MAX_USRPS*i) + li], 0))
 
         # Forward the X-axis aggregated sample streams to all Y-axis neighbors
         for ri in router_map['Y']:
             for li in range(DIM_WIDTH*DIM_WIDTH):  # li = GT Lane index
-                bee7fpga.sim_core.connect(bee7fpga.int_samp_bus[li], 0, bee7fpga.serdes_o[router_map['Y'][ri] + li], 0)
+                edges.append((bee7fpga.int_samp_bus[li], 0, serdes_o[router_map['Y'][ri] + li], 0))
 
         # What partial products will this FPGA compute?
         # Generate channel list to compute partial products
         pp_chans = list()
         for cg in range(DIM_WIDTH):     # cg = Channel group
-            for r in range(NUM_USRPS):
-                radio_num = cls.get_radio_num({'X':fpga_addr['X'], 'Y':fpga_addr['Y'], 'Z':cg}, r, NUM_USRPS)
+            for radio_num in radio_table[fpga_addr['X']][fpga_addr['Y']][cg]:
                 for ch in range(CHANS_PER_USRP):
                     pp_chans.append(radio_num*CHANS_PER_USRP + ch)
 
@@ -487,22 +590,22 @@ class Topology_3D_4x4_FLB:
                 for li in range(NUM_USRPS):
                     func_inln = (sg * DIM_WIDTH * NUM_USRPS) + (qi * NUM_USRPS) + li
                     if sg == fpga_addr['Y']:
-                        bee7fpga.sim_core.connect(bee7fpga.int_samp_bus[(qi * DIM_WIDTH) + li], 0,
-                            bee7fpga.func_pp_comp, func_inln)
+                        edges.append((bee7fpga.int_samp_bus[(qi * DIM_WIDTH) + li], 0,
+                            bee7fpga.func_pp_comp, func_inln))
                     else:
-                        bee7fpga.sim_core.connect(bee7fpga.serdes_i[router_map['Y'][sg] + (qi * DIM_WIDTH) + li], 0,
-                            bee7fpga.func_pp_comp, func_inln)
+                        edges.append((serdes_i[router_map['Y'][sg] + (qi * DIM_WIDTH) + li], 0,
+                            bee7fpga.func_pp_comp, func_inln))
 
         # Internal bus to hold aggregated partial products
         bee7fpga.pp_bus = dict()
         for i in range(DIM_WIDTH*NUM_USRPS):
             bee7fpga.pp_bus[i] = rfnocsim.Channel(bee7fpga.sim_core, '%s/_INT_PP_%02d' % (bee7fpga.name,i))
-            bee7fpga.sim_core.connect(bee7fpga.func_pp_comp, i, bee7fpga.pp_bus[i], 0)
+            edges.append((bee7fpga.func_pp_comp, i, bee7fpga.pp_bus[i], 0))
 
         # Forward partial products to Z-axis neighbors
         for ri in router_map['Z']:
             for li in range(NUM_USRPS):  # li = GT Lane index
-                bee7fpga.sim_core.connect(bee7fpga.pp_bus[ri*NUM_USRPS + li], 0, bee7fpga.serdes_o[router_map['Z'][ri] + li], 0)
+                edges.append((bee7fpga.pp_bus[ri*NUM_USRPS + li], 0, serdes_o[router_map['Z'][ri] + li], 0))
 
         # Instantiate partial product adder
         bee7fpga.func_pp_comb = dict()
@@ -517,17 +620,29 @@ class Topology_3D_4x4_FLB:
         for u in range(NUM_USRPS):
             for ri in range(DIM_WIDTH):
                 if ri in router_map['Z']:
-                    bee7fpga.sim_core.connect(bee7fpga.serdes_i[router_map['Z'][ri] + u], 0, bee7fpga.func_pp_comb[u], ri)
+                    edges.append((serdes_i[router_map['Z'][ri] + u], 0, bee7fpga.func_pp_comb[u], ri))
                 else:
-                    bee7fpga.sim_core.connect(bee7fpga.pp_bus[ri*NUM_USRPS + u], 0, bee7fpga.func_pp_comb[u], ri)
+                    edges.append((bee7fpga.pp_bus[ri*NUM_USRPS + u], 0, bee7fpga.func_pp_comb[u], ri))
 
         # Instantiate partial product adder
         for u in range(NUM_USRPS):
-            bee7fpga.sim_core.connect(bee7fpga.func_pp_comb[u], 0, bee7fpga.serdes_o[base_usrp_lane + u], 0)
+            edges.append((bee7fpga.func_pp_comb[u], 0, serdes_o[base_usrp_lane + u], 0))
 
         # Coefficient consumer
         bee7fpga.coeff_sink = rfnocsim.Consumer(bee7fpga.sim_core, bee7fpga.name + '/coeff_sink', 10e9/8, 0.0)
-        bee7fpga.sim_core.connect(bee7fpga.serdes_i[terminal_map['X'] + NUM_USRPS], 0, bee7fpga.coeff_sink, 0)
+        edges.append((serdes_i[terminal_map['X'] + NUM_USRPS], 0, bee7fpga.coeff_sink, 0))
+
+        bee7fpga.sim_core.connect_edges(edges)
+
+    @classmethod
+    def get_fpga_functions(cls):
+        """
+        Returns the functions that config_bitstream adds to each FPGA as a
+        list of (blade index, FPGA index, functions) without instantiating
+        them (see Topology_ND.get_fpga_functions)
+        """
+        funcs = [('computer', 32, 16, 2)] + [('combiner', 4)] * 2
+        return [(b, f, funcs) for b in range(16) for f in range(hw.Bee7Blade.NUM_FPGAS)]
 
     @classmethod
     def connect(cls, sim_core, usrps, bee7blades, hosts, app_settings):
@@ -547,47 +662,547 @@ class Topology_3D_4x4_FLB:
                 bee7row.append(blade)
             bee7grid.append(bee7row)
 
+        # All IO lane connections between blades, USRPs and hosts only depend
+        # on the FPGA address. Look up the precomputed port maps and radio numbers
+        # and make the connections in bulk.
+        radio_table = cls.get_radio_table(NUM_USRPS)
+        portmaps = [[[cls.get_portmap({'X':x,'Y':y,'Z':z}) for z in range(4)] for y in range(4)] for x in range(4)]
+        io_lane = hw.Bee7Blade.io_lane
+
         # USRP-Bee7 Connections
         # Blades across the diagonal are connected to USRPs
+        edges = []
         for x in range(4):
             for y in range(4):
                 for z in range(4):
+                    terminal_map = portmaps[x][y][z][1]
                     for u in range(NUM_USRPS):
-                        usrp_num = cls.get_radio_num({'X':x,'Y':y,'Z':z}, u, NUM_USRPS)
-                        (router_map, terminal_map) = cls.get_portmap({'X':x,'Y':y,'Z':z})
-                        sim_core.connect_bidir(
-                            usrps[usrp_num], 0,
-                            bee7grid[x][z], hw.Bee7Blade.io_lane(y, terminal_map['X'] + u), 'SAMP')
+                        usrp = usrps[radio_table[x][y][z][u]]
+                        lane = io_lane(y, terminal_map['X'] + u)
+                        edges.append((usrp, 0, bee7grid[x][z], lane))
+                        edges.append((bee7grid[x][z], lane, usrp, 0))
+        sim_core.connect_edges(edges, 'SAMP')
 
         # Bee7-Bee7 Connections
-        null_srcs = []
+        samp_edges = []
+        pp_edges = []
         for row in range(4):
             for col in range(4):
                 for fpga in range(4):
-                    (src_map, t) = cls.get_portmap({'X':row,'Y':fpga,'Z':col})
+                    src_map = portmaps[row][fpga][col][0]
                     for dst in range(4):
                         if row != dst:
-                            (dst_map, t) = cls.get_portmap({'X':dst,'Y':fpga,'Z':col})
-                            sim_core.connect_multi(
-                                bee7grid[row][col],
-                                list(range(hw.Bee7Blade.io_lane(fpga, src_map['X'][dst]), hw.Bee7Blade.io_lane(fpga, src_map['X'][dst]+4))),
-                                bee7grid[dst][col],
-                                list(range(hw.Bee7Blade.io_lane(fpga, dst_map['X'][row]), hw.Bee7Blade.io_lane(fpga, dst_map['X'][row]+4))),
-                                'SAMP')
+                            src_base = io_lane(fpga, src_map['X'][dst])
+                            dst_base = io_lane(fpga, portmaps[dst][fpga][col][0]['X'][row])
+                            for li in range(4):
+                                samp_edges.append((bee7grid[row][col], src_base + li, bee7grid[dst][col], dst_base + li))
                         if col != dst:
-                            (dst_map, t) = cls.get_portmap({'X':row,'Y':fpga,'Z':dst})
-                            sim_core.connect_multi(
-                                bee7grid[row][col],
-                                list(range(hw.Bee7Blade.io_lane(fpga, src_map['Z'][dst]), hw.Bee7Blade.io_lane(fpga, src_map['Z'][dst]+4))),
-                                bee7grid[row][dst],
-                                list(range(hw.Bee7Blade.io_lane(fpga, dst_map['Z'][col]), hw.Bee7Blade.io_lane(fpga, dst_map['Z'][col]+4))),
-                                'PP', 'blue')
+                            src_base = io_lane(fpga, src_map['Z'][dst])
+                            dst_base = io_lane(fpga, portmaps[row][fpga][dst][0]['Z'][col])
+                            for li in range(4):
+                                pp_edges.append((bee7grid[row][col], src_base + li, bee7grid[row][dst], dst_base + li))
+        sim_core.connect_edges(samp_edges, 'SAMP')
+        sim_core.connect_edges(pp_edges, 'PP', 'blue')
 
         # Host connection
+        edges = []
         for row in range(4):
             for col in range(4):
                 for fpga in range(4):
-                    (router_map, terminal_map) = cls.get_portmap({'X':row,'Y':row,'Z':col})
-                    sim_core.connect_bidir(
-                        hosts[row], col*4 + fpga,
-                        bee7grid[row][col], hw.Bee7Blade.io_lane(fpga, terminal_map['X'] + NUM_USRPS), 'COEFF', 'red')
+                    terminal_map = portmaps[row][row][col][1]
+                    lane = io_lane(fpga, terminal_map['X'] + NUM_USRPS)
+                    edges.append((hosts[row], col*4 + fpga, bee7grid[row][col], lane))
+                    edges.append((bee7grid[row][col], lane, hosts[row], col*4 + fpga))
+        sim_core.connect_edges(edges, 'COEFF', 'red')
+
+class Topology_ND:
+    """
+    A parameterized N-dimensional network of BEE7 FPGAs (routers).
+
+    Every router has an N-dimensional address with radix coordinates
+    per dimension and concentration USRPs attached to it. Radio samples
+    are broadcast along the first bcast_dims dimensions so that every
+    router sees all samples of its broadcast plane. Each router computes
+    the partial products of those samples on all radios that share its
+    broadcast coordinates. The partial products are then reduced along
+    the remaining dimensions (one dimension per stage) until every router
+    holds the TX samples for its own USRPs.
+
+    Two kinds of networks are supported:
+    - flb: Flattened butterfly. Every router is directly connected to all
+      routers that differ from it in one coordinate.
+    - torus: Every router is connected to its two ring neighbors in each
+      dimension. Samples are relayed around the ring and partial products
+      are accumulated along the way.
+
+    Routers are packed into blades (4 FPGAs each) with the blade_dim
+    coordinate varying fastest. Neighbors in the same blade use the
+    internal IO lanes, all other links use lanes_per_link external IO
+    lanes (a single value or one per dimension). Each stream needs its
+    own IO lane, so a SimCompError is raised if a link is too narrow or
+    an FPGA runs out of IO lanes.
+
+    Args:
+        kind: Network kind (flb or torus)
+        dims: Number of dimensions
+        radix: Number of routers along each dimension
+        concentration: Number of USRPs connected to each router
+        lanes_per_link: Number of external IO lanes per link
+        bcast_dims: Number of dimensions used to broadcast samples
+        blade_dim: Dimension that is mapped to the inside of a blade
+    """
+    KINDS = ['flb', 'torus']
+    CHANS_PER_USRP = 2  # How many radio channels does each USRP have
+
+    def __init__(self, kind='flb', dims=3, radix=4, concentration=2, lanes_per_link=4,
+                 bcast_dims=None, blade_dim=None):
+        if kind not in self.KINDS:
+            raise RuntimeError('Invalid topology kind: ' + kind)
+        if bcast_dims is None:
+            bcast_dims = (dims + 1) // 2
+        if blade_dim is None:
+            blade_dim = bcast_dims - 1
+        if dims < 2 or not (1 <= bcast_dims < dims):
+            raise RuntimeError('Need at least one broadcast and one reduction dimension')
+        if radix < 2:
+            raise RuntimeError('The radix must be at least 2')
+        if not isinstance(lanes_per_link, (list, tuple)):
+            lanes_per_link = [lanes_per_link] * dims
+        if len(lanes_per_link) != dims:
+            raise RuntimeError('lanes_per_link must have one value per dimension')
+        self.kind = kind
+        self.dims = dims
+        self.radix = radix
+        self.concentration = concentration
+        self.lanes_per_link = list(lanes_per_link)
+        self.bcast_dims = list(range(bcast_dims))
+        self.reduce_dims = list(range(bcast_dims, dims))
+        self.blade_dim = blade_dim
+        # Ring neighbors are reached by relaying through at most this many
+        # routers in the +1 (plus) and -1 (minus) direction
+        self.__hops = (radix // 2, radix - 1 - (radix // 2))
+        # Routers are enumerated in address order (last dimension varies fastest)
+        self.__addrs = list(itertools.product(range(radix), repeat=dims))
+        self.__index = dict((a, i) for (i, a) in enumerate(self.__addrs))
+        # Place routers in blades with the blade dimension varying fastest
+        place_order = [d for d in range(dims) if d != blade_dim] + [blade_dim]
+        self.__location = dict()
+        for (p, a) in enumerate(sorted(self.__addrs, key=lambda a: [a[d] for d in place_order])):
+            self.__location[a] = divmod(p, hw.Bee7Blade.NUM_FPGAS)
+        self.__portmaps = dict()
+        for a in self.__addrs:
+            self.__portmaps[a] = self.__build_portmap(a)
+
+    def get_num_routers(self):
+        return len(self.__addrs)
+
+    def get_num_usrps(self):
+        return len(self.__addrs) * self.concentration
+
+    def get_num_blades(self):
+        return -(-len(self.__addrs) // hw.Bee7Blade.NUM_FPGAS)
+
+    def get_num_hosts(self, switch_ports):
+        return -(-len(self.__addrs) // switch_ports)
+
+    def get_addrs(self):
+        return list(self.__addrs)
+
+    def get_location(self, addr):
+        """
+        Returns the (blade index, FPGA index) of the router at addr
+        """
+        return self.__location[tuple(addr)]
+
+    def get_radio_num(self, addr, radio_idx):
+        """
+        Returns the global index of the local radio (USRP) radio_idx of
+        the router at addr
+        """
+        return self.__index[tuple(addr)] * self.concentration + radio_idx
+
+    def get_neighbors(self, addr, dim):
+        """
+        Returns the coordinates of all routers along dim that the router
+        at addr is directly connected to
+        """
+        here = addr[dim]
+        if self.kind == 'flb':
+            return [c for c in range(self.radix) if c != here]
+        return sorted(set([(here + 1) % self.radix, (here - 1) % self.radix]))
+
+    def get_portmap(self, addr):
+        """
+        Returns the router and terminal connections for a router
+
+        (router_map, terminal_lane) = get_portmap(addr) where:
+        - addr: Address of the router
+        - router_map: router_map[dim][coord] is the first FPGA IO lane of the link
+                      to the neighbor along dim with coordinate coord
+        - terminal_lane: The first FPGA IO lane for USRPs. The lane that follows
+                         the USRPs is connected to the management host.
+        The maps are shared between calls and must not be modified.
+        """
+        return self.__portmaps[tuple(addr)]
+
+    def __build_portmap(self, addr):
+        (blade, fpga) = self.__location[addr]
+        ext = hw.Bee7Fpga.EXT_IO_LANES
+        terminal_lane = ext[hw.Bee7Fpga.BP_BASE]
+        # External links are allocated from the front panel lanes first and
+        # then from the backplane lanes that are not used by terminals
+        regions = [[ext[hw.Bee7Fpga.FP_BASE], ext[hw.Bee7Fpga.FP_BASE] + hw.Bee7Fpga.FP_LANES],
+                   [terminal_lane + self.concentration + 1, terminal_lane + hw.Bee7Fpga.BP_LANES]]
+        if regions[1][0] > regions[1][1]:
+            raise RuntimeError('Not enough IO lanes for %d USRPs per router' % (self.concentration))
+        router_map = []
+        for dim in range(self.dims):
+            router_map.append(dict())
+            for coord in self.get_neighbors(addr, dim):
+                peer = self.__location[self.__move(addr, dim, coord)]
+                if peer[0] == blade:
+                    router_map[dim][coord] = hw.Bee7Blade.int_io_lanes(fpga, peer[1])[0]
+                    continue
+                width = self.lanes_per_link[dim]
+                for region in regions:
+                    if region[0] + width <= region[1]:
+                        router_map[dim][coord] = region[0]
+                        region[0] += width
+                        break
+                else:
+                    raise RuntimeError('Router %s has run out of external IO lanes' % (str(addr)))
+        return (router_map, terminal_lane)
+
+    def __get_link_width(self, addr, dim, coord):
+        peer = self.__location[self.__move(addr, dim, coord)]
+        if peer[0] == self.__location[addr][0]:
+            return len(hw.Bee7Fpga.EW_IO_LANES)
+        return self.lanes_per_link[dim]
+
+    @staticmethod
+    def __move(addr, dim, coord):
+        return addr[:dim] + (coord,) + addr[dim+1:]
+
+    def __span(self, addr, dims):
+        """
+        Returns all addresses that only differ from addr along dims
+        """
+        addrs = [addr]
+        for d in dims:
+            addrs = [self.__move(a, d, c) for a in addrs for c in range(self.radix)]
+        return sorted(addrs)
+
+    def __keys(self, addrs):
+        return [(a, u) for a in addrs for u in range(self.concentration)]
+
+    def __bcast_keys(self, addr, stage, coord):
+        """
+        Returns the sample streams (keys) that the router at addr forwards
+        to its neighbor at coord during a broadcast stage
+        """
+        dim = self.bcast_dims[stage]
+        prev_dims = self.bcast_dims[:stage]
+        if self.kind == 'flb':
+            return self.__keys(self.__span(addr, prev_dims))
+        origins = []
+        here = addr[dim]
+        (plus_hops, minus_hops) = self.__hops
+        if coord == (here + 1) % self.radix:
+            origins += [(here - i) % self.radix for i in range(plus_hops)]
+        if coord == (here - 1) % self.radix:
+            origins += [(here + i) % self.radix for i in range(minus_hops)]
+        addrs = []
+        for o in origins:
+            addrs += self.__span(self.__move(addr, dim, o), prev_dims)
+        return self.__keys(sorted(addrs))
+
+    def __reduce_keys(self, addr, stage, coord):
+        """
+        Returns the partial products (keys) that the router at addr forwards
+        to its neighbor at coord during a reduction stage
+        """
+        dim = self.reduce_dims[stage]
+        keys = self.__keys(self.__span(addr, self.reduce_dims[stage:]))
+        if self.kind == 'flb':
+            return [k for k in keys if k[0][dim] == coord]
+        here = addr[dim]
+        (plus_hops, minus_hops) = self.__hops
+        fwd_keys = []
+        for k in keys:
+            dist = (k[0][dim] - here) % self.radix
+            if coord == (here + 1) % self.radix and 1 <= dist <= plus_hops:
+                fwd_keys.append(k)
+            elif coord == (here - 1) % self.radix and 1 <= self.radix - dist <= minus_hops:
+                fwd_keys.append(k)
+        return fwd_keys
+
+    def __link(self, bee7fpga, addr, dim, coord, send_keys, recv_keys, sources, edges):
+        """
+        Sends the send_keys streams from sources over the link to the neighbor
+        at coord and returns a map of the recv_keys streams that come back
+        """
+        lane = self.get_portmap(addr)[0][dim][coord]
+        width = self.__get_link_width(addr, dim, coord)
+        if max(len(send_keys), len(recv_keys)) > width:
+            raise bee7fpga.SimCompError('The link to %s needs %d IO lanes but only has %d' %
+                (str(self.__move(addr, dim, coord)), max(len(send_keys), len(recv_keys)), width))
+        for (slot, k) in enumerate(send_keys):
+            edges.append(sources[k] + (bee7fpga.serdes_o[lane + slot], 0))
+        return dict((k, (bee7fpga.serdes_i[lane + slot], 0)) for (slot, k) in enumerate(recv_keys))
+
+    def __check_link(self, addr, dim, coord, send_keys, recv_keys):
+        width = self.__get_link_width(addr, dim, coord)
+        if max(len(send_keys), len(recv_keys)) > width:
+            raise RuntimeError('The link from %s to %s needs %d IO lanes but only has %d' %
+                (str(addr), str(self.__move(addr, dim, coord)), max(len(send_keys), len(recv_keys)), width))
+
+    def get_fpga_functions(self):
+        """
+        Returns the functions that config_bitstream adds to each FPGA without
+        instantiating them. This is enough to estimate the FPGA resources
+        of the network without building it.
+
+        Returns a list of (blade index, FPGA index, functions) for every FPGA
+        of every blade where functions is a list of
+        ('computer', size, num_dst_chans, items_per_stream) and ('combiner', radix)
+        tuples. Raises a RuntimeError if a link is too narrow.
+        """
+        routers = dict((loc, a) for (a, loc) in self.__location.items())
+        fpga_funcs = []
+        for b in range(self.get_num_blades()):
+            for f in range(hw.Bee7Blade.NUM_FPGAS):
+                addr = routers.get((b, f))
+                fpga_funcs.append((b, f, self.__get_functions(addr) if addr else []))
+        return fpga_funcs
+
+    def __get_functions(self, addr):
+        # Mirrors the stages of config_bitstream
+        samp_keys = set(self.__keys([addr]))
+        for (stage, dim) in enumerate(self.bcast_dims):
+            for coord in self.get_neighbors(addr, dim):
+                recv_keys = self.__bcast_keys(self.__move(addr, dim, coord), stage, addr[dim])
+                self.__check_link(addr, dim, coord, self.__bcast_keys(addr, stage, coord), recv_keys)
+                samp_keys.update(recv_keys)
+        pp_keys = self.__keys(self.__span(addr, self.reduce_dims))
+        funcs = [('computer', len(samp_keys), len(pp_keys) * self.CHANS_PER_USRP, self.CHANS_PER_USRP)]
+
+        for (stage, dim) in enumerate(self.reduce_dims):
+            here = addr[dim]
+            neighbors = self.get_neighbors(addr, dim)
+            received = dict()
+            for coord in neighbors:
+                received[coord] = set(self.__reduce_keys(self.__move(addr, dim, coord), stage, here))
+                self.__check_link(addr, dim, coord, self.__reduce_keys(addr, stage, coord), received[coord])
+            for k in pp_keys:
+                dist = (k[0][dim] - here) % self.radix
+                if self.kind == 'flb':
+                    radix = self.radix if dist == 0 else 0
+                elif dist == 0:
+                    radix = 1 + len([c for c in neighbors if k in received[c]])
+                elif dist <= self.__hops[0]:
+                    radix = 1 + int(k in received[(here - 1) % self.radix])
+                else:
+                    radix = 1 + int(k in received[(here + 1) % self.radix])
+                if radix > 1:
+                    funcs.append(('combiner', radix))
+            pp_keys = [k for k in pp_keys if k[0][dim] == here]
+        return funcs
+
+    def config_bitstream(self, bee7fpga, app_settings, addr):
+        """
+        Defines the FPGA behavior for the current FPGA. This function will make
+        create the necessary simulation functions, connect them to IO lanes and
+        define the various utilization metrics for the image.
+
+        config_bitstream(bee7fpga, app_settings, addr):
+        - bee7fpga: The FPGA simulation object being configured
+        - app_settings: Application information
+        - addr: Address of the router
+        """
+        addr = tuple(addr)
+        (router_map, terminal_lane) = self.get_portmap(addr)
+        all_chans = list(range(self.get_num_usrps() * self.CHANS_PER_USRP))
+        edges = []
+        # Streams are tracked as (component, port) sources keyed by
+        # (router address, USRP index) of the radio they belong to
+
+        # Broadcast samples one dimension at a time. After each stage, this
+        # router has the samples of all routers in the plane spanned by the
+        # dimensions so far. In a torus, some of the received samples are
+        # relayed to the next router.
+        samps = dict(((addr, u), (bee7fpga.serdes_i[terminal_lane + u], 0))
+            for u in range(self.concentration))
+        for (stage, dim) in enumerate(self.bcast_dims):
+            neighbors = self.get_neighbors(addr, dim)
+            received = dict()
+            for coord in neighbors:
+                received.update(self.__link(bee7fpga, addr, dim, coord, [],
+                    self.__bcast_keys(self.__move(addr, dim, coord), stage, addr[dim]), None, edges))
+            samps.update(received)
+            for coord in neighbors:
+                self.__link(bee7fpga, addr, dim, coord,
+                    self.__bcast_keys(addr, stage, coord), [], samps, edges)
+
+        # Compute partial products of the samples on all radios that share the
+        # broadcast coordinates of this router
+        samp_keys = sorted(samps.keys())
+        pp_keys = self.__keys(self.__span(addr, self.reduce_dims))
+        pp_chans = []
+        for (a, u) in pp_keys:
+            radio_num = self.get_radio_num(a, u)
+            pp_chans += [radio_num*self.CHANS_PER_USRP + ch for ch in range(self.CHANS_PER_USRP)]
+        bee7fpga.func_pp_comp = PartialContribComputer(
+            sim_core=bee7fpga.sim_core, name=bee7fpga.name+'/pp_computer/', size=len(samp_keys),
+            dst_chans=pp_chans, items_per_stream=self.CHANS_PER_USRP, app_settings=app_settings)
+        bee7fpga.add_function(bee7fpga.func_pp_comp)
+        for (i, k) in enumerate(samp_keys):
+            edges.append(samps[k] + (bee7fpga.func_pp_comp, i))
+        pps = dict((k, (bee7fpga.func_pp_comp, i)) for (i, k) in enumerate(pp_keys))
+
+        # Reduce partial products one dimension at a time. After each stage, this
+        # router only has the partial products for radios that share its address
+        # in the dimensions so far.
+        bee7fpga.func_pp_comb = dict()
+        def combine(inputs):
+            func = PartialContribCombiner(
+                sim_core=bee7fpga.sim_core, name=bee7fpga.name + '/pp_combiner_%d/'%(len(bee7fpga.func_pp_comb)),
+                radix=len(inputs), app_settings=app_settings, reducer_filter=(all_chans, 'tx'),
+                items_per_stream=self.CHANS_PER_USRP)
+            bee7fpga.func_pp_comb[len(bee7fpga.func_pp_comb)] = func
+            bee7fpga.add_function(func)
+            for (i, src) in enumerate(inputs):
+                edges.append(src + (func, i))
+            return (func, 0)
+
+        for (stage, dim) in enumerate(self.reduce_dims):
+            here = addr[dim]
+            received = dict()
+            partials = dict()
+            if self.kind == 'flb':
+                for coord in self.get_neighbors(addr, dim):
+                    received[coord] = self.__link(bee7fpga, addr, dim, coord,
+                        self.__reduce_keys(addr, stage, coord),
+                        self.__reduce_keys(self.__move(addr, dim, coord), stage, here),
+                        pps, edges)
+                for k in sorted(pps.keys()):
+                    if k[0][dim] == here:
+                        partials[k] = combine([pps[k] if c == here else received[c][k]
+                            for c in range(self.radix)])
+            else:
+                # Partial products travel around the ring towards their
+                # destination and accumulate the contribution of every router
+                # they pass through
+                (plus_hops, minus_hops) = self.__hops
+                plus = (here + 1) % self.radix
+                minus = (here - 1) % self.radix
+                neighbors = self.get_neighbors(addr, dim)
+                for coord in neighbors:
+                    received[coord] = self.__link(bee7fpga, addr, dim, coord, [],
+                        self.__reduce_keys(self.__move(addr, dim, coord), stage, here), None, edges)
+                outgoing = dict()
+                for k in sorted(pps.keys()):
+                    dist = (k[0][dim] - here) % self.radix
+                    inputs = [pps[k]]
+                    if dist == 0:
+                        inputs += [received[c][k] for c in neighbors if k in received[c]]
+                    elif dist <= plus_hops:
+                        inputs += [received[minus][k]] if k in received[minus] else []
+                    else:
+                        inputs += [received[plus][k]] if k in received[plus] else []
+                    src = combine(inputs) if len(inputs) > 1 else inputs[0]
+                    if dist == 0:
+                        partials[k] = src
+                    else:
+                        outgoing[k] = src
+                for coord in neighbors:
+                    self.__link(bee7fpga, addr, dim, coord,
+                        self.__reduce_keys(addr, stage, coord), [], outgoing, edges)
+            pps = partials
+
+        # Send TX samples back to the USRPs
+        for u in range(self.concentration):
+            edges.append(pps[(addr, u)] + (bee7fpga.serdes_o[terminal_lane + u], 0))
+
+        # Coefficient consumer
+        bee7fpga.coeff_sink = rfnocsim.Consumer(bee7fpga.sim_core, bee7fpga.name + '/coeff_sink', 10e9/8, 0.0)
+        edges.append((bee7fpga.serdes_i[terminal_lane + self.concentration], 0, bee7fpga.coeff_sink, 0))
+
+        bee7fpga.sim_core.connect_edges(edges)
+
+    def connect(self, sim_core, usrps, bee7blades, hosts, app_settings):
+        if len(usrps) < self.get_num_usrps() or len(bee7blades) < self.get_num_blades():
+            raise RuntimeError('The network needs %d USRPs and %d BEE7 blades' %
+                (self.get_num_usrps(), self.get_num_blades()))
+        switch_ports = -(-self.get_num_routers() // len(hosts))
+        io_lane = hw.Bee7Blade.io_lane
+        samp_edges = []
+        link_edges = [[] for d in range(self.dims)]
+        coeff_edges = []
+        for addr in self.__addrs:
+            (b, f) = self.__location[addr]
+            blade = bee7blades[b]
+            self.config_bitstream(blade.fpgas[f], app_settings, addr)
+            (router_map, terminal_lane) = self.get_portmap(addr)
+
+            # USRP-Bee7 Connections
+            for u in range(self.concentration):
+                usrp = usrps[self.get_radio_num(addr, u)]
+                lane = io_lane(f, terminal_lane + u)
+                samp_edges.append((usrp, 0, blade, lane))
+                samp_edges.append((blade, lane, usrp, 0))
+
+            # Bee7-Bee7 Connections (the internal ones are part of the blade)
+            for dim in range(self.dims):
+                for (coord, lane) in sorted(router_map[dim].items()):
+                    peer = self.__move(addr, dim, coord)
+                    (pb, pf) = self.__location[peer]
+                    if pb == b:
+                        continue
+                    peer_lane = self.get_portmap(peer)[0][dim][addr[dim]]
+                    for i in range(self.lanes_per_link[dim]):
+                        link_edges[dim].append((blade, io_lane(f, lane + i),
+                            bee7blades[pb], io_lane(pf, peer_lane + i)))
+
+            # Host connection
+            (h, port) = divmod(self.__index[addr], switch_ports)
+            lane = io_lane(f, terminal_lane + self.concentration)
+            coeff_edges.append((hosts[h], port, blade, lane))
+            coeff_edges.append((blade, lane, hosts[h], port))
+
+        sim_core.connect_edges(samp_edges, 'SAMP')
+        for dim in range(self.dims):
+            if dim in self.bcast_dims:
+                sim_core.connect_edges(link_edges[dim], 'SAMP')
+            else:
+                sim_core.connect_edges(link_edges[dim], 'PP', 'blue')
+        sim_core.connect_edges(coeff_edges, 'COEFF', 'red')
+
+def estimate_fpga_utilization(topology, app_settings):
+    """
+    Estimates the resource utilization of every BEE7 FPGA in a topology
+    without building the network. Returns a dict of {fpga_name: {attr: util}}
+    that matches the utilization reported by the built FPGAs.
+    """
+    max_rsrcs = hw.Bee7Fpga.get_max_resources()
+    comp_rsrcs = dict()
+    comb_rsrcs = dict()
+    utilization = dict()
+    for (blade, fpga, funcs) in topology.get_fpga_functions():
+        rsrcs = hw.Bee7Fpga.get_base_resources()
+        for func in funcs:
+            # Many functions are identical so their resources are only computed once
+            if func[0] == 'computer':
+                if func not in comp_rsrcs:
+                    (size, num_dst_chans, items_per_stream) = func[1:]
+                    comp_rsrcs[func] = PartialContribComputer.get_resources(
+                        size*items_per_stream, num_dst_chans, app_settings,
+                        PartialContribComputer.get_sync_buff_depth(app_settings)*size)
+                rsrcs.merge(comp_rsrcs[func])
+            else:
+                if func not in comb_rsrcs:
+                    comb_rsrcs[func] = PartialContribCombiner.get_resources(
+                        func[1], PartialContribCombiner.get_sync_buff_depth(app_settings))
+                rsrcs.merge(comb_rsrcs[func])
+        utilization[hw.Bee7Blade.get_fpga_name(blade, fpga)] = dict(
+            (a, rsrcs.get(a) / max_rsrcs.get(a)) for a in max_rsrcs.get_attrs())
+    return utilization
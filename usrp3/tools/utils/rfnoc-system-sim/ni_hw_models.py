@@ -116,34 +116,53 @@ class Bee7Fpga(rfnocsim.SimComp):
     ELASTIC_BUFF_FULLNESS = 0.5
     BRAM_BYTES = 18e3/8
 
+    MAX_IO = 80
+    # Each SERDES needs to have some buffering. We assume elastic buffering (50% full on avg).
+    IO_BUFF_SIZE = (IO_LN_BW * IO_LN_LATENCY) / ELASTIC_BUFF_FULLNESS
+
     def __init__(self, sim_core, name):
         self.sim_core = sim_core
         rfnocsim.SimComp.__init__(self, sim_core, name, rfnocsim.comptype.hardware)
-        # Max resources from Virtex7 datasheet
-        self.max_resources = rfnocsim.HwRsrcs()
-        self.max_resources.add('DSP', 3600)
-        self.max_resources.add('BRAM_18kb', 2940)
-        self.resources = rfnocsim.HwRsrcs()
+        self.max_resources = self.get_max_resources()
+        self.resources = self.get_base_resources()
         # Each FPGA has 80 SERDES lanes
-        self.max_io = 80
+        self.max_io = self.MAX_IO
         self.serdes_i = dict()
         self.serdes_o = dict()
         # Each lane can carry at most 10GB/s
-        # Each SERDES needs to have some buffering. We assume elastic buffering (50% full on avg).
-        io_buff_size = (self.IO_LN_BW * self.IO_LN_LATENCY) / self.ELASTIC_BUFF_FULLNESS
         # Worst case lane latency
         lane_latency = self.IO_LN_LATENCY * self.get_tick_rate()
+        # If the simulator is packetized, packets queue up in the elastic buffer
         for i in range(self.max_io):
-            self.serdes_i[i] = rfnocsim.Channel(sim_core, self.__ioln_name(i)+'/I', self.IO_LN_BW, lane_latency / 2)
-            self.serdes_o[i] = rfnocsim.Channel(sim_core, self.__ioln_name(i)+'/O', self.IO_LN_BW, lane_latency / 2)
-            self.resources.add('BRAM_18kb', 1 + math.ceil(io_buff_size / self.BRAM_BYTES))  #input buffering per lane
-            self.resources.add('BRAM_18kb', 1)                                          #output buffering per lane
-        # Other resources
-        self.resources.add('BRAM_18kb', 72)     # BPS infrastructure + microblaze
-        self.resources.add('BRAM_18kb', 128)    # 2 MIGs
+            self.serdes_i[i] = rfnocsim.Channel(sim_core, self.__ioln_name(i)+'/I', self.IO_LN_BW, lane_latency / 2,
+                                                buff_size=self.IO_BUFF_SIZE)
+            self.serdes_o[i] = rfnocsim.Channel(sim_core, self.__ioln_name(i)+'/O', self.IO_LN_BW, lane_latency / 2,
+                                                buff_size=self.IO_BUFF_SIZE)
 
         self.functions = dict()
 
+    @staticmethod
+    def get_max_resources():
+        # Max resources from Virtex7 datasheet
+        rsrcs = rfnocsim.HwRsrcs()
+        rsrcs.add('DSP', 3600)
+        rsrcs.add('BRAM_18kb', 2940)
+        return rsrcs
+
+    @classmethod
+    def get_base_resources(cls):
+        """
+        Returns the resources used by an FPGA before any functions are added
+        """
+        rsrcs = rfnocsim.HwRsrcs()
+        for i in range(cls.MAX_IO):
+            rsrcs.add('BRAM_18kb', 1 + math.ceil(cls.IO_BUFF_SIZE / cls.BRAM_BYTES))    #input buffering per lane
+            rsrcs.add('BRAM_18kb', 1)                                                   #output buffering per lane
+        # Other resources
+        rsrcs.add('BRAM_18kb', 72)     # BPS infrastructure + microblaze
+        rsrcs.add('BRAM_18kb', 128)    # 2 MIGs
+        return rsrcs
+
     def inputs(self, i, bind=False):
         return self.serdes_i[i].inputs(0, bind)
 
@@ -190,15 +209,15 @@ class Bee7Blade(rfnocsim.SimComp):
     NE_FPGA = 1
     SW_FPGA = 2
     SE_FPGA = 3
+    FPGA_NAMES = ['FPGA_NW', 'FPGA_NE', 'FPGA_SW', 'FPGA_SE']
 
     def __init__(self, sim_core, index):
         self.sim_core = sim_core
         self.name = name='BEE7_%03d' % (index)
         # Add FPGAs
-        names = ['FPGA_NW', 'FPGA_NE', 'FPGA_SW', 'FPGA_SE']
         self.fpgas = []
         for i in range(self.NUM_FPGAS):
-            self.fpgas.append(Bee7Fpga(sim_core, name + '/' + names[i]))
+            self.fpgas.append(Bee7Fpga(sim_core, self.get_fpga_name(index, i)))
         # Build a fully connected network of FPGA
         # 4 FPGAs x 3 Links x 2 directions = 12 connections
         self.sim_core.connect_multi_bidir(
@@ -222,11 +241,32 @@ class Bee7Blade(rfnocsim.SimComp):
         IO_PER_FPGA = len(Bee7Fpga.EXT_IO_LANES)
         self.fpgas[int(i/IO_PER_FPGA)].connect(Bee7Fpga.EXT_IO_LANES[i%IO_PER_FPGA], dest)
 
+    @classmethod
+    def get_fpga_name(cls, index, fpga):
+        return 'BEE7_%03d/%s' % (index, cls.FPGA_NAMES[fpga])
+
     @staticmethod
     def io_lane(fpga, fpga_lane):
         IO_PER_FPGA = len(Bee7Fpga.EXT_IO_LANES)
         return (fpga_lane - Bee7Fpga.EXT_IO_LANES[0]) + (fpga * IO_PER_FPGA)
 
+    @staticmethod
+    def int_io_lanes(fpga, peer):
+        """
+        Returns the FPGA IO lanes that connect fpga to peer within the blade
+        0 - 1
+        | X |
+        2 - 3
+        """
+        if fpga == peer:
+            raise RuntimeError('An FPGA is not connected to itself')
+        if (fpga ^ peer) == 1:
+            return Bee7Fpga.EW_IO_LANES
+        elif (fpga ^ peer) == 2:
+            return Bee7Fpga.NS_IO_LANES
+        else:
+            return Bee7Fpga.XX_IO_LANES
+
 class ManagementHostandSwitch(rfnocsim.SimComp):
     """
     Simulation model for a management host computer
@@ -16,14 +16,36 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import array
 import collections
 import copy
+import csv
+import fnmatch
+import functools
+import gc
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import random
 import re
+import shutil
+import sys
+import timeit
+import types
 import math
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
-from graphviz import Digraph
+from graphviz import Digraph, Source, ExecutableNotFound
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 
 #------------------------------------------------------------
 # Simulator Core Components
@@ -39,23 +61,874 @@ class comptype():
     hardware = 'Hardware'
     other    = 'Other'
 
+# Latencies are fixed-point numbers of ticks with TICK_FRAC_BITS fractional
+# bits. They are stored as floats but sums of fixed-point values are exact
+# (up to 2^(53-TICK_FRAC_BITS) ticks), so latencies accumulated over many
+# hops do not drift and do not depend on the order they were added in.
+# Producer rates (samples per tick) are fixed-point numbers in the same way
+# so that byte counts are exact however many ticks they are summed over.
+TICK_FRAC_BITS = 16
+
+def fixed_ticks(ticks):
+    """
+    Returns ticks rounded to the nearest fixed-point number of ticks
+    """
+    if math.isinf(ticks) or math.isnan(ticks):
+        return ticks
+    scale = float(1 << TICK_FRAC_BITS)
+    return math.floor(ticks * scale + 0.5) / scale
+
+def fixed_count(count):
+    """
+    Returns count rounded to the nearest fixed-point number of samples.
+    Nonzero counts are never rounded down to zero.
+    """
+    fixed = fixed_ticks(count)
+    if fixed == 0 and count > 0:
+        return 1.0 / (1 << TICK_FRAC_BITS)
+    return fixed
+
+class ComponentIndex():
+    """
+    Component Name Index:
+    Indexes component names by type and in a trie keyed on the '/'
+    separated levels of the name hierarchy. Queries only visit the
+    part of the trie that can match the literal prefix of the query.
+    Compiled name filters are cached. Names are added to the trie in
+    batches, on the first query after they were registered, so that
+    building a network doesn't pay for the trie one name at a time.
+    """
+    SEP = '/'
+    REGEX_META = '.^$*+?{}[]\\|()'
+
+    class Node(object):
+        __slots__ = ['children', 'names']
+
+        def __init__(self):
+            self.children = dict()
+            self.names = []     # Names that end at this node
+
+    def __init__(self):
+        self.__root = self.Node()
+        self.__types = dict()
+        self.__names_by_type = dict()
+        self.__filters = dict()
+        self.__pending = []
+
+    def add(self, name, ctype):
+        self.__pending.append((name, ctype))
+
+    def __flush(self):
+        pending = self.__pending
+        if not pending:
+            return
+        self.__pending = []
+        root = self.__root
+        Node = self.Node
+        sep = self.SEP
+        for (name, ctype) in pending:
+            node = root
+            for seg in name.split(sep):
+                child = node.children.get(seg)
+                if child is None:
+                    child = node.children[seg] = Node()
+                node = child
+            node.names.append(name)
+        self.__types.update(pending)
+        names_by_type = self.__names_by_type
+        for (name, ctype) in pending:
+            names = names_by_type.get(ctype)
+            if names is None:
+                names = names_by_type[ctype] = []
+            names.append(name)
+
+    def find(self, ctype='', name_filt=''):
+        """
+        Returns all names that match the regular expression name_filt
+        (from the beginning of the name) and are of type ctype
+        """
+        self.__flush()
+        (regex, prefix) = self.__get_filter(name_filt)
+        if ctype and not prefix:
+            return [n for n in self.__names_by_type.get(ctype, []) if regex.match(n)]
+        segs = prefix.split(self.SEP)
+        partial = segs.pop()
+        node = self.__node(segs)
+        if node is None:
+            return []
+        names = []
+        for (seg, child) in node.children.items():
+            if seg.startswith(partial):
+                self.__collect(child, names)
+        return [n for n in names if (not ctype or self.__types[n] == ctype) and regex.match(n)]
+
+    def glob(self, pattern, ctype=''):
+        """
+        Returns all names at or below the levels matched by a glob
+        pattern (ex: BEE7_010/FPGA_NW/SER_EW_*) that are of type ctype
+        """
+        self.__flush()
+        nodes = [self.__root]
+        for seg in pattern.split(self.SEP):
+            next_nodes = []
+            for node in nodes:
+                if any(c in seg for c in '*?['):
+                    next_nodes.extend(child for (key, child) in node.children.items()
+                        if fnmatch.fnmatchcase(key, seg))
+                elif seg in node.children:
+                    next_nodes.append(node.children[seg])
+            nodes = next_nodes
+        names = []
+        for node in nodes:
+            self.__collect(node, names)
+        return [n for n in names if not ctype or self.__types[n] == ctype]
+
+    def __node(self, segs):
+        node = self.__root
+        for seg in segs:
+            node = node.children.get(seg)
+            if node is None:
+                return None
+        return node
+
+    def __collect(self, node, names):
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            names.extend(n.names)
+            stack.extend(n.children.values())
+
+    def __get_filter(self, name_filt):
+        filt = self.__filters.get(name_filt)
+        if filt is None:
+            filt = (re.compile(name_filt), self.__literal_prefix(name_filt))
+            self.__filters[name_filt] = filt
+        return filt
+
+    def __literal_prefix(self, name_filt):
+        # Alternations can match anything. Don't bother.
+        if '|' in name_filt:
+            return ''
+        for i in range(len(name_filt)):
+            if name_filt[i] in self.REGEX_META:
+                # A quantifier makes the last literal character optional
+                if name_filt[i] in '*?{' and i > 0:
+                    return name_filt[:i-1]
+                return name_filt[:i]
+        return name_filt
+
+class UtilizationDb():
+    """
+    Utilization Database:
+    Holds the byte count, bandwidth limit and latency of every bandwidth
+    limited component (producers, consumers and channels), indexed by a
+    dense component ID, so that utilization can be computed for all of
+    them in a single vectorized expression. Byte counts are updated on
+    every push so they live in a flat list (scalar writes to a NumPy array
+    are much slower) and are converted to an array on every query.
+
+    If interval is non-zero, the byte counts are also sampled every
+    interval ticks to produce utilization time series.
+    """
+
+    def __init__(self, tick_rate, interval=0):
+        self.__tick_rate = tick_rate
+        self.__names = list()
+        self.__ids = dict()
+        self.__byte_counts = list()
+        self.__bw = list()
+        self.__latency = list()
+        self.__limits = None
+        self.__interval = interval
+        self.__next_sample = interval if interval > 0 else float('inf')
+        self.__sample_ticks = [0] if interval > 0 else []
+        self.__samples = [np.zeros(0)] if interval > 0 else []
+        self.__coalesce_start = None
+
+    def __len__(self):
+        return len(self.__names)
+
+    def add(self, name, bw, latency):
+        comp_id = len(self.__names)
+        self.__names.append(name)
+        self.__ids[name] = comp_id
+        self.__byte_counts.append(0)
+        self.__bw.append(bw)
+        self.__latency.append(latency)
+        self.__limits = None
+        return comp_id
+
+    def get_id(self, name):
+        return self.__ids.get(name)
+
+    def get_names(self):
+        return list(self.__names)
+
+    def get_byte_counts(self):
+        # The live list. Components add the bytes they move into their slot.
+        return self.__byte_counts
+
+    def get_bandwidths(self):
+        return self.__get_limits()[0]
+
+    def get_latencies(self):
+        return self.__get_limits()[1]
+
+    def __get_limits(self):
+        if self.__limits is None:
+            self.__limits = (np.array(self.__bw, dtype=float), np.array(self.__latency, dtype=float))
+        return self.__limits
+
+    def get_comp_utilization(self, comp_id, ticks):
+        return ((self.__byte_counts[comp_id] / (ticks / self.__tick_rate)) /
+                self.__bw[comp_id])
+
+    def get_utilization(self, ticks, what='bandwidth', ids=None):
+        """
+        Returns the utilization of all components (or the components
+        in ids) as an array
+        """
+        if what != 'bandwidth':
+            util = np.zeros(len(self.__names))
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                util = (np.array(self.__byte_counts, dtype=float) /
+                        (ticks / self.__tick_rate)) / self.get_bandwidths()
+        return util if ids is None else util[ids]
+
+    def get_interval(self):
+        return self.__interval
+
+    def advance(self, tick):
+        """
+        Sample the byte counts for all intervals that end at or before tick
+        """
+        if self.__next_sample > tick or self.__coalesce_start is not None:
+            return
+        counts = np.array(self.__byte_counts, dtype=float)
+        while self.__next_sample <= tick:
+            self.__record(counts)
+
+    def begin_coalesce(self, tick):
+        """
+        The scheduler will skip ahead after tick and account for the
+        skipped ticks in one scaled period. Sampling is suspended until
+        end_coalesce() so that the scaled bytes can be spread out.
+        """
+        self.advance(tick)
+        if self.__interval > 0:
+            self.__coalesce_start = (tick, np.array(self.__byte_counts, dtype=float))
+
+    def end_coalesce(self, tick):
+        if self.__coalesce_start is None:
+            return
+        (start_tick, start_counts) = self.__coalesce_start
+        self.__coalesce_start = None
+        counts = np.array(self.__byte_counts, dtype=float)
+        delta = counts - np.pad(start_counts, (0, len(counts) - len(start_counts)), 'constant')
+        while self.__next_sample <= tick:
+            frac = float(self.__next_sample - start_tick) / (tick - start_tick)
+            self.__record(counts - delta * (1.0 - frac))
+
+    def __record(self, counts):
+        self.__sample_ticks.append(self.__next_sample)
+        self.__samples.append(counts)
+        self.__next_sample += self.__interval
+
+    def get_utilization_series(self, what='bandwidth', ids=None):
+        """
+        Returns (times, utilization) where utilization[k] holds the
+        utilization of all components (or the components in ids) during
+        the interval that ends at times[k] seconds
+        """
+        num_comps = len(self.__names)
+        counts = np.zeros((len(self.__samples), num_comps))
+        for k, s in enumerate(self.__samples):
+            counts[k, :len(s)] = s
+        ticks = np.array(self.__sample_ticks, dtype=float)
+        if what != 'bandwidth' or len(ticks) < 2:
+            util = np.zeros((max(len(ticks) - 1, 0), num_comps))
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                util = (np.diff(counts, axis=0) /
+                        (np.diff(ticks) / self.__tick_rate)[:, None]) / self.get_bandwidths()
+        times = ticks[1:] / self.__tick_rate
+        return (times, util if ids is None else util[:, ids])
+
+class TelemetryRecorder(object):
+    """
+    Telemetry Recorder:
+    Accumulates windowed counters for a single component. Window k holds
+    ticks (k*window, (k+1)*window]. Completed windows are stored in a
+    preallocated ring buffer that holds the last depth windows.
+    Metrics:
+    - bytes: Bytes moved by the component
+    - stall_ticks: Ticks during which the component was held up
+    - occupancy: Input queue occupancy integrated over ticks (item-ticks)
+    - ready_fails: Number of readiness queries that returned False (the
+      destinations holding the component up count their own queries)
+    Under the event scheduler, readiness is only queried on the ticks that
+    producers are woken up on, so channels and functions see fewer
+    readiness failures (and stall ticks) than under the tick scheduler.
+    """
+    METRICS = ['bytes', 'stall_ticks', 'occupancy', 'ready_fails']
+    BYTES, STALL_TICKS, OCCUPANCY, READY_FAILS = range(4)
+
+    __slots__ = ['__window', '__depth', '__buf', '__acc', '__window_num', '__window_end',
+                 '__fail_tick']
+
+    def __init__(self, window, depth):
+        self.__window = window
+        self.__depth = depth
+        self.__buf = np.zeros((depth, len(self.METRICS)))
+        self.__acc = [0.0] * len(self.METRICS)
+        self.__window_num = 0
+        self.__window_end = window
+        self.__fail_tick = -1
+
+    def add(self, metric, tick, value):
+        if tick > self.__window_end:
+            self.__roll(tick)
+        self.__acc[metric] += value
+
+    def add_ready_fail(self, tick):
+        # Every failure is counted but a tick is only stalled once
+        self.add(self.READY_FAILS, tick, 1)
+        if tick != self.__fail_tick:
+            self.__fail_tick = tick
+            self.__acc[self.STALL_TICKS] += 1
+
+    def add_span(self, metric, start_tick, end_tick, level=1.0):
+        """
+        Add level for every tick in (start_tick, end_tick]
+        """
+        # Windows that will have dropped out of the ring buffer are skipped
+        start_tick = max(start_tick, end_tick - (self.__depth + 1) * self.__window)
+        while start_tick < end_tick:
+            if start_tick + 1 > self.__window_end:
+                self.__roll(start_tick + 1)
+            stop = min(end_tick, self.__window_end)
+            self.__acc[metric] += level * (stop - start_tick)
+            start_tick = stop
+
+    def __roll(self, tick):
+        # Close the open window and all empty windows before the one holding tick
+        num = (tick - 1) // self.__window
+        self.__buf[self.__window_num % self.__depth] = self.__acc
+        if num - self.__window_num > self.__depth:
+            self.__buf[:] = 0.0
+        else:
+            for k in range(self.__window_num + 1, num):
+                self.__buf[k % self.__depth] = 0.0
+        self.__acc = [0.0] * len(self.METRICS)
+        self.__window_num = num
+        self.__window_end = (num + 1) * self.__window
+
+    def get_windows(self, ticks):
+        """
+        Returns (window_end_ticks, values) for all completed windows still
+        in the ring buffer as of ticks, oldest first. values has one column
+        per metric.
+        """
+        if ticks + 1 > self.__window_end:
+            self.__roll(ticks + 1)
+        first = max(self.__window_num - self.__depth, 0)
+        nums = np.arange(first, self.__window_num)
+        return ((nums + 1) * self.__window, self.__buf[nums % self.__depth])
+
+class LatencySketch(object):
+    """
+    Latency Sketch:
+    Streaming min/mean/max and percentiles of latencies (in ticks). The
+    percentiles come from an HDR style log-bucketed histogram: values
+    below 2^sub_bits ticks are counted exactly (to the tick), larger ones
+    in buckets that are 2^-(sub_bits-1) of their value wide (about 1.6%
+    accuracy by default). Adding a value is O(1) and only allocates when
+    the histogram has to grow.
+    """
+    SUB_BITS = 6
+
+    __slots__ = ['__sub_bits', '__half', '__count', '__total', '__min', '__max', '__buckets']
+
+    def __init__(self, sub_bits=SUB_BITS):
+        self.__sub_bits = sub_bits
+        self.__half = 1 << (sub_bits - 1)
+        self.__count = 0
+        self.__total = 0.0
+        self.__min = float('inf')
+        self.__max = 0.0
+        self.__buckets = array.array('l', [0] * (2 * self.__half))
+
+    def add(self, value, count=1):
+        self.__count += count
+        self.__total += value * count
+        if value < self.__min:
+            self.__min = value
+        if value > self.__max:
+            self.__max = value
+        v = int(value) if value > 0 else 0
+        shift = v.bit_length() - self.__sub_bits
+        if shift <= 0:
+            i = v
+        else:
+            i = shift * self.__half + (v >> shift)
+        if i >= len(self.__buckets):
+            self.__buckets.extend([0] * (i + 1 - len(self.__buckets)))
+        self.__buckets[i] += count
+
+    def __bucket_range(self, i):
+        # Returns [low, high) of the values in bucket i
+        shift = i // self.__half - 1
+        if shift <= 0:
+            return (i, i + 1)
+        m = i - shift * self.__half
+        return (m << shift, (m + 1) << shift)
+
+    def get_count(self):
+        return self.__count
+
+    def get_min(self):
+        return self.__min if self.__count else None
+
+    def get_max(self):
+        return self.__max if self.__count else None
+
+    def get_mean(self):
+        return self.__total / self.__count if self.__count else None
+
+    def get_percentile(self, p):
+        """
+        Returns an estimate of the p-th percentile (0..100): the middle of
+        the histogram bucket that holds it, clamped to [min, max]
+        """
+        if not self.__count:
+            return None
+        rank = max(p / 100.0 * self.__count, 1)
+        seen = 0
+        for i in range(len(self.__buckets)):
+            seen += self.__buckets[i]
+            if seen >= rank:
+                (low, high) = self.__bucket_range(i)
+                return min(max((low + high - 1) / 2.0, self.__min), self.__max)
+        return self.__max
+
+class Profiler(object):
+    """
+    Profiler:
+    Measures the wall clock time spent in instrumented methods of the
+    simulator and its components. Time is recorded per call stack of
+    instrumented methods so that it can be aggregated by component class
+    or name prefix, and exported as collapsed stacks for flamegraphs.
+    Self time is the time spent in a method minus the time spent in the
+    instrumented methods that it calls.
+    """
+    GROUPINGS = ['class', 'prefix', 'name']
+
+    def __init__(self):
+        self.__stack = []           # Frames of the active calls
+        self.__child_time = []      # Time spent in the children of the active calls
+        self.__stacks = dict()      # Call stack -> [calls, total time, self time]
+        self.__patched = []
+
+    def instrument(self, obj, method, frame):
+        """
+        Replaces obj.method with a version that is profiled under frame,
+        a (class name, method name, component name) tuple
+        """
+        orig = getattr(obj, method)
+        self.__patched.append((obj, method, obj.__dict__.get(method)))
+        profiler = self
+        def profiled(self, *args, **kwargs):
+            return profiler.__call(frame, orig, args, kwargs)
+        setattr(obj, method, types.MethodType(profiled, obj))
+
+    def restore(self):
+        """
+        Undoes all instrumentation (the recorded data is kept)
+        """
+        for (obj, method, prev) in reversed(self.__patched):
+            if prev is None:
+                delattr(obj, method)
+            else:
+                setattr(obj, method, prev)
+        self.__patched = []
+
+    def __call(self, frame, method, args, kwargs):
+        self.__stack.append(frame)
+        self.__child_time.append(0.0)
+        start = timeit.default_timer()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            elapsed = timeit.default_timer() - start
+            self_time = elapsed - self.__child_time.pop()
+            stack = tuple(self.__stack)
+            self.__stack.pop()
+            if self.__child_time:
+                self.__child_time[-1] += elapsed
+            entry = self.__stacks.get(stack)
+            if entry is None:
+                self.__stacks[stack] = [1, elapsed, self_time]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] += self_time
+
+    @staticmethod
+    def __frame_label(frame, by, depth):
+        (cls, method, name) = frame
+        if by == 'class' or not name:
+            return '%s.%s' % (cls, method)
+        elif by == 'prefix':
+            return '%s:%s.%s' % ('/'.join(name.split('/')[:depth]), cls, method)
+        else:
+            return '%s:%s.%s' % (name, cls, method)
+
+    def __grouped_stacks(self, by, depth):
+        if by not in self.GROUPINGS:
+            raise RuntimeError('Invalid profile grouping: ' + by)
+        for (stack, entry) in self.__stacks.items():
+            yield ([self.__frame_label(f, by, depth) for f in stack], entry)
+
+    def get_stats(self, by='class', depth=2):
+        """
+        Returns a list of (label, calls, total time, self time) sorted by self
+        time. Labels are "class.method" optionally prefixed by the component
+        name (by='name') or its first depth name levels (by='prefix').
+        Recursive calls are only counted once in the total time.
+        """
+        stats = dict()
+        for (labels, (calls, total, self_time)) in self.__grouped_stacks(by, depth):
+            stat = stats.setdefault(labels[-1], [0, 0.0, 0.0])
+            stat[0] += calls
+            if labels[-1] not in labels[:-1]:
+                stat[1] += total
+            stat[2] += self_time
+        return sorted([(l, c, t, st) for (l, (c, t, st)) in stats.items()],
+                      key=lambda x: x[3], reverse=True)
+
+    def write_collapsed(self, filename, by='class', depth=2):
+        """
+        Writes the self time (in microseconds) of every call stack in the
+        collapsed stack format used by flamegraph.pl and speedscope
+        """
+        collapsed = dict()
+        for (labels, entry) in self.__grouped_stacks(by, depth):
+            key = ';'.join(labels)
+            collapsed[key] = collapsed.get(key, 0.0) + entry[2]
+        with open(filename, 'w') as f:
+            for key in sorted(collapsed):
+                usecs = int(round(collapsed[key] * 1e6))
+                if usecs > 0:
+                    f.write('%s %d\n' % (key, usecs))
+
+class PartitionLink():
+    """
+    Partitioned Simulation Link:
+    Stands in for a connection that crosses a partition boundary in a
+    partitioned simulation (see SimulatorCore.run_partitioned). Pushed
+    data is queued in an outbox and shows up at the destination (usually
+    in another partition) delay ticks after it was sent. The link has no
+    backpressure, the receiving end buffers data like an elastic buffer
+    and reports the cut as blocked (see PartitionInbox).
+    """
+
+    def __init__(self, sim_core, src_name, dest_name, dest_arg, outbox, delay):
+        self.__sim_core = sim_core
+        self.__src = src_name
+        self.__dest = (dest_name, dest_arg)
+        self.__outbox = outbox
+        self.__delay = delay
+
+    def is_ready(self):
+        return True
+
+    def get_ready_tick(self):
+        return self.__sim_core.get_ticks()
+
+    def get_ready_tracker(self):
+        return None     # Always ready
+
+    def push(self, data):
+        self.__outbox.append((self.__sim_core.get_ticks() + self.__delay, self.__delay,
+                              self.__dest, data, self.__src))
+
+class PartitionStub():
+    """
+    Partitioned Simulation Stub:
+    Stands in for a component (or function argument) of another partition
+    in the process of a partition. Connections to it are replaced with
+    PartitionLinks before the partition is simulated.
+    """
+
+    def __init__(self, name, arg):
+        self.name = name
+        self.arg = arg
+        self.type = comptype.other
+        self.__ready = ReadyTracker()
+
+    def get_ready_tracker(self):
+        return self.__ready
+
+class PartitionPickler(pickle.Pickler):
+    """
+    Partition Pickler:
+    Pickles the simulator for the process of a single partition. The
+    objects in foreign (a dict that maps the ids of the components,
+    function arguments and readiness trackers of all other partitions to
+    (kind, name, arg) keys) are not pickled. PartitionUnpickler replaces
+    them with PartitionStubs (and their trackers).
+    """
+
+    def __init__(self, f, foreign):
+        pickle.Pickler.__init__(self, f, pickle.HIGHEST_PROTOCOL)
+        self.__foreign = foreign
+
+    def persistent_id(self, obj):
+        return self.__foreign.get(id(obj))
+
+class PartitionUnpickler(pickle.Unpickler):
+    """
+    Partition Unpickler:
+    Unpickles what PartitionPickler pickled
+    """
+
+    def __init__(self, f):
+        pickle.Unpickler.__init__(self, f)
+        self.__stubs = dict()
+
+    def persistent_load(self, pid):
+        (kind, name, arg) = pid
+        stub = self.__stubs.get((name, arg))
+        if stub is None:
+            stub = self.__stubs[(name, arg)] = PartitionStub(name, arg)
+        return stub if kind == 'comp' else stub.get_ready_tracker()
+
+def _run_partition(state, part, comp_names, links, in_parts, end_tick, lookahead,
+                   drain_windows, offsets, queues, results):
+    # Runs in the worker process of a partition (see SimulatorCore.run_partitioned)
+    try:
+        state = PartitionUnpickler(io.BytesIO(state)).load()
+        DataStream.merge_intern_tables(state['intern_tables'])
+        results.put(state['core'].run_partition(part, comp_names, links, in_parts, end_tick,
+                                                lookahead, drain_windows, offsets, queues))
+    except Exception as e:
+        results.put({'part': part, 'error': '%s: %s' % (type(e).__name__, str(e))})
+
+class PartitionInbox():
+    """
+    Partitioned Simulation Inbox:
+    Delivers data sent over partition links when it is due. It is ticked
+    after all producers. If a destination is not ready, its data is held
+    back (in order) until it is. In a sequential simulation, the channel
+    that sent it would not have been ready instead, so the ticks on which
+    data is held back are recorded for every cut (see get_blocked).
+    """
+
+    def __init__(self, sim_core):
+        self.__sim_core = sim_core
+        self.__pending = collections.deque()
+        self.__dests = dict()
+        self.__blocked = dict()
+
+    def add(self, messages):
+        """
+        Adds a list of (due tick, delay, (dest name, dest arg), data, src name)
+        messages
+        """
+        by_delay = dict()
+        for m in messages:
+            by_delay.setdefault(m[1], []).append(m)
+        merged = list(self.__pending)
+        for (delay, msgs) in by_delay.items():
+            # The delay is not part of the simulated latency
+            streams = DataStream.rebase([m[3] for m in msgs], delay)
+            merged.extend((m[0], m[2], data, m[4]) for (m, data) in zip(msgs, streams))
+        merged.sort(key=lambda m: m[0])
+        self.__pending = collections.deque(merged)
+
+    def __get_dest(self, dest):
+        if dest not in self.__dests:
+            comp = self.__sim_core.lookup(dest[0])
+            self.__dests[dest] = comp if dest[1] is None else comp.inputs(dest[1])
+        return self.__dests[dest]
+
+    def tick(self):
+        now = self.__sim_core.get_ticks()
+        held = []
+        blocked = set()
+        cuts = set()
+        while self.__pending and self.__pending[0][0] <= now:
+            msg = self.__pending.popleft()
+            dest = self.__get_dest(msg[1])
+            if msg[1] in blocked or not dest.is_ready():
+                blocked.add(msg[1])
+                cuts.add((msg[3], msg[1][0]))
+                held.append(msg)
+            else:
+                dest.push(msg[2])
+        self.__pending.extendleft(reversed(held))
+        for cut in cuts:
+            if cut in self.__blocked:
+                self.__blocked[cut][0] += 1
+            else:
+                self.__blocked[cut] = [1, now]
+        if held:
+            return now + 1
+        return self.__pending[0][0] if self.__pending else None
+
+    def get_blocked(self):
+        """
+        Returns a dict that maps the (src name, dest name) of every cut that
+        would have blocked to the number of ticks on which it held back
+        data and the first of them
+        """
+        return dict((cut, tuple(b)) for (cut, b) in self.__blocked.items())
+
+    def __len__(self):
+        return len(self.__pending)
+
 class SimulatorCore:
     """
     Core simulation engine:
     This class owns all the simulation components and
     manages time and other housekeeping operations.
-    """
 
-    def __init__(self, tick_rate):
+    Two schedulers are supported:
+    - tick: Every tick-aware component is ticked on every tick
+    - event: Components post the next tick at which they can make
+      progress and are only woken up then. Once the network reaches
+      a periodic steady state, whole periods are coalesced into one.
+
+    Byte counts of all bandwidth limited components are kept in a
+    UtilizationDb. If util_interval (seconds) is specified, they are
+    also sampled at that interval for utilization time series.
+
+    Consumers keep the latest hops and latency of every item they receive
+    and, unless latency_histograms is False, a histogram of its latency.
+    The retention policy controls what else they keep (see Consumer).
+
+    If packet_size (bytes) is specified, channels with a finite bandwidth
+    serialize the data pushed into them as packets (see Channel).
+
+    If telemetry_window (seconds) is specified, producers, channels and
+    functions record windowed telemetry (see TelemetryRecorder) for the
+    last telemetry_depth windows.
+
+    A coalesced push stands for the pushes of many periods. Components
+    that cannot account for that (ex: telemetry recorders would see all
+    the skipped periods as one burst) call observe_every_period(), which
+    disables steady state coalescing.
+
+    run_partitioned() splits the network into partitions that are
+    simulated in parallel processes (see PartitionLink).
+    """
+    SCHEDULERS = ['tick', 'event']
+    SNAPSHOT_VERSION = 8
+    # Only set in the processes of a partitioned simulation
+    __inbox = None
+    # Only set after a partitioned simulation
+    __blocked_cuts = None
+    # Only set while profiling
+    __profiler = None
+    # Methods that are instrumented for profiling by component type
+    PROFILED_METHODS = {
+        comptype.producer: ['tick'],
+        comptype.consumer: ['push'],
+        comptype.channel: ['push'],
+        comptype.function: ['notify', 'do_func'],
+    }
+
+    def __init__(self, tick_rate, scheduler='tick', util_interval=None,
+                 telemetry_window=None, telemetry_depth=1024,
+                 retention='latest', reservoir_size=16, latency_histograms=True,
+                 packet_size=None):
+        if scheduler not in self.SCHEDULERS:
+            raise RuntimeError('Invalid scheduler: ' + scheduler)
+        if retention not in Consumer.RETENTION_POLICIES:
+            raise RuntimeError('Invalid retention policy: ' + retention)
+        self.__retention = (retention, reservoir_size)
+        self.__latency_histograms = latency_histograms
+        self.__packet_size = packet_size
+        util_interval_ticks = 0
+        if util_interval:
+            util_interval_ticks = max(int(round(util_interval * tick_rate)), 1)
+        self.__telemetry_window = 0
+        if telemetry_window:
+            self.__telemetry_window = max(int(round(telemetry_window * tick_rate)), 1)
+        self.__telemetry_depth = telemetry_depth
+        # Free-form information about the simulation that is saved with snapshots
+        self.metadata = dict()
         self.__ticks = 0
         self.__tick_rate = tick_rate
+        self.__scheduler = scheduler
+        self.__coalesce_factor = 1
+        self.__coalesce_end = 0
+        self.__observe_every_period = False
         self.__tick_aware_comps = list()
         self.__all_comps = dict()
+        self.__index = ComponentIndex()
+        self.__util_db = UtilizationDb(tick_rate, util_interval_ticks)
         self.__edge_render_db = list()
 
+    def set_scheduler(self, scheduler):
+        if scheduler not in self.SCHEDULERS:
+            raise RuntimeError('Invalid scheduler: ' + scheduler)
+        self.__scheduler = scheduler
+
+    def save_snapshot(self, filename):
+        """
+        Saves the simulator, all components and all data in flight
+        to a compressed binary file
+        """
+        if sys.version_info[0] < 3:
+            raise RuntimeError('Snapshots require Python 3')
+        if self.__profiler:
+            raise RuntimeError('Cannot save a snapshot while profiling')
+        state = {'version': self.SNAPSHOT_VERSION, 'core': self,
+                 'intern_tables': DataStream.get_intern_tables()}
+        # The cyclic GC needlessly rescans the huge object graph many times
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with gzip.open(filename, 'wb', compresslevel=1) as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    @staticmethod
+    def load_snapshot(filename):
+        """
+        Restores a simulator that was saved using save_snapshot()
+        """
+        if sys.version_info[0] < 3:
+            raise RuntimeError('Snapshots require Python 3')
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with gzip.open(filename, 'rb') as f:
+                state = pickle.load(f)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if state.get('version') != SimulatorCore.SNAPSHOT_VERSION:
+            raise RuntimeError('Unsupported snapshot version in ' + filename)
+        DataStream.merge_intern_tables(state['intern_tables'])
+        return state['core']
+
+    def release(self):
+        """
+        Call when done with this simulator. Clears the route and latency
+        interning caches that are shared by all simulators so they don't
+        keep growing over many simulations (ex: in a sweep).
+        """
+        DataStream.clear_intern_caches()
+
     def register(self, comp, tick_aware):
         if comp.name not in self.__all_comps:
             self.__all_comps[comp.name] = comp
+            self.__index.add(comp.name, comp.type)
         else:
             raise RuntimeError('Duplicate component ' + comp.name)
         if tick_aware:
@@ -85,10 +958,34 @@ class SimulatorCore:
         if len(srcports) != len(dstports):
             raise RuntimeError(
                 'Source and destination ports should be of the same length')
-        for i in range(len(srcports)):
-            src.connect(srcports[i], dst.inputs(dstports[i], bind=True))
-        if render_label:
-            self.__edge_render_db.append((src.name, dst.name, float(len(srcports)), render_label, render_color))
+        self.connect_edges([(src, sp, dst, dp) for (sp, dp) in zip(srcports, dstports)],
+            render_label, render_color)
+
+    def connect_edges(self, edges, render_label=None, render_color=None):
+        """
+        Makes all connections in an edge list in one pass. Each edge
+        is a (src, srcport, dst, dstport) tuple. If render_label is
+        specified, one rendered edge is recorded for every run of
+        consecutive edges between the same pair of components, with
+        the run length as its weight.
+        """
+        render_db = self.__edge_render_db
+        last_pair = None
+        run_len = 0
+        for (src, srcport, dst, dstport) in edges:
+            src.connect(srcport, dst.inputs(dstport, True))
+            if render_label:
+                if last_pair is not None and (src is last_pair[0] and dst is last_pair[1]):
+                    run_len += 1
+                    continue
+                if last_pair is not None:
+                    render_db.append((last_pair[0].name, last_pair[1].name, float(run_len),
+                        render_label, render_color))
+                last_pair = (src, dst)
+                run_len = 1
+        if last_pair is not None:
+            render_db.append((last_pair[0].name, last_pair[1].name, float(run_len),
+                render_label, render_color))
 
     def connect_multi_bidir(self, ep1, ep1port, ep2, ep2port, render_labels=None, render_colors=None):
         if render_labels:
@@ -105,13 +1002,10 @@ class SimulatorCore:
         self.connect_multi(ep2, ep2port, ep1, ep1port, render_labels[1], render_colors[1])
 
     def list_components(self, comptype='', name_filt=''):
-        if not comptype:
-            return sorted([c for c in list(self.__all_comps.keys())
-                if (re.match(name_filt, self.__all_comps[c].name))])
-        else:
-            return sorted([c for c in list(self.__all_comps.keys())
-                if (self.__all_comps[c].type == comptype and
-                    re.match(name_filt, self.__all_comps[c].name))])
+        return sorted(self.__index.find(comptype, name_filt))
+
+    def glob_components(self, pattern, comptype=''):
+        return sorted(self.__index.glob(pattern, comptype))
 
     def lookup(self, comp_name):
         return self.__all_comps[comp_name]
@@ -120,17 +1014,478 @@ class SimulatorCore:
         self.__ticks += 1
         for c in self.__tick_aware_comps:
             c.tick()
+        self.__util_db.advance(self.__ticks)
+
+    def enable_profiling(self):
+        """
+        Instruments the simulator and all its components for profiling
+        (see Profiler) and returns the profiler
+        """
+        if self.__profiler:
+            return self.__profiler
+        self.__profiler = Profiler()
+        self.__profiler.instrument(self, 'run', ('SimulatorCore', 'run', ''))
+        self.__profiler.instrument(self, 'tick', ('SimulatorCore', 'tick', ''))
+        for n in sorted(self.__all_comps):
+            c = self.__all_comps[n]
+            for method in self.PROFILED_METHODS.get(c.type, []):
+                self.__profiler.instrument(c, method, (type(c).__name__, method, n))
+        return self.__profiler
+
+    def disable_profiling(self):
+        """
+        Removes the profiling instrumentation and returns the profiler
+        """
+        profiler = self.__profiler
+        if profiler:
+            profiler.restore()
+            self.__profiler = None
+        return profiler
+
+    def get_profiler(self):
+        return self.__profiler
 
     def run(self, time_s):
-        for i in range(int(time_s * self.__tick_rate)):
-            self.tick()
+        self.__run_until(self.__ticks + int(time_s * self.__tick_rate))
+
+    def __run_until(self, end_tick):
+        if self.__scheduler == 'event':
+            self.__run_events(end_tick)
+        else:
+            while self.__ticks < end_tick:
+                self.tick()
+
+    def get_partitions(self, partition_func):
+        """
+        Returns a dict that maps each component name to a partition.
+        partition_func(name) returns the partition of a component or None
+        if the component should go to the partition of a neighbor.
+        """
+        parts = dict()
+        neighbors = dict((n, []) for n in self.__all_comps)
+        for (src, dst, arg) in self.__get_edges():
+            neighbors[src].append(dst)
+            neighbors[dst].append(src)
+        for n in sorted(self.__all_comps):
+            part = partition_func(n)
+            if part is not None:
+                parts[n] = part
+        if not parts:
+            raise RuntimeError('No component was assigned to a partition')
+        frontier = sorted(parts)
+        while frontier:
+            next_frontier = []
+            for n in frontier:
+                for m in neighbors[n]:
+                    if m not in parts:
+                        parts[m] = parts[n]
+                        next_frontier.append(m)
+            frontier = next_frontier
+        # Unconnected components are not simulated so they can go anywhere
+        default = min(parts.values())
+        for n in self.__all_comps:
+            parts.setdefault(n, default)
+        return parts
+
+    def __get_edges(self):
+        # Returns a list of (src name, dest name, dest arg) for all connections
+        edges = []
+        for n in sorted(self.__all_comps):
+            c = self.__all_comps[n]
+            if c.type not in (comptype.producer, comptype.channel, comptype.function):
+                continue
+            for d in c.get_dests():
+                if d is None:
+                    continue
+                elif isinstance(d, Function.Arg):
+                    edges.append((n, d.get_func().name, d.get_num()))
+                else:
+                    edges.append((n, d.name, None))
+        return edges
+
+    def run_partitioned(self, time_s, partition_func, lookahead=None, strict=False):
+        """
+        Simulates time_s seconds with every partition (see get_partitions)
+        in its own process. Partitions can only be cut at channels and the
+        partitions only exchange data once every lookahead ticks, which
+        defaults to the smallest latency of the cut channels.
+
+        Data that crosses a cut shows up in the other partition lookahead
+        ticks after it was sent. The other inputs of functions that it goes
+        to are delayed to match so the data streams line up exactly like in
+        a sequential simulation. The delays are not counted as latency. Data
+        that is still in flight at the end of the simulation is drained
+        (with the producers stopped) before the results are collected.
+        Backpressure does not cross the cuts, data is buffered instead. If
+        the destination of a cut channel is not ready for the data (the
+        channel would have blocked in a sequential simulation), the results
+        differ from a sequential simulation. Such cuts are reported (see
+        get_blocked_cuts) with a warning or, if strict, an error.
+
+        Every process only receives the components of its partition (see
+        PartitionPickler) so any multiprocessing start method works.
+
+        This simulator is not run. The byte counts and consumed streams of
+        all partitions are merged back into it so that the results can be
+        inspected.
+        """
+        if self.__util_db.get_interval() > 0 or self.__telemetry_window or self.__profiler:
+            raise RuntimeError('Utilization intervals, telemetry and profiling are not supported in partitioned simulations')
+        end_tick = self.__ticks + int(time_s * self.__tick_rate)
+        parts = self.get_partitions(partition_func)
+        edges = self.__get_edges()
+        cut_latency = None
+        for (src, dst, arg) in edges:
+            if parts[src] == parts[dst]:
+                continue
+            if self.__all_comps[src].type != comptype.channel:
+                raise RuntimeError('Partitions can only be cut at channels. Cannot cut %s -> %s' % (src, dst))
+            latency = self.__all_comps[src].get_latency()
+            if cut_latency is None or latency < cut_latency:
+                cut_latency = latency
+        if lookahead is None:
+            lookahead = cut_latency if cut_latency else end_tick - self.__ticks
+        lookahead = int(lookahead)
+        if lookahead < 1:
+            raise RuntimeError('The partition lookahead must be at least one tick')
+
+        # Number of lookahead delays that the data going into each component
+        # has seen. Function inputs that have seen fewer get delayed to match.
+        delays = self.__get_partition_delays(parts, edges)
+        links = []
+        for (src, dst, arg) in edges:
+            if arg is None:
+                delay = 1 if parts[src] != parts[dst] else 0
+            else:
+                delay = delays[dst] - delays[src]
+            if delay > 0:
+                links.append((src, dst, arg, parts[dst], delay * lookahead))
+
+        # Data sent at the end takes up to this many windows to arrive
+        drain_windows = max(delays.values()) + 1
+        part_ids = sorted(set(parts.values()))
+        queues = dict((p, multiprocessing.Queue()) for p in part_ids)
+        results = multiprocessing.Queue()
+        workers = []
+        blocked_cuts = dict()
+        for p in part_ids:
+            comp_names = [n for n in parts if parts[n] == p]
+            # Streams that reach a consumer have been delayed by its delay
+            offsets = dict((n, delays[n] * lookahead) for n in comp_names
+                           if self.__all_comps[n].type == comptype.consumer and delays[n] > 0)
+            workers.append(multiprocessing.Process(target=_run_partition,
+                args=(self.__pickle_partition(comp_names), p, comp_names,
+                      [l for l in links if parts[l[0]] == p],
+                      set(parts[l[0]] for l in links if l[3] == p and parts[l[0]] != p),
+                      end_tick, lookahead, drain_windows, offsets, queues, results)))
+        for w in workers:
+            w.start()
+        try:
+            for i in range(len(workers)):
+                res = results.get()
+                if 'error' in res:
+                    raise RuntimeError('Partition %s failed: %s' % (res['part'], res['error']))
+                DataStream.merge_intern_tables(res['intern_tables'])
+                byte_counts = self.__util_db.get_byte_counts()
+                for (comp_id, count) in res['byte_counts'].items():
+                    byte_counts[comp_id] = count
+                for (n, comp_results) in res['results'].items():
+                    self.__all_comps[n].import_results(comp_results)
+                blocked_cuts.update(res['blocked_cuts'])
+        except:
+            for w in workers:
+                w.terminate()
+            raise
+        finally:
+            for w in workers:
+                w.join()
+        self.__ticks = end_tick
+        self.__util_db.advance(end_tick)
+        self.__blocked_cuts = blocked_cuts
+        for ((src, dst), (ticks, first_tick)) in sorted(blocked_cuts.items()):
+            msg = ('The partition cut %s -> %s would have blocked on %d ticks (first on tick %d). '
+                   'Backpressure does not cross partition cuts.' % (src, dst, ticks, first_tick))
+            if strict:
+                raise RuntimeError(msg)
+            print('[WARN] ' + msg)
+
+    def get_blocked_cuts(self):
+        """
+        Returns a dict that maps the (src, dst) of every cut of the last
+        partitioned simulation that would have blocked (see run_partitioned)
+        to the number of ticks on which it held back data and the first of
+        them
+        """
+        return dict(self.__blocked_cuts or {})
+
+    def __get_partition_delays(self, parts, edges):
+        # Longest path (in cut edges) from the producers to each component
+        in_edges = dict((n, []) for n in self.__all_comps)
+        out_edges = dict((n, []) for n in self.__all_comps)
+        for (src, dst, arg) in edges:
+            in_edges[dst].append(src)
+            out_edges[src].append(dst)
+        delays = dict()
+        remaining = dict((n, len(in_edges[n])) for n in self.__all_comps)
+        frontier = [n for n in self.__all_comps if remaining[n] == 0]
+        while frontier:
+            n = frontier.pop()
+            delays[n] = max([delays[m] + (1 if parts[m] != parts[n] else 0) for m in in_edges[n]] + [0])
+            for m in out_edges[n]:
+                remaining[m] -= 1
+                if remaining[m] == 0:
+                    frontier.append(m)
+        if len(delays) != len(self.__all_comps):
+            raise RuntimeError('Partitioned simulations do not support loops between components')
+        return delays
+
+    def __pickle_partition(self, comp_names):
+        # Components of other partitions are replaced by stubs (see PartitionPickler)
+        local = set(comp_names)
+        foreign = dict()
+        for (n, c) in self.__all_comps.items():
+            if n in local:
+                continue
+            foreign[id(c)] = ('comp', n, None)
+            if hasattr(c, 'get_ready_tracker') and c.get_ready_tracker() is not None:
+                foreign[id(c.get_ready_tracker())] = ('ready', n, None)
+            if c.type == comptype.function:
+                for arg in c.get_in_args():
+                    foreign[id(arg)] = ('comp', n, arg.get_num())
+                    foreign[id(arg.get_ready_tracker())] = ('ready', n, arg.get_num())
+        f = io.BytesIO()
+        PartitionPickler(f, foreign).dump(
+            {'core': self, 'intern_tables': DataStream.get_intern_tables()})
+        return f.getvalue()
+
+    def run_partition(self, part, comp_names, links, in_parts, end_tick, lookahead,
+                      drain_windows, offsets, queues):
+        """
+        Simulates a single partition of run_partitioned() in a worker
+        process and returns its results. This simulator must have been
+        unpickled from the partition (see PartitionPickler).
+        """
+        local = set(comp_names)
+        self.__inbox = PartitionInbox(self)
+        outboxes = dict()
+        for (src, dst, arg, dst_part, delay) in links:
+            outbox = outboxes.setdefault(dst_part, [])
+            for dest in self.lookup(src).get_dests():
+                if isinstance(dest, PartitionLink):
+                    continue
+                elif isinstance(dest, Function.Arg):
+                    key = (dest.get_func().name, dest.get_num())
+                else:
+                    key = (dest.name, getattr(dest, 'arg', None))
+                if key == (dst, arg):
+                    break
+            else:
+                raise RuntimeError('%s is not connected to %s' % (src, dst))
+            self.lookup(src).replace_dest(dest, PartitionLink(self, src, dst, arg, outbox, delay))
+        # Only tick the producers of this partition. Deliver data after them.
+        self.__tick_aware_comps = [c for c in self.__tick_aware_comps if c.name in local]
+        self.__tick_aware_comps.append(self.__inbox)
+        drain_tick = end_tick + drain_windows * lookahead
+        window = 0
+        early = dict()
+        while self.__ticks < drain_tick:
+            if self.__ticks >= end_tick:
+                # Stop the producers and drain the data in flight
+                self.__tick_aware_comps = [c for c in self.__tick_aware_comps
+                                           if not isinstance(c, Producer)]
+            self.__run_until(min(self.__ticks + lookahead,
+                                 end_tick if self.__ticks < end_tick else drain_tick))
+            if self.__ticks >= drain_tick:
+                break
+            # Exchange data with the other partitions
+            for (p, outbox) in outboxes.items():
+                if p == part:
+                    self.__inbox.add(outbox)
+                else:
+                    queues[p].put((window, pickle.dumps(outbox, pickle.HIGHEST_PROTOCOL)))
+                del outbox[:]
+            received = early.pop(window, [])
+            while len(received) < len(in_parts):
+                (w, msgs) = queues[part].get()
+                if w == window:
+                    received.append(msgs)
+                else:
+                    early.setdefault(w, []).append(msgs)
+            for msgs in received:
+                self.__inbox.add(pickle.loads(msgs))
+            window += 1
+        for (n, ticks) in offsets.items():
+            self.lookup(n).rebase(-ticks)
+        byte_counts = self.__util_db.get_byte_counts()
+        res = {'part': part, 'byte_counts': dict(), 'results': dict(),
+               'intern_tables': DataStream.get_intern_tables(),
+               'blocked_cuts': self.__inbox.get_blocked()}
+        for n in comp_names:
+            comp_id = self.__util_db.get_id(n)
+            if comp_id is not None:
+                res['byte_counts'][comp_id] = byte_counts[comp_id]
+            comp_results = self.lookup(n).export_results()
+            if comp_results is not None:
+                res['results'][n] = comp_results
+        return res
+
+    def __run_events(self, end_tick):
+        # Everything is woken up on the first tick. After that, components
+        # are only woken up on the ticks they post. Ties are broken using the
+        # registration order to match the tick scheduler.
+        queue = [(self.__ticks + 1, i) for i in range(len(self.__tick_aware_comps))]
+        stateful_comps = [c for c in self.__all_comps.values() if hasattr(c, 'get_sched_state')]
+        history = dict()
+        while queue and queue[0][0] <= end_tick:
+            now = queue[0][0]
+            self.__ticks = now
+            if now > self.__coalesce_end and self.__coalesce_factor > 1:
+                self.__util_db.end_coalesce(self.__coalesce_end)
+                self.__coalesce_factor = 1
+            self.__util_db.advance(now - 1)
+            while queue and queue[0][0] == now:
+                (t, i) = heapq.heappop(queue)
+                wake = self.__tick_aware_comps[i].tick()
+                if wake is not None:
+                    heapq.heappush(queue, (max(wake, now + 1), i))
+            if self.__coalesce_factor > 1 or self.__observe_every_period or self.__inbox is not None:
+                continue
+            # If the state of the network repeats itself then the network is
+            # periodic. Skip all but one of the remaining periods and account
+            # for the skipped ones by scaling the data in the last one.
+            state = self.__get_sched_state(stateful_comps)
+            if state is None:
+                continue
+            if state in history:
+                period = now - history[state]
+                num_periods = (end_tick - now) // period
+                if num_periods >= 2:
+                    skip = (num_periods - 1) * period
+                    self.__util_db.begin_coalesce(now)
+                    for c in stateful_comps:
+                        c.fast_forward(skip)
+                    self.__ticks += skip
+                    queue = [(t + skip, i) for (t, i) in queue]
+                    self.__coalesce_factor = num_periods
+                    self.__coalesce_end = self.__ticks + period
+                history = dict()
+            else:
+                history[state] = now
+        if self.__coalesce_factor > 1:
+            self.__util_db.end_coalesce(self.__coalesce_end)
+        self.__ticks = end_tick
+        self.__coalesce_factor = 1
+        self.__util_db.advance(end_tick)
+
+    def __get_sched_state(self, stateful_comps):
+        state = []
+        for c in stateful_comps:
+            s = c.get_sched_state()
+            if s is None:
+                return None
+            state.append(s)
+        return tuple(state)
 
     def get_ticks(self):
         return self.__ticks
 
+    def get_coalesce_factor(self):
+        """
+        Returns the number of periods that pushes stand for (1 unless the
+        event scheduler is coalescing a steady state)
+        """
+        return self.__coalesce_factor
+
+    def observe_every_period(self):
+        """
+        Disables steady state coalescing (see get_coalesce_factor). Called
+        by components that have to observe the pushes of every period.
+        """
+        self.__observe_every_period = True
+
     def get_tick_rate(self):
         return self.__tick_rate
 
+    def get_util_db(self):
+        return self.__util_db
+
+    def get_utilization(self, comp_names, what):
+        """
+        Returns the utilization of attribute what for all components in
+        comp_names as an array. Components in the utilization database are
+        computed in one shot, the rest are queried one at a time.
+        """
+        ids = [self.__util_db.get_id(n) for n in comp_names]
+        tracked = [i for (i, comp_id) in enumerate(ids) if comp_id is not None]
+        util = np.zeros(len(comp_names))
+        if tracked:
+            util[tracked] = self.__util_db.get_utilization(
+                self.__ticks, what, [ids[i] for i in tracked])
+        for (i, comp_id) in enumerate(ids):
+            if comp_id is None:
+                util[i] = self.lookup(comp_names[i]).get_utilization(what)
+        return util
+
+    def get_utilization_series(self, comp_names, what='bandwidth'):
+        """
+        Returns (times, utilization) where utilization[k][i] is the
+        utilization of comp_names[i] during the interval ending at times[k].
+        Only components in the utilization database are supported.
+        """
+        ids = []
+        for n in comp_names:
+            comp_id = self.__util_db.get_id(n)
+            if comp_id is None:
+                raise RuntimeError('No utilization time series for ' + n)
+            ids.append(comp_id)
+        return self.__util_db.get_utilization_series(what, ids)
+
+    def get_retention_policy(self):
+        """
+        Returns the (policy, reservoir size) of new consumers
+        """
+        return self.__retention
+
+    def get_latency_histograms(self):
+        """
+        Returns True if new consumers keep latency histograms
+        """
+        return self.__latency_histograms
+
+    def get_packet_size(self):
+        """
+        Returns the packet size (bytes) of new bandwidth limited channels
+        or None if they pass streams through atomically
+        """
+        return self.__packet_size
+
+    def new_telemetry_recorder(self):
+        """
+        Returns a new TelemetryRecorder or None if telemetry is disabled
+        """
+        if not self.__telemetry_window:
+            return None
+        # Recorders would see all the skipped periods as one burst
+        self.observe_every_period()
+        return TelemetryRecorder(self.__telemetry_window, self.__telemetry_depth)
+
+    def get_telemetry(self, comp_names, metric):
+        """
+        Returns (times, values) where values[k][i] is the telemetry metric
+        of comp_names[i] for the window ending at times[k]
+        """
+        col = TelemetryRecorder.METRICS.index(metric)
+        times = None
+        values = []
+        for n in comp_names:
+            (ticks, windows) = self.lookup(n).get_telemetry()
+            if times is None:
+                times = ticks / float(self.__tick_rate)
+            values.append(windows[:, col])
+        if times is None:
+            return (np.zeros(0), np.zeros((0, 0)))
+        return (times, np.array(values).T)
+
     def network_to_dot(self):
         dot = Digraph(comment='RFNoC Network Topology')
         node_ids = dict()
@@ -152,17 +1507,243 @@ class SimulatorCore:
                 color=str(edgeinfo[4] if edgeinfo[4] else 'black'))
         return dot
 
+    def network_view_to_dot(self, root='', depth=2):
+        """
+        Returns a hierarchical view of the network that is small enough
+        to lay out. Every component under root is collapsed into its
+        ancestor one level below root or, if that ancestor contains
+        hardware, into its deepest ancestor (at most depth levels below
+        root) that is hardware or contains hardware. Nodes are clustered
+        by their parent (ex: FPGAs by blade). All connections between two
+        nodes (ex: parallel lanes) are collapsed into one edge weighted by
+        the number of connections. Components outside of root are
+        collapsed into the sibling of root (or of its ancestors) that
+        contains them and are only shown if they are connected to root.
+        So the top-level view (root='') shows blades and FPGAs and views
+        of single blades or FPGAs can be drilled into on demand.
+        """
+        root_parts = [p for p in root.split('/') if p]
+        level = len(root_parts) + depth
+        hw_prefixes = set()
+        for hw in self.list_components(comptype.hardware):
+            parts = hw.split('/')
+            hw_prefixes.update('/'.join(parts[:l]) for l in range(1, len(parts) + 1))
+        node_cache = dict()
+
+        def get_node(name):
+            if name not in node_cache:
+                parts = [p for p in name.split('/') if p]
+                common = 0
+                while common < len(root_parts) and common < len(parts) and \
+                        parts[common] == root_parts[common]:
+                    common += 1
+                if common < len(root_parts):
+                    node_cache[name] = ('/'.join(parts[:common + 1]), False)
+                else:
+                    l = len(root_parts) + 1
+                    while l < min(len(parts), level) and '/'.join(parts[:l + 1]) in hw_prefixes:
+                        l += 1
+                    node_cache[name] = ('/'.join(parts[:l]), True)
+            return node_cache[name]
+
+        # The root itself (ex: the FPGA hardware component) is not a node
+        nodes = set(get_node(n) for n in self.__all_comps
+                    if get_node(n)[1] and get_node(n)[0] != root.strip('/'))
+        edges = collections.OrderedDict()
+        for (src, dst, arg) in self.__get_edges():
+            (src_node, dst_node) = (get_node(src), get_node(dst))
+            if src_node[0] != dst_node[0] and (src_node in nodes or dst_node in nodes):
+                edges[(src_node, dst_node)] = edges.get((src_node, dst_node), 0) + 1
+        for (src_node, dst_node) in edges:
+            nodes.update([src_node, dst_node])
+        # Edges are labeled with the render info of connections between
+        # their nodes or ancestors of their nodes
+        labels = dict()
+        for (src, dst, weight, label, color) in self.__edge_render_db:
+            labels.setdefault((get_node(src)[0], get_node(dst)[0]), set()).add((label, color))
+
+        def get_ancestors(node):
+            parts = node.split('/')
+            return ['/'.join(parts[:l]) for l in range(1, len(parts) + 1)]
+
+        dot = Digraph(comment='RFNoC Network Topology: ' + (root or 'Top'))
+        node_ids = dict()
+        clusters = collections.OrderedDict()
+        for (node, inside) in sorted(nodes):
+            node_ids[node] = str(len(node_ids) + 1)
+            parent = node.rsplit('/', 1)[0] if '/' in node else ''
+            if inside and parent:
+                if parent not in clusters:
+                    clusters[parent] = Digraph(name='cluster_%d' % (len(clusters) + 1))
+                    clusters[parent].attr(label=parent)
+                clusters[parent].node(node_ids[node], node.rsplit('/', 1)[1], shape='box')
+            else:
+                dot.node(node_ids[node], node, shape='box',
+                         style='solid' if inside else 'dashed')
+        for cluster in clusters.values():
+            dot.subgraph(cluster)
+        for ((src_node, dst_node), count) in edges.items():
+            info = set()
+            for src_anc in get_ancestors(src_node[0]):
+                for dst_anc in get_ancestors(dst_node[0]):
+                    info.update(labels.get((src_anc, dst_anc), set()))
+            info = sorted(info, key=lambda i: (i[0], i[1] or ''))
+            label = '/'.join(i[0] for i in info)
+            colors = set(i[1] for i in info)
+            dot.edge(
+                tail_name=node_ids[src_node[0]],
+                head_name=node_ids[dst_node[0]],
+                label=('%s x%d' % (label, count)).strip() if count > 1 else label,
+                weight=str(count), penwidth=str(1.0 + math.log(count, 2)),
+                color=str(colors.pop() if len(colors) == 1 and None not in colors else 'black'))
+        return dot
+
+    GRAPH_FORMATS = ['npz', 'parquet', 'arrow']
+
+    def get_graph_tables(self, solver=None):
+        """
+        Returns the component graph as (nodes, edges) tables. Each table
+        is an ordered dict of equal length NumPy column arrays.
+        Nodes (one row per component):
+        - id, name, type, cls: Row index, name, comptype and class name
+        - ticks_per_exec: Ticks between executions (functions, else 0)
+        - bandwidth: Bandwidth limit (bytes/s, NaN if not limited)
+        - byte_rate: Average bytes moved per second (NaN if not tracked)
+        - latency: Latency added by the component (s, NaN if none)
+        - max_item_latency: Largest latency of all items (consumers, s)
+        - util_<attr>: Utilization of every utilization attribute
+          (NaN if the component does not have the attribute)
+        Edges (one row per connection):
+        - src, dst, src_id, dst_id: Names and node IDs of both ends
+        - src_port, dst_port: Output of the source, input of the destination
+        - byte_rate: Average bytes per second over the edge (NaN if unknown)
+        - latency: Latency added to streams on the edge by the source (s)
+        If an analytic solver is specified, steady state rates,
+        utilization and latencies are returned.
+        """
+        names = sorted(self.__all_comps)
+        ids = dict((n, i) for (i, n) in enumerate(names))
+        comps = [self.__all_comps[n] for n in names]
+        seconds = self.__ticks / self.__tick_rate
+        bws = self.__util_db.get_bandwidths()
+        latencies = self.__util_db.get_latencies()
+        byte_counts = self.__util_db.get_byte_counts()
+
+        def get_byte_rate(n):
+            comp_id = self.__util_db.get_id(n)
+            if comp_id is None:
+                return float('nan')
+            if solver:
+                return solver.get_byte_rate(n)
+            return byte_counts[comp_id] / seconds if seconds > 0 else 0.0
+
+        nodes = collections.OrderedDict()
+        nodes['id'] = np.arange(len(names))
+        nodes['name'] = np.array(names, dtype=str)
+        nodes['type'] = np.array([c.type for c in comps], dtype=str)
+        nodes['cls'] = np.array([c.__class__.__name__ for c in comps], dtype=str)
+        columns = dict((k, np.full(len(names), np.nan))
+                       for k in ['bandwidth', 'byte_rate', 'latency', 'max_item_latency'])
+        nodes['ticks_per_exec'] = np.zeros(len(names), dtype=int)
+        for (i, n) in enumerate(names):
+            comp_id = self.__util_db.get_id(n)
+            if comp_id is not None:
+                columns['bandwidth'][i] = bws[comp_id] if np.isfinite(bws[comp_id]) else np.nan
+                columns['byte_rate'][i] = get_byte_rate(n)
+                columns['latency'][i] = latencies[comp_id] / self.__tick_rate
+            if comps[i].type == comptype.function:
+                columns['latency'][i] = comps[i].get_latency() / self.__tick_rate
+                nodes['ticks_per_exec'][i] = comps[i].get_ticks_per_exec()
+            elif comps[i].type == comptype.consumer:
+                items = solver.get_items(n) if solver else comps[i].get_items()
+                if items:
+                    get_latency = functools.partial(solver.get_latency, n) if solver else comps[i].get_latency
+                    columns['max_item_latency'][i] = max(get_latency(item) for item in items)
+        for k in ['bandwidth', 'byte_rate', 'latency', 'max_item_latency']:
+            nodes[k] = columns[k]
+        comp_attrs = [set(c.get_util_attrs()) for c in comps]
+        for attr in sorted(set().union(*comp_attrs)):
+            util = np.array((solver or self).get_utilization(names, attr), dtype=float)
+            util[[attr not in a for a in comp_attrs]] = np.nan
+            nodes['util_' + attr] = util
+
+        rows = []
+        for (i, n) in enumerate(names):
+            if comps[i].type not in (comptype.producer, comptype.channel, comptype.function):
+                continue
+            for (port, d) in enumerate(comps[i].get_dests()):
+                if isinstance(d, Function.Arg):
+                    (dst, dst_port) = (d.get_func().name, d.get_num())
+                elif isinstance(d, SimComp):
+                    (dst, dst_port) = (d.name, 0)
+                else:
+                    continue    # Not connected
+                if comps[i].type == comptype.function:
+                    # Outputs of functions are not tracked individually
+                    rows.append((n, dst, port, dst_port, float('nan'),
+                                 comps[i].get_latency(port) / self.__tick_rate))
+                else:
+                    rows.append((n, dst, 0, dst_port, nodes['byte_rate'][i], nodes['latency'][i]))
+        edges = collections.OrderedDict()
+        edges['src'] = np.array([r[0] for r in rows], dtype=str)
+        edges['dst'] = np.array([r[1] for r in rows], dtype=str)
+        edges['src_id'] = np.array([ids[r[0]] for r in rows], dtype=int)
+        edges['dst_id'] = np.array([ids[r[1]] for r in rows], dtype=int)
+        edges['src_port'] = np.array([r[2] for r in rows], dtype=int)
+        edges['dst_port'] = np.array([r[3] for r in rows], dtype=int)
+        edges['byte_rate'] = np.array([r[4] for r in rows], dtype=float)
+        edges['latency'] = np.array([r[5] for r in rows], dtype=float)
+        return (nodes, edges)
+
+    def export_graph(self, prefix, fmt='npz', solver=None):
+        """
+        Writes the node and edge tables (see get_graph_tables) for offline
+        analysis and returns the names of the files written:
+        - npz: Compressed NumPy archive prefix.npz that holds the columns
+          as nodes_<column> and edges_<column> arrays
+        - parquet: prefix_nodes.parquet and prefix_edges.parquet
+        - arrow: prefix_nodes.arrow and prefix_edges.arrow (Arrow IPC files)
+        The parquet and arrow formats require pyarrow.
+        """
+        if fmt not in self.GRAPH_FORMATS:
+            raise RuntimeError('Invalid graph format: ' + fmt)
+        tables = dict(zip(['nodes', 'edges'], self.get_graph_tables(solver)))
+        if fmt == 'npz':
+            arrays = dict()
+            for (t, columns) in tables.items():
+                for (k, v) in columns.items():
+                    arrays[t + '_' + k] = v
+            np.savez_compressed(prefix + '.npz', **arrays)
+            return [prefix + '.npz']
+        try:
+            import pyarrow
+            import pyarrow.feather
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('The %s graph format requires pyarrow' % fmt)
+        filenames = []
+        for t in ['nodes', 'edges']:
+            table = pyarrow.table(collections.OrderedDict(
+                (k, v.tolist() if v.dtype.kind == 'U' else v) for (k, v) in tables[t].items()))
+            filenames.append('%s_%s.%s' % (prefix, t, fmt))
+            if fmt == 'parquet':
+                pyarrow.parquet.write_table(table, filenames[-1])
+            else:
+                pyarrow.feather.write_feather(table, filenames[-1])
+        return filenames
+
 class SimComp:
     """
     Base simulation component:
     All components must inherit from SimComp.
     """
 
-    def __init__(self, sim_core, name, ctype):
+    def __init__(self, sim_core, name, ctype, tick_aware=False):
         self.__sim_core = sim_core
         self.name = name
         self.type = ctype
-        self.__sim_core.register(self, (ctype == comptype.producer))
+        self.loc_id = DataStream.intern_location(name)
+        self.__sim_core.register(self, (ctype == comptype.producer) or tick_aware)
 
     def get_ticks(self):
         return self.__sim_core.get_ticks()
@@ -170,6 +1751,56 @@ class SimComp:
     def get_tick_rate(self):
         return self.__sim_core.get_tick_rate()
 
+    def get_coalesce_factor(self):
+        return self.__sim_core.get_coalesce_factor()
+
+    def observe_every_period(self):
+        self.__sim_core.observe_every_period()
+
+    def get_util_db(self):
+        return self.__sim_core.get_util_db()
+
+    def new_telemetry_recorder(self):
+        return self.__sim_core.new_telemetry_recorder()
+
+    def get_retention_policy(self):
+        return self.__sim_core.get_retention_policy()
+
+    def get_latency_histograms(self):
+        return self.__sim_core.get_latency_histograms()
+
+    def get_packet_size(self):
+        return self.__sim_core.get_packet_size()
+
+    def get_telemetry(self):
+        raise self.SimCompError('Telemetry is not supported or not enabled.')
+
+    def bind_telemetry(self):
+        """
+        Swaps in traced versions of methods if telemetry is enabled.
+        Called on construction and after a snapshot is restored.
+        """
+        pass
+
+    def export_results(self):
+        """
+        Returns the results of a partitioned simulation run that are not
+        in the utilization database (None if there are none)
+        """
+        return None
+
+    def import_results(self, results):
+        pass
+
+    def __getstate__(self):
+        # Methods that are rebound per instance are not picklable
+        return dict((k, v) for (k, v) in self.__dict__.items()
+                    if not isinstance(v, types.MethodType))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bind_telemetry()
+
     def SimCompError(self, msg):
         raise RuntimeError(msg + ' [' + self.name + ']')
 
@@ -216,60 +1847,338 @@ class HwRsrcs():
         else:
             self.__rsrcs = dict()
 
+class BoundedCache():
+    """
+    Memoization Cache:
+    A dictionary that holds at most max_size entries. The least
+    recently used entry is evicted when it is full.
+    """
+
+    def __init__(self, max_size):
+        self.__max_size = max_size
+        self.__entries = collections.OrderedDict()
+
+    def get(self, key):
+        value = self.__entries.pop(key, None)
+        if value is not None:
+            self.__entries[key] = value     # Most recently used goes last
+        return value
+
+    def put(self, key, value):
+        self.__entries.pop(key, None)
+        self.__entries[key] = value
+        if len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        self.__entries.clear()
+
+@functools.total_ordering
+class SubMatrix(object):
+    """
+    Submatrix Stream Item:
+    Identifies a block of a matrix using a matrix ID and a tuple of
+    coordinates where each coordinate is a tuple of indices along one
+    dimension. The string representation (ex: pp[(0,1);(5)]) is only
+    rendered for display. Unpacks like a (matrix_id, coords) tuple.
+    Submatrices are ordered by (matrix_id, coords) and against other
+    (string) items by their string representation.
+    """
+    __slots__ = ['matrix_id', 'coords', '__hash']
+
+    def __init__(self, matrix_id, coords):
+        self.matrix_id = matrix_id
+        self.coords = coords
+        self.__hash = hash((matrix_id, coords))
+
+    def __iter__(self):
+        return iter((self.matrix_id, self.coords))
+
+    def __reduce__(self):
+        # String hashes are salted per process so the hash is recomputed
+        return (SubMatrix, (self.matrix_id, self.coords))
+
+    def __hash__(self):
+        return self.__hash
+
+    def __eq__(self, other):
+        if not isinstance(other, SubMatrix):
+            return False
+        return (self.__hash == hash(other) and self.matrix_id == other.matrix_id and
+                self.coords == other.coords)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        if not isinstance(other, SubMatrix):
+            return str(self) < str(other)
+        return (self.matrix_id, self.coords) < (other.matrix_id, other.coords)
+
+    def __gt__(self, other):
+        # Called for the reflected comparison of a string with a submatrix
+        if not isinstance(other, SubMatrix):
+            return str(self) > str(other)
+        return (self.matrix_id, self.coords) > (other.matrix_id, other.coords)
+
+    def __str__(self):
+        return DataStream.submatrix_str(self)
+
+    def __repr__(self):
+        return 'SubMatrix(' + str(self) + ')'
+
 class DataStream:
     """
     Data Stream Object:
     Holds information about a date stream that passes through various block.
     The simulator simulates event on the actual stream so each stream Object
     must have a unique payload (items) to disambiguate it from the rest.
+
+    Streams are cheap to fork: The hops are an immutable chain of Hop
+    objects linked to their parent and the items are an immutable tuple.
+    Both are shared between forks. Adding a hop (or assigning new items)
+    only changes the stream it is called on.
+
+    Hop locations are interned into integer IDs that are shared by
+    all streams in the simulation. Routes and their latency profiles
+    are interned as well because most streams take the same route
+    with the same latencies over and over again. They are only interned
+    to save memory so they are kept in bounded caches that can be cleared
+    (see SimulatorCore.release) at any time.
     """
     HopInfo = collections.namedtuple('HopInfo', ['location', 'latency'])
 
-    class HopDb():
-        def __init__(self, hops):
-            self.__hops = hops
+    INTERN_CACHE_SIZE = 65536
+    __location_ids = dict()
+    __locations = list()
+    __paths = BoundedCache(INTERN_CACHE_SIZE)
+    __latency_profiles = BoundedCache(INTERN_CACHE_SIZE)
+
+    @classmethod
+    def intern_location(cls, location):
+        """
+        Returns the integer ID for a hop location string
+        """
+        loc_id = cls.__location_ids.get(location)
+        if loc_id is None:
+            loc_id = len(cls.__locations)
+            cls.__location_ids[location] = loc_id
+            cls.__locations.append(location)
+        return loc_id
+
+    @classmethod
+    def get_location(cls, loc_id):
+        return cls.__locations[loc_id]
+
+    @classmethod
+    def find_location(cls, location):
+        return cls.__location_ids.get(location)
+
+    @classmethod
+    def get_intern_tables(cls):
+        # Paths and latency profiles are pickled with the streams that use them
+        return list(cls.__locations)
+
+    @classmethod
+    def merge_intern_tables(cls, locations):
+        """
+        Merges interning tables from get_intern_tables() (from another
+        process) into this one. Location IDs must agree.
+        """
+        num_common = min(len(locations), len(cls.__locations))
+        if locations[:num_common] != cls.__locations[:num_common]:
+            raise RuntimeError('Hop location IDs do not match. Cannot merge interning tables.')
+        for location in locations[num_common:]:
+            cls.intern_location(location)
+
+    @classmethod
+    def clear_intern_caches(cls):
+        cls.__paths.clear()
+        cls.__latency_profiles.clear()
+
+    @classmethod
+    def get_intern_cache_sizes(cls):
+        return (len(cls.__paths), len(cls.__latency_profiles))
+
+    @classmethod
+    def intern_path(cls, loc_ids):
+        path = cls.__paths.get(loc_ids)
+        if path is None:
+            path = cls.__paths.put(loc_ids, cls.HopPath(loc_ids))
+        return path
+
+    @classmethod
+    def intern_latency_profile(cls, accum_latency):
+        profile = cls.__latency_profiles.get(accum_latency)
+        if profile is None:
+            profile = cls.__latency_profiles.put(accum_latency, array.array('d', accum_latency))
+        return profile
+
+    class Hop(object):
+        """
+        A single link in a hop chain. Hops are shared between streams
+        so they must never be modified after they are created.
+        """
+        __slots__ = ['loc_id', 'latency', 'parent', 'root', 'accum_latency', 'depth']
+
+        def __init__(self, loc_id, latency, parent=None):
+            self.loc_id = loc_id
+            self.latency = latency
+            self.parent = parent
+            if parent:
+                self.root = parent.root
+                self.accum_latency = parent.accum_latency + latency
+                self.depth = parent.depth + 1
+            else:
+                # The root hop holds the init timestamp, not a latency
+                self.root = self
+                self.accum_latency = 0
+                self.depth = 0
+
+        @property
+        def location(self):
+            return DataStream.get_location(self.loc_id)
+
+        def to_list(self):
+            hops = [None] * (self.depth + 1)
+            hop = self
+            while hop:
+                hops[hop.depth] = hop
+                hop = hop.parent
+            return hops
+
+    class HopPath(object):
+        """
+        Interned sequence of hop locations (a route)
+        """
+        __slots__ = ['loc_ids', 'first_hop']
+
+        def __init__(self, loc_ids):
+            self.loc_ids = array.array('i', loc_ids)
+            self.first_hop = dict()
+            for i in reversed(range(len(loc_ids))):
+                self.first_hop[loc_ids[i]] = i
+
+    class HopDb(object):
+        """
+        Compact copy of a hop chain:
+        The route is an interned HopPath and the latencies are an interned
+        prefix sum so the latency up to any hop can be looked up in
+        constant time. Only the init timestamp is unique to a HopDb so the
+        owner can reuse it for another chain along the same route (update).
+        """
+        __slots__ = ['__init_ticks', '__path', '__accum_latency']
+
+        def __init__(self, last_hop):
+            hops = last_hop.to_list()
+            self.__init_ticks = last_hop.root.latency
+            self.__path = DataStream.intern_path(tuple([h.loc_id for h in hops]))
+            self.__accum_latency = DataStream.intern_latency_profile(
+                tuple([h.accum_latency for h in hops]))
+
+        def update(self, last_hop, loc_id, latency):
+            """
+            Takes the init timestamp from the hop chain that ends with
+            last_hop followed by a hop at loc_id if it has the same route
+            and latencies. Returns False (without changes) if it does not.
+            """
+            loc_ids = self.__path.loc_ids
+            i = len(loc_ids) - 1
+            if (last_hop.depth != i - 1 or loc_ids[i] != loc_id or
+                    self.__accum_latency[i] != last_hop.accum_latency + latency):
+                return False
+            hop = last_hop
+            while hop is not None:
+                i -= 1
+                if loc_ids[i] != hop.loc_id or self.__accum_latency[i] != hop.accum_latency:
+                    return False
+                hop = hop.parent
+            self.__init_ticks = last_hop.root.latency
+            return True
+
+        def rebase(self, ticks):
+            self.__init_ticks += ticks
 
         def get_src(self):
-            return self.__hops[0].location
+            return DataStream.get_location(self.__path.loc_ids[0])
 
         def get_dst(self):
-            return self.__hops[-1].location
+            return DataStream.get_location(self.__path.loc_ids[-1])
 
         def get_hops(self):
-            hoparr = []
-            for h in self.__hops:
-                hoparr.append(h.location)
-            return hoparr
+            return [DataStream.get_location(i) for i in self.__path.loc_ids]
 
         def get_latency(self, ticks, location = ''):
-            latency = ticks - self.__hops[0].latency    #Hop0 always has the init timestamp
-            if (self.__hops[0].location != location):
-                for i in range(1,len(self.__hops)):
-                    latency += self.__hops[i].latency
-                    if (self.__hops[i].location == location):
-                        break
+            latency = ticks - self.__init_ticks    #Hop0 always has the init timestamp
+            if (self.get_src() != location):
+                hop_i = self.__path.first_hop.get(DataStream.find_location(location), -1)
+                latency += self.__accum_latency[hop_i]
             return latency
 
     def __init__(self, bpi, items, count, producer=None, parent=None):
         self.bpi = bpi
-        self.items = []
-        self.items.extend(items)
+        self.items = tuple(items)
         self.count = count
-        self.__hops = list()
         if producer and parent:
             raise RuntimeError('Data stream cannot have both a producer and a parent stream')
         elif producer:
-            self.__hops.append(self.HopInfo(location='Gen@'+producer.name, latency=producer.get_ticks()))
+            self.__last_hop = self.Hop(producer.get_gen_loc_id(), producer.get_ticks())
         elif parent:
-            self.__hops.extend(parent.get_hops())
+            self.__last_hop = parent.get_last_hop()
         else:
             raise RuntimeError('Data stream must have a producer or a parent stream')
 
+    def fork(self):
+        """
+        Returns a new stream that shares the hops and items of this one
+        """
+        return copy.copy(self)
+
     def add_hop(self, location, latency):
-        self.__hops.append(self.HopInfo(location=location, latency=latency))
+        self.__last_hop = self.Hop(self.intern_location(location), latency, self.__last_hop)
+
+    def add_hop_id(self, loc_id, latency):
+        self.__last_hop = self.Hop(loc_id, latency, self.__last_hop)
+
+    def get_last_hop(self):
+        return self.__last_hop
 
     def get_hops(self):
-        return self.__hops
+        return [self.HopInfo(location=h.location, latency=h.latency)
+                for h in self.__last_hop.to_list()]
+
+    def get_hop_db(self):
+        return self.HopDb(self.__last_hop)
+
+    def get_latency(self, ticks):
+        return ticks - self.__last_hop.root.latency + self.__last_hop.accum_latency
+
+    @staticmethod
+    def rebase(streams, ticks):
+        """
+        Returns copies of streams with their init timestamp moved by ticks,
+        for streams that were delivered ticks late (ex: from another
+        partition) so that the delay is not counted as latency. Hops are
+        shared by reference so the hop chains are copied, not modified.
+        """
+        new_hops = dict()
+        def rebase_hop(hop):
+            if id(hop) not in new_hops:
+                if hop.parent is None:
+                    new_hops[id(hop)] = DataStream.Hop(hop.loc_id, hop.latency + ticks)
+                else:
+                    new_hops[id(hop)] = DataStream.Hop(hop.loc_id, hop.latency, rebase_hop(hop.parent))
+            return new_hops[id(hop)]
+        rebased = []
+        for data in streams:
+            new_data = data.fork()
+            new_data.__last_hop = rebase_hop(data.get_last_hop())
+            rebased.append(new_data)
+        return rebased
 
     def get_bytes(self):
         return self.bpi * len(self.items) * self.count
@@ -277,29 +2186,159 @@ class DataStream:
     """
     Type specific methods
     """
+    SUBMATRIX_CACHE_SIZE = 4096
+    __submatrix_parse_cache = BoundedCache(SUBMATRIX_CACHE_SIZE)
+    __submatrix_str_cache = BoundedCache(SUBMATRIX_CACHE_SIZE)
+
     @staticmethod
     def submatrix_gen(matrix_id, coordinates):
         coord_arr = []
         for c in coordinates:
-            if isinstance(c, collections.Iterable):
-                coord_arr.append('(' + (','.join(str(x) for x in c)) + ')')
+            if isinstance(c, Iterable):
+                coord_arr.append(tuple(c))
             else:
-                coord_arr.append('(' + str(c) + ')')
-        return matrix_id + '[' + ';'.join(coord_arr) + ']'
-
-    @staticmethod
-    def submatrix_parse(stream_id):
-        m = re.match('(.+)\[(.*)\]', stream_id)
-        matrix_id = m.group(1)
-        coords = []
-        for cstr in m.group(2).split(';'):
-            coords.append([int(x) for x in re.match('\((.+)\)', cstr).group(1).split(',')])
-        return (matrix_id, coords)
+                coord_arr.append((c,))
+        return SubMatrix(matrix_id, tuple(coord_arr))
+
+    @classmethod
+    def submatrix_parse(cls, stream_id):
+        """
+        Returns a (matrix_id, coords) SubMatrix for a stream item. Legacy
+        string items are parsed once and then looked up in a cache.
+        """
+        if isinstance(stream_id, SubMatrix):
+            return stream_id
+        submatrix = cls.__submatrix_parse_cache.get(stream_id)
+        if submatrix is None:
+            m = re.match('(.+)\[(.*)\]', stream_id)
+            matrix_id = m.group(1)
+            coords = []
+            for cstr in m.group(2).split(';'):
+                coords.append(tuple(int(x) for x in re.match('\((.+)\)', cstr).group(1).split(',')))
+            submatrix = cls.__submatrix_parse_cache.put(stream_id, SubMatrix(matrix_id, tuple(coords)))
+        return submatrix
+
+    @classmethod
+    def item_key(cls, table, item):
+        """
+        Returns the key of item in a dict of results keyed by stream items.
+        Submatrix items can also be looked up by their string (ex: tx[(0)]).
+        """
+        if item in table or not isinstance(item, str) or not re.match(r'.+\[.*\]$', item):
+            return item
+        return cls.submatrix_parse(item)
+
+    @classmethod
+    def submatrix_str(cls, submatrix):
+        rendered = cls.__submatrix_str_cache.get(submatrix)
+        if rendered is None:
+            coord_arr = ['(' + (','.join(str(x) for x in c)) + ')' for c in submatrix.coords]
+            rendered = cls.__submatrix_str_cache.put(
+                submatrix, submatrix.matrix_id + '[' + ';'.join(coord_arr) + ']')
+        return rendered
 
 #------------------------------------------------------------
 # Basic Network components
 #------------------------------------------------------------
 
+class ReadyTracker():
+    """
+    Readiness Tracker:
+    Caches the readiness of a component (and everything downstream of
+    it) so that readiness queries don't have to walk the graph. The
+    readiness of a component is a (dead, busy, ready tick) state:
+    - dead: It will not be ready until something is connected to it
+    - busy: It is holding data and is waiting on something else
+    - ready tick: It is not ready before this tick
+    The state combines the component's own state with the states of the
+    trackers of its destinations (that it watches). A change invalidates
+    the cached state of the tracker and of everything upstream of it that
+    is still valid. Invalid states are recomputed when they are queried.
+    So the work per tick is proportional to the number of components that
+    changed, not to the size of the graph. Destinations that don't have a
+    tracker are always ready.
+    """
+    READY = (False, False, 0)
+
+    def __init__(self):
+        self.__dests = list()
+        self.__watchers = list()
+        self.__own = self.READY
+        self.__state = self.READY
+        self.__valid = True
+
+    def get_state(self):
+        if not self.__valid:
+            (dead, busy, tick) = self.__own
+            for d in self.__dests:
+                (d_dead, d_busy, d_tick) = d.get_state()
+                dead = dead or d_dead
+                busy = busy or d_busy
+                if d_tick > tick:
+                    tick = d_tick
+            self.__state = (dead, busy, tick)
+            self.__valid = True
+        return self.__state
+
+    def is_ready(self, ticks):
+        (dead, busy, tick) = self.get_state()
+        return not (dead or busy) and ticks >= tick
+
+    def get_ready_tick(self, ticks):
+        """
+        Returns the earliest tick (>= ticks) at which the component
+        could be ready or None if it will never be ready
+        """
+        (dead, busy, tick) = self.get_state()
+        if dead:
+            return None
+        return max(ticks + 1 if busy else ticks, tick)
+
+    def watch(self, dest):
+        if dest is not None:
+            self.__dests.append(dest)
+            dest.__watchers.append(self)
+            self.invalidate()
+
+    def unwatch(self, dest):
+        if dest is not None:
+            self.__dests.remove(dest)
+            dest.__watchers.remove(self)
+            self.invalidate()
+
+    def update(self, dead=False, busy=False, tick=0):
+        """
+        Updates the component's own state
+        """
+        own = (dead, busy, tick)
+        if own != self.__own:
+            self.__own = own
+            self.invalidate()
+
+    def invalidate(self):
+        # Everything upstream of an invalid state is invalid already
+        if self.__valid:
+            self.__valid = False
+            for w in self.__watchers:
+                w.invalidate()
+
+    def __getstate__(self):
+        # Pickling the watchers would walk the whole graph back and forth
+        # (recursively). They are restored from the destinations instead.
+        state = self.__dict__.copy()
+        del state['_ReadyTracker__watchers']
+        return state
+
+    def __setstate__(self, state):
+        # With readiness cycles, a destination can be restored before or
+        # after its watchers so this works in either order. The cached
+        # states are recomputed when they are first queried.
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_ReadyTracker__watchers', list())
+        self.__valid = False
+        for d in self.__dests:
+            d.__dict__.setdefault('_ReadyTracker__watchers', list()).append(self)
+
 # Producer object.
 class Producer(SimComp):
     """
@@ -311,13 +2350,21 @@ class Producer(SimComp):
         SimComp.__init__(self, sim_core, name, comptype.producer)
         self.__bpi = bpi
         self.__items = items
-        self.__bw = max_samp_rate * bpi
-        self.__latency = latency
+        self.__latency = fixed_ticks(latency)
         self.__dests = list()
         self.__data_count = 0
-        self.__byte_count = 0
+        self.__util_db = self.get_util_db()
+        self.__util_id = self.__util_db.add(name, max_samp_rate * bpi, self.__latency)
+        self.__byte_counts = self.__util_db.get_byte_counts()
         self.__backpressure_ticks = 0
+        self.__last_tick = self.get_ticks()
+        self.__parked = False
+        self.__gen_loc_id = DataStream.intern_location('Gen@' + name)
+        self.__bp_loc_id = DataStream.intern_location('BP@' + name)
         self.set_rate(self.get_tick_rate())
+        self.__telemetry = self.new_telemetry_recorder()
+        self.__telemetry_tick = self.get_ticks()
+        self.bind_telemetry()
 
     def inputs(self, i, bind=False):
         raise self.SimCompError('This is a producer block. Cannot connect another block to it.')
@@ -326,36 +2373,118 @@ class Producer(SimComp):
         self.__dests.append(dest)
 
     def set_rate(self, samp_rate):
-        self.__data_count = samp_rate / self.get_tick_rate()
+        self.__data_count = fixed_count(samp_rate / self.get_tick_rate())
+
+    def get_data_count(self):
+        return self.__data_count
+
+    def replace_dest(self, dest, new_dest):
+        self.__dests[[d is dest for d in self.__dests].index(True)] = new_dest
+
+    def get_dests(self):
+        return list(self.__dests)
+
+    def create_data_stream(self, count, backpressure_ticks=0):
+        """
+        Returns a new stream with count samples per item that has already
+        passed through this producer after backpressure_ticks of stalling
+        """
+        data = DataStream(bpi=self.__bpi, items=self.__items, count=count, producer=self)
+        if backpressure_ticks > 0:
+            data.add_hop_id(self.__bp_loc_id, backpressure_ticks)
+        data.add_hop_id(self.loc_id, self.__latency)
+        return data
 
     def tick(self):
+        """
+        Push data downstream if all destinations are ready.
+        Returns the next tick at which this producer should be woken
+        up or None if it will never be ready again.
+        """
         if len(self.__dests) > 0:
+            # Ticks skipped by the event scheduler are always backpressure ticks
+            self.__backpressure_ticks += self.get_ticks() - self.__last_tick - 1
+            self.__last_tick = self.get_ticks()
             ready = True
             for dest in self.__dests:
                 ready = ready and dest.is_ready()
             if ready:
-                data = DataStream(
-                    bpi=self.__bpi, items=self.__items, count=self.__data_count, producer=self)
-                if self.__backpressure_ticks > 0:
-                    data.add_hop('BP@'+self.name, self.__backpressure_ticks)
-                data.add_hop(self.name, self.__latency)
+                data = self.create_data_stream(
+                    self.__data_count * self.get_coalesce_factor(), self.__backpressure_ticks)
                 for dest in self.__dests:
-                    dest.push(copy.deepcopy(data))
-                self.__byte_count += data.get_bytes()
+                    dest.push(data.fork())
+                self.__byte_counts[self.__util_id] += data.get_bytes()
                 self.__backpressure_ticks = 0
             else:
                 self.__backpressure_ticks += 1
+            return self.__get_wake_tick()
+        self.__parked = True
+        return None
+
+    def bind_telemetry(self):
+        if self.__telemetry:
+            self.__tick_untraced = self.tick
+            self.tick = self.__tick_traced
+
+    def __tick_traced(self):
+        ticks = self.get_ticks()
+        self.__trace_skipped(ticks - 1)
+        bytes_before = self.__byte_counts[self.__util_id]
+        wake = self.__tick_untraced()
+        if self.__dests:
+            if self.__backpressure_ticks == 0:
+                self.__telemetry.add(TelemetryRecorder.BYTES, ticks,
+                    self.__byte_counts[self.__util_id] - bytes_before)
+            else:
+                self.__telemetry.add_ready_fail(ticks)
+        self.__telemetry_tick = ticks
+        return wake
+
+    def __trace_skipped(self, ticks):
+        # Ticks skipped by the event scheduler are stall ticks
+        if self.__dests and ticks > self.__telemetry_tick:
+            self.__telemetry.add_span(TelemetryRecorder.STALL_TICKS, self.__telemetry_tick, ticks)
+            self.__telemetry_tick = ticks
+
+    def get_telemetry(self):
+        if not self.__telemetry:
+            return SimComp.get_telemetry(self)
+        self.__trace_skipped(self.get_ticks())
+        return self.__telemetry.get_windows(self.get_ticks())
+
+    def __get_wake_tick(self):
+        wake = self.get_ticks() + 1
+        for dest in self.__dests:
+            dest_tick = dest.get_ready_tick()
+            if dest_tick is None:
+                self.__parked = True
+                return None
+            wake = max(wake, dest_tick)
+        self.__parked = False
+        return wake
+
+    def get_sched_state(self):
+        if self.__parked:
+            return 'parked'
+        return self.__backpressure_ticks + (self.get_ticks() - self.__last_tick)
+
+    def fast_forward(self, ticks):
+        # A parked producer is backpressured during the skipped ticks
+        if not self.__parked:
+            self.__last_tick += ticks
 
     def get_bytes(self):
-        return self.__byte_count
+        return self.__byte_counts[self.__util_id]
+
+    def get_gen_loc_id(self):
+        return self.__gen_loc_id
 
     def get_util_attrs(self):
         return ['bandwidth']
 
     def get_utilization(self, what):
         if what in self.get_util_attrs():
-            return ((self.__byte_count / (self.get_ticks() / self.get_tick_rate())) /
-                    self.__bw)
+            return self.__util_db.get_comp_utilization(self.__util_id, self.get_ticks())
         else:
             return 0.0
 
@@ -363,15 +2492,34 @@ class Producer(SimComp):
 class Consumer(SimComp):
     """
     Consumes Block:
-    Consumes data at a constant rate
+    Consumes data at a constant rate. The hops of the latest stream of
+    every item are kept. Unless latency histograms are disabled in the
+    simulator, the latency of every stream on arrival is also counted in
+    a LatencySketch per item. Depending on the retention policy of the
+    simulator, the consumer also keeps for every item:
+    - latest: Nothing else
+    - reservoir: A uniform random sample of up to reservoir_size hop
+      histories (with their latency on arrival) of all streams
+    The memory used does not grow with the length of the simulation.
+    Histogram samples are weighted by the coalesce factor. A reservoir
+    cannot sample the skipped periods so it disables coalescing.
     """
+    RETENTION_POLICIES = ['latest', 'reservoir']
 
     def __init__(self, sim_core, name, bw = float("inf"), latency = 0):
         SimComp.__init__(self, sim_core, name, comptype.consumer)
-        self.__byte_count = 0
         self.__item_db = dict()
-        self.__bw = bw
-        self.__latency = latency
+        self.__hop_dbs = dict()     # Items tuple -> latest HopDb (for reuse)
+        (self.__retention, self.__reservoir_size) = self.get_retention_policy()
+        self.__samples = dict()     # Item -> [count, [(arrival tick, HopDb)]]
+        if self.__retention == 'reservoir':
+            self.observe_every_period()
+        self.__histograms = dict() if self.get_latency_histograms() else None
+        self.__rng = random.Random(name)
+        self.__latency = fixed_ticks(latency)
+        self.__util_db = self.get_util_db()
+        self.__util_id = self.__util_db.add(name, bw, self.__latency)
+        self.__byte_counts = self.__util_db.get_byte_counts()
         self.__bound = False
 
     def inputs(self, i, bind=False):
@@ -386,33 +2534,145 @@ class Consumer(SimComp):
     def is_ready(self):
         return True #TODO: Readiness can depend on bw and byte_count
 
+    def get_ready_tick(self):
+        return self.get_ticks()
+
+    def get_ready_tracker(self):
+        return None     # Always ready
+
     def push(self, data):
-        data.add_hop(self.name, self.__latency)
+        last_hop = data.get_last_hop()
+        hop_db = self.__hop_dbs.get(data.items)
+        # Streams usually take the same route every time. Only the init
+        # timestamp needs to be updated then (no allocations).
+        if hop_db is None or not hop_db.update(last_hop, self.loc_id, self.__latency):
+            data.add_hop_id(self.loc_id, self.__latency)
+            hop_db = data.get_hop_db()
+            self.__hop_dbs[data.items] = hop_db
         for item in data.items:
-            self.__item_db[item] = DataStream.HopDb(data.get_hops())
-        self.__byte_count += data.get_bytes()
+            self.__item_db[item] = hop_db
+        if self.__histograms is not None:
+            # A coalesced push stands for the (identical) pushes of many periods
+            latency = data.get_latency(self.get_ticks()) + self.__latency
+            periods = self.get_coalesce_factor()
+            for item in data.items:
+                sketch = self.__histograms.get(item)
+                if sketch is None:
+                    sketch = self.__histograms[item] = LatencySketch()
+                sketch.add(latency, periods)
+        if self.__retention == 'reservoir':
+            self.__sample(data, last_hop)
+        self.__byte_counts[self.__util_id] += data.get_bytes()
+
+    def __sample(self, data, last_hop):
+        # Reservoir sampling (algorithm R) of the hop histories of each item
+        sample = None
+        for item in data.items:
+            reservoir = self.__samples.get(item)
+            if reservoir is None:
+                reservoir = self.__samples[item] = [0, []]
+            reservoir[0] += 1
+            if len(reservoir[1]) < self.__reservoir_size:
+                slot = len(reservoir[1])
+                reservoir[1].append(None)
+            else:
+                slot = self.__rng.randrange(reservoir[0])
+                if slot >= self.__reservoir_size:
+                    continue
+            if sample is None:
+                # The latest HopDb is updated in place so it cannot be kept
+                hop = DataStream.Hop(self.loc_id, self.__latency, last_hop)
+                sample = (self.get_ticks(), DataStream.HopDb(hop))
+            reservoir[1][slot] = sample
 
     def get_items(self):
         return list(self.__item_db.keys())
 
+    def export_results(self):
+        return (self.__item_db, self.__samples, self.__histograms)
+
+    def rebase(self, ticks):
+        """
+        Shifts the timestamps of all kept streams by ticks (for partitions
+        in which everything arrives late by the same number of ticks)
+        """
+        hop_dbs = dict((id(h), h) for h in self.__item_db.values())
+        for reservoir in self.__samples.values():
+            hop_dbs.update((id(h), h) for (tick, h) in reservoir[1])
+            reservoir[1] = [(tick + ticks, h) for (tick, h) in reservoir[1]]
+        for h in hop_dbs.values():
+            h.rebase(ticks)
+
+    def import_results(self, results):
+        self.__item_db.update(results[0])
+        self.__samples.update(results[1])
+        if self.__histograms is not None:
+            self.__histograms.update(results[2])
+
+    def get_retention(self):
+        return self.__retention
+
     def get_bytes(self):
-        return self.__byte_count
+        return self.__byte_counts[self.__util_id]
 
     def get_hops(self, item):
-        return self.__item_db[item].get_hops()
+        return self.__item_db[DataStream.item_key(self.__item_db, item)].get_hops()
 
     def get_latency(self, item, hop=None):
+        item = DataStream.item_key(self.__item_db, item)
         if not hop:
             hop = self.get_hops(item)[-1]
         return self.__item_db[item].get_latency(self.get_ticks(), hop) / self.get_tick_rate()
 
+    def get_latency_history(self, item):
+        """
+        Returns a list of (arrival time, latency, hops) for the sampled
+        streams of item (reservoir retention only)
+        """
+        if self.__retention != 'reservoir':
+            raise self.SimCompError('Latency histories are only kept with reservoir retention.')
+        item = DataStream.item_key(self.__samples, item)
+        if item not in self.__samples:
+            return []
+        history = []
+        for (tick, hop_db) in sorted(self.__samples[item][1], key=lambda x: x[0]):
+            hops = hop_db.get_hops()
+            history.append((tick / self.get_tick_rate(),
+                            hop_db.get_latency(tick, hops[-1]) / self.get_tick_rate(), hops))
+        return history
+
+    def get_sample_count(self, item):
+        """
+        Returns the number of streams of item that the reservoir was
+        sampled from (reservoir retention only)
+        """
+        if self.__retention != 'reservoir':
+            raise self.SimCompError('Samples are only kept with reservoir retention.')
+        item = DataStream.item_key(self.__samples, item)
+        return self.__samples[item][0] if item in self.__samples else 0
+
+    def get_latency_stats(self, item, percentiles=(50, 99, 99.9)):
+        """
+        Returns a dict with the count, min, mean, max and the specified
+        percentiles (keyed by 'p<percentile>') of the latency of item on
+        arrival in seconds
+        """
+        if self.__histograms is None:
+            raise self.SimCompError('Latency histograms are disabled.')
+        sketch = self.__histograms.get(DataStream.item_key(self.__histograms, item), LatencySketch())
+        to_s = lambda t: t / self.get_tick_rate() if t is not None else None
+        stats = {'count': sketch.get_count(), 'min': to_s(sketch.get_min()),
+                 'mean': to_s(sketch.get_mean()), 'max': to_s(sketch.get_max())}
+        for p in percentiles:
+            stats['p%g' % p] = to_s(sketch.get_percentile(p))
+        return stats
+
     def get_util_attrs(self):
         return ['bandwidth']
 
     def get_utilization(self, what):
         if what in self.get_util_attrs():
-            return ((self.__byte_count / (self.get_ticks() / self.get_tick_rate())) /
-                    self.__bw)
+            return self.__util_db.get_comp_utilization(self.__util_id, self.get_ticks())
         else:
             return 0.0
 
@@ -421,19 +2681,50 @@ class Channel(SimComp):
     """
     A resource limited IO pipe:
     From the data stream perspective, this is a passthrough
+
+    By default, the bandwidth is not enforced and only used to report
+    utilization. If the simulator has a packet size, bandwidth limited
+    channels serialize the bytes pushed into them as packets at bw.
+    Packets are kept as counters (bytes in the packet being filled and
+    bytes in full packets waiting to be serialized), not as objects.
+    Every stream is delayed by the time it takes to serialize the queued
+    packets ahead of it. If buff_size (bytes) is finite, the channel is
+    not ready while the queue holds more than buff_size bytes.
     """
 
-    def __init__(self, sim_core, name, bw = float("inf"), latency = 0, lossy = True):
+    def __init__(self, sim_core, name, bw = float("inf"), latency = 0, lossy = True,
+                 buff_size = float("inf")):
         SimComp.__init__(self, sim_core, name, comptype.channel)
-        self.__bw = bw
-        self.__latency = latency
+        self.__latency = fixed_ticks(latency)
         self.__lossy = lossy
         self.__dests = list()
-        self.__byte_count = 0
+        self.__util_db = self.get_util_db()
+        self.__util_id = self.__util_db.add(name, bw, self.__latency)
+        self.__byte_counts = self.__util_db.get_byte_counts()
         self.__bound = False
+        # If nothing is hooked up to a lossy lane, it will drop data (always ready)
+        self.__ready = ReadyTracker()
+        self.__ready.update(dead=not lossy)
+        self.__packet_size = SimComp.get_packet_size(self) if bw != float('inf') else None
+        if self.__packet_size:
+            self.__buff_size = buff_size
+            self.__bytes_per_tick = float(bw) / self.get_tick_rate()
+            self.__fill = 0.0           # Bytes in the packet being filled
+            self.__queued = 0.0         # Bytes in full packets waiting to be serialized
+            self.__queue_tick = self.get_ticks()
+            self.__peak_queued = 0.0
+        self.__telemetry = self.new_telemetry_recorder()
+        self.bind_telemetry()
 
     def get_bytes(self):
-        return self.__byte_count
+        return self.__byte_counts[self.__util_id]
+
+    def get_packet_size(self):
+        """
+        Returns the packet size (bytes) or None if this channel passes
+        streams through atomically
+        """
+        return self.__packet_size
 
     def inputs(self, i, bind=False):
         if (i != 0):
@@ -445,38 +2736,134 @@ class Channel(SimComp):
 
     def connect(self, i, dest):
         self.__dests.append(dest)
+        self.__ready.watch(dest.get_ready_tracker())
+        self.__ready.update()
+
+    def replace_dest(self, dest, new_dest):
+        self.__dests[[d is dest for d in self.__dests].index(True)] = new_dest
+        self.__ready.unwatch(dest.get_ready_tracker())
+        self.__ready.watch(new_dest.get_ready_tracker())
 
     def is_connected(self):
         return len(self.__dests) > 0
 
+    def get_latency(self):
+        return self.__latency
+
+    def is_lossy(self):
+        return self.__lossy
+
+    def get_dests(self):
+        return list(self.__dests)
+
     def is_bound(self):
         return self.__bound
 
     def is_ready(self):
+        return self.__ready.is_ready(self.get_ticks())
+
+    def get_ready_tick(self):
+        return self.__ready.get_ready_tick(self.get_ticks())
+
+    def get_ready_tracker(self):
+        return self.__ready
+
+    def push(self, data):
         # If nothing is hooked up to a lossy lane, it will drop data
         if self.__lossy and not self.is_connected():
-            return True
-        ready = self.is_connected()
+            return
+        data.add_hop_id(self.loc_id, self.__latency)
         for dest in self.__dests:
-            ready = ready and dest.is_ready()
-        return ready
+            dest.push(data.fork())
+        self.__byte_counts[self.__util_id] += data.get_bytes()
 
-    def push(self, data):
-        # If nothing is hooked up to a lossy lane, it will drop data
+    def __push_packets(self, data):
         if self.__lossy and not self.is_connected():
             return
-        data.add_hop(self.name, self.__latency)
+        nbytes = data.get_bytes()
+        queued = self.__drain()
+        # Wait for the packets ahead of this stream to be serialized
+        data.add_hop_id(self.loc_id, self.__latency + fixed_ticks(queued / self.__bytes_per_tick))
+        # A coalesced push holds the data of many periods but the queue
+        # is in the same state at the end of every period
+        self.__fill += nbytes / self.get_coalesce_factor()
+        full = math.floor(self.__fill / self.__packet_size) * self.__packet_size
+        self.__fill -= full
+        self.__queued = queued + full
+        self.__peak_queued = max(self.__peak_queued, self.__queued)
+        self.__update_ready()
         for dest in self.__dests:
-            dest.push(copy.deepcopy(data))
-        self.__byte_count += data.get_bytes()
+            dest.push(data.fork())
+        self.__byte_counts[self.__util_id] += nbytes
+
+    def __drain(self):
+        # Serialize queued packets up to the current tick
+        ticks = self.get_ticks()
+        if ticks != self.__queue_tick:
+            self.__queued = max(self.__queued - (ticks - self.__queue_tick) * self.__bytes_per_tick, 0.0)
+            self.__queue_tick = ticks
+        return self.__queued
+
+    def __update_ready(self):
+        excess = self.__queued + self.__fill - self.__buff_size
+        tick = 0
+        if excess > 0:
+            tick = self.__queue_tick + int(math.ceil(excess / self.__bytes_per_tick))
+        self.__ready.update(dead=(not self.__lossy and not self.__dests), tick=tick)
+
+    def __get_queue_state(self):
+        # Packets filled with fractional byte counts (ex: by slow streams)
+        # practically never repeat. Don't bother comparing the state then.
+        if self.__fill != int(self.__fill):
+            return None
+        return (self.__drain(), self.__fill)
+
+    def __fast_forward_queue(self, ticks):
+        # The queue is in the same state one period later
+        self.__queue_tick += ticks
+        self.__update_ready()
+
+    def bind_telemetry(self):
+        # Also rebinds the packet mode (first, so that telemetry wraps it)
+        if self.__packet_size:
+            self.push = self.__push_packets
+            # The queue is state that the event scheduler has to compare
+            self.get_sched_state = self.__get_queue_state
+            self.fast_forward = self.__fast_forward_queue
+        if self.__telemetry:
+            self.__is_ready_untraced = self.is_ready
+            self.__push_untraced = self.push
+            self.is_ready = self.__is_ready_traced
+            self.push = self.__push_traced
+
+    def __is_ready_traced(self):
+        ready = self.__is_ready_untraced()
+        if not ready:
+            self.__telemetry.add_ready_fail(self.get_ticks())
+        return ready
+
+    def __push_traced(self, data):
+        bytes_before = self.__byte_counts[self.__util_id]
+        self.__push_untraced(data)
+        self.__telemetry.add(TelemetryRecorder.BYTES, self.get_ticks(),
+            self.__byte_counts[self.__util_id] - bytes_before)
+
+    def get_telemetry(self):
+        if not self.__telemetry:
+            return SimComp.get_telemetry(self)
+        return self.__telemetry.get_windows(self.get_ticks())
 
     def get_util_attrs(self):
+        if self.__packet_size and self.__buff_size != float('inf'):
+            return ['bandwidth', 'peak_occupancy']
         return ['bandwidth']
 
     def get_utilization(self, what):
-        if what in self.get_util_attrs():
-            return ((self.__byte_count / (self.get_ticks() / self.get_tick_rate())) /
-                    self.__bw)
+        if what == 'bandwidth':
+            return self.__util_db.get_comp_utilization(self.__util_id, self.get_ticks())
+        elif what == 'peak_occupancy' and what in self.get_util_attrs():
+            # The push that fills the buffer can overshoot it
+            return min(self.__peak_queued / self.__buff_size, 1.0)
         else:
             return 0.0
 
@@ -486,29 +2873,77 @@ class Function(SimComp):
     A Function Component:
     A function block is something that does anything interesting with a data stream.
     A function can have multiple input and output streams.
+
+    Each input argument is a FIFO that holds up to arg_depth streams.
+    With the default depth of 1, an argument only accepts data when the
+    function is ready to execute and the function executes as soon as all
+    arguments have data. Deeper arguments are elastic buffers: they accept
+    data as long as they have room and the function drains them (on every
+    tick) whenever it is ready. Their average and peak fill level are
+    reported as the occupancy and peak_occupancy utilization attributes.
     """
 
     class Arg:
-        def __init__(self, num, base_func):
+        def __init__(self, num, base_func, depth=1):
             self.__num = num
-            self.__data = None
             self.__base_func = base_func
             self.__bound = False
+            # Ring buffer
+            self.__depth = depth
+            self.__buf = [None] * depth
+            self.__head = 0
+            self.__count = 0
+            # Elastic buffers accept data regardless of the function
+            self.__ready = ReadyTracker()
+            if depth == 1:
+                self.__ready.watch(base_func.get_ready_tracker())
 
         def get_num(self):
             return self.__num
 
+        def get_func(self):
+            return self.__base_func
+
+        def get_depth(self):
+            return self.__depth
+
+        def get_occupancy(self):
+            return self.__count
+
         def is_ready(self):
-            return self.__base_func.is_ready() and not self.__data
+            if self.__depth == 1:
+                return self.__base_func.is_ready() and not self.__count
+            return self.__count < self.__depth
+
+        def get_ready_tick(self):
+            return self.__ready.get_ready_tick(self.__base_func.get_ticks())
+
+        def get_ready_tracker(self):
+            return self.__ready
+
+        def is_empty(self):
+            return not self.__count
+
+        def peek(self):
+            return self.__buf[self.__head] if self.__count else None
 
         def push(self, data):
-            self.__data = data
-            self.__base_func.notify(self.__num)
+            if self.__count == self.__depth:
+                self.__base_func.SimCompError('Input argument ' + str(self.__num) + ' overflowed.')
+            self.__buf[(self.__head + self.__count) % self.__depth] = data
+            self.__count += 1
+            if self.__count == self.__depth:
+                self.__ready.update(busy=True)
+            self.__base_func.notify(self.__num, data)
 
         def pop(self):
-            if self.__data:
-                data = self.__data
-                self.__data = None
+            if self.__count:
+                data = self.__buf[self.__head]
+                self.__buf[self.__head] = None
+                self.__head = (self.__head + 1) % self.__depth
+                self.__count -= 1
+                if self.__count == self.__depth - 1:
+                    self.__ready.update()
                 return data
             else:
                 raise RuntimeError('Nothing to pop.')
@@ -519,21 +2954,37 @@ class Function(SimComp):
             return retval
 
     Latencies = collections.namedtuple('Latencies', ['func','inarg','outarg'])
-
-    def __init__(self, sim_core, name, num_in_args, num_out_args, ticks_per_exec = 1):
-        SimComp.__init__(self, sim_core, name, comptype.function)
-        self.__ticks_per_exec = ticks_per_exec
+    Latencies.__qualname__ = 'Function.Latencies'
+
+    def __init__(self, sim_core, name, num_in_args, num_out_args, ticks_per_exec = 1, arg_depth = 1):
+        # Functions with elastic buffers have to drain them on every tick
+        SimComp.__init__(self, sim_core, name, comptype.function, tick_aware=(arg_depth > 1))
+        # Executions are scheduled on integer ticks. A function that needs
+        # a fraction of a tick more fires on the next tick.
+        self.__ticks_per_exec = max(int(math.ceil(ticks_per_exec)), 1)
         self.__last_exec_ticks = 0
+        self.__arg_depth = arg_depth
+        self.__ready = ReadyTracker()
         self.__in_args = list()
         for i in range(num_in_args):
-            self.__in_args.append(Function.Arg(i, self))
+            self.__in_args.append(Function.Arg(i, self, arg_depth))
         self.__dests = list()
         for i in range(num_out_args):
             self.__dests.append(None)
-        self.__in_args_pushed = dict()
+        self.__update_ready()
+        self.__num_filled_args = 0
+        self.__num_buffered = 0     # Streams in all input arguments
+        # Occupancy of the elastic buffers integrated over ticks
+        self.__occupancy_area = 0.0
+        self.__occupancy_area_tick = self.get_ticks()
+        self.__peak_occupancy = 0
         # Resources required by this function to do its job in one tick
         self.__rsrcs = HwRsrcs()
         self.__latencies = self.Latencies(func=0, inarg=[0]*num_in_args, outarg=[0]*num_out_args)
+        self.__telemetry = self.new_telemetry_recorder()
+        self.__occupancy = 0
+        self.__occupancy_tick = self.get_ticks()
+        self.bind_telemetry()
 
     def get_rsrcs(self):
         return self.__rsrcs
@@ -543,9 +2994,22 @@ class Function(SimComp):
 
     def update_latency(self, func, inarg=None, outarg=None):
         self.__latencies = self.Latencies(
-            func=func,
-            inarg=inarg if inarg else [0]*len(self.__in_args),
-            outarg=outarg if outarg else [0]*len(self.__dests))
+            func=fixed_ticks(func),
+            inarg=[fixed_ticks(l) for l in inarg] if inarg else [0]*len(self.__in_args),
+            outarg=[fixed_ticks(l) for l in outarg] if outarg else [0]*len(self.__dests))
+
+    def get_latencies(self):
+        return self.__latencies
+
+    def get_latency(self, out_i=None):
+        """
+        Returns the latency (in ticks) added to the streams on output
+        out_i (or the largest of all outputs)
+        """
+        outarg = self.__latencies.outarg
+        if out_i is not None:
+            outarg = [outarg[out_i]]
+        return max(self.__latencies.inarg or [0]) + self.__latencies.func + max(outarg or [0])
 
     def inputs(self, i, bind=False):
         if bind and self.__in_args[i].bind(True):
@@ -553,77 +3017,570 @@ class Function(SimComp):
         return self.__in_args[i]
 
     def connect(self, i, dest):
+        if self.__dests[i] is not None:
+            self.__ready.unwatch(self.__dests[i].get_ready_tracker())
         self.__dests[i] = dest
+        self.__ready.watch(dest.get_ready_tracker())
+        self.__update_ready()
+
+    def replace_dest(self, dest, new_dest):
+        self.__dests[[d is dest for d in self.__dests].index(True)] = new_dest
+        self.__ready.unwatch(dest.get_ready_tracker())
+        self.__ready.watch(new_dest.get_ready_tracker())
+
+    def get_in_args(self):
+        return list(self.__in_args)
+
+    def get_dests(self):
+        return list(self.__dests)
+
+    def get_ticks_per_exec(self):
+        return self.__ticks_per_exec
 
     def is_ready(self):
-        ready = len(self.__dests) > 0
-        for dest in self.__dests:
-            ready = ready and dest.is_ready()
-        exec_ready = (self.get_ticks() - self.__last_exec_ticks) >= self.__ticks_per_exec
-        return ready and exec_ready
+        return self.__ready.is_ready(self.get_ticks())
+
+    def get_ready_tick(self):
+        return self.__ready.get_ready_tick(self.get_ticks())
+
+    def get_ready_tracker(self):
+        return self.__ready
+
+    def __update_ready(self):
+        # Called whenever the outputs or the last execution tick change
+        self.__ready.update(dead=(not self.__dests or None in self.__dests),
+                            tick=self.__last_exec_ticks + self.__ticks_per_exec)
+
+    def get_sched_state(self):
+        # Data in flight makes the state hard to compare. Don't bother.
+        # Skipping periods would also skip the buffer occupancy in them.
+        if self.__num_buffered or self.__arg_depth > 1:
+            return None
+        return min(self.get_ticks() - self.__last_exec_ticks, self.__ticks_per_exec)
+
+    def fast_forward(self, ticks):
+        self.__last_exec_ticks += ticks
+        self.__update_ready()
+
+    def evaluate(self, arg_data_in):
+        """
+        Calls the function on one set of input streams and returns
+        the output streams after they have passed through this function
+        """
+        max_in_latency = 0
+        self.__max_latency_input = None
+        for d in arg_data_in:
+            lat = d.get_latency(self.get_ticks())
+            if lat > max_in_latency:
+                max_in_latency = lat
+                self.__max_latency_input = d
+        arg_data_out = self.do_func(arg_data_in)
+        if not isinstance(arg_data_out, Iterable):
+            arg_data_out = [arg_data_out]
+        for i in range(len(arg_data_out)):
+            arg_data_out[i].add_hop_id(self.loc_id,
+                max(self.__latencies.inarg) + self.__latencies.func + self.__latencies.outarg[i])
+        return arg_data_out
 
     def create_outdata_stream(self, bpi, items, count):
         return DataStream(
             bpi=bpi, items=items, count=count, parent=self.__max_latency_input)
 
-    def notify(self, arg_i):
-        self.__in_args_pushed[arg_i] = True
+    def notify(self, arg_i, data):
+        """
+        Called by input argument arg_i after data was pushed into it
+        """
+        occupancy = self.__in_args[arg_i].get_occupancy()
+        if occupancy == 1:
+            self.__num_filled_args += 1
+        if self.__arg_depth > 1:
+            self.__update_occupancy()
+            self.__peak_occupancy = max(self.__peak_occupancy, occupancy)
+        self.__num_buffered += 1
+        self.__execute()
+
+    def tick(self):
+        # Only functions with elastic buffers are ticked
+        self.__execute()
+        return self.get_ticks() + 1 if self.__num_buffered else None
+
+    def __execute(self):
         # Wait for all input args to come in
-        if (sorted(self.__in_args_pushed.keys()) == list(range(len(self.__in_args)))):
+        while self.__num_filled_args == len(self.__in_args):
+            if self.__arg_depth > 1 and not self.is_ready():
+                return
             # Pop data out of each input arg
-            max_in_latency = 0
-            self.__max_latency_input = None
-            arg_data_in = list()
-            for arg in self.__in_args:
-                d = arg.pop()
-                arg_data_in.append(d)
-                lat = DataStream.HopDb(d.get_hops()).get_latency(self.get_ticks())
-                if lat > max_in_latency:
-                    max_in_latency = lat
-                    self.__max_latency_input = d
-            # Call the function
-            arg_data_out = self.do_func(arg_data_in)
-            if not isinstance(arg_data_out, collections.Iterable):
-                arg_data_out = [arg_data_out]
-            # Update output args
+            if self.__arg_depth > 1:
+                self.__update_occupancy()
+            arg_data_in = [arg.pop() for arg in self.__in_args]
+            self.__num_filled_args = len([a for a in self.__in_args if not a.is_empty()])
+            self.__num_buffered -= len(self.__in_args)
+            # Call the function and update output args
+            arg_data_out = self.evaluate(arg_data_in)
             for i in range(len(arg_data_out)):
-                arg_data_out[i].add_hop(self.name,
-                    max(self.__latencies.inarg) + self.__latencies.func + self.__latencies.outarg[i])
                 self.__dests[i].push(arg_data_out[i])
-            # Cleanup
             self.__last_exec_ticks = self.get_ticks()
-            self.__in_args_pushed = dict()
+            self.__update_ready()
+
+    def __update_occupancy(self):
+        # Called before the number of buffered streams changes
+        ticks = self.get_ticks()
+        self.__occupancy_area += self.__num_buffered * (ticks - self.__occupancy_area_tick)
+        self.__occupancy_area_tick = ticks
+
+    def bind_telemetry(self):
+        if self.__telemetry:
+            self.__is_ready_untraced = self.is_ready
+            self.__notify_untraced = self.notify
+            self.is_ready = self.__is_ready_traced
+            self.notify = self.__notify_traced
+
+    def __is_ready_traced(self):
+        ready = self.__is_ready_untraced()
+        if not ready:
+            self.__telemetry.add_ready_fail(self.get_ticks())
+        return ready
+
+    def __notify_traced(self, arg_i, data):
+        ticks = self.get_ticks()
+        self.__telemetry.add(TelemetryRecorder.BYTES, ticks, data.get_bytes())
+        self.__trace_occupancy(ticks - 1)
+        self.__notify_untraced(arg_i, data)
+        self.__occupancy = self.__num_buffered
+
+    def __trace_occupancy(self, ticks):
+        # Occupancy is sampled at the end of every tick
+        if ticks > self.__occupancy_tick:
+            self.__telemetry.add_span(TelemetryRecorder.OCCUPANCY,
+                self.__occupancy_tick, ticks, self.__occupancy)
+            self.__occupancy_tick = ticks
+
+    def get_telemetry(self):
+        if not self.__telemetry:
+            return SimComp.get_telemetry(self)
+        self.__trace_occupancy(self.get_ticks())
+        return self.__telemetry.get_windows(self.get_ticks())
 
     def get_util_attrs(self):
+        if self.__arg_depth > 1:
+            return ['occupancy', 'peak_occupancy']
         return []
 
     def get_utilization(self, what):
+        capacity = float(self.__arg_depth * len(self.__in_args))
+        if what == 'occupancy' and self.__arg_depth > 1 and self.get_ticks() > 0:
+            area = self.__occupancy_area + self.__num_buffered * (self.get_ticks() - self.__occupancy_area_tick)
+            return area / (self.get_ticks() * capacity)
+        elif what == 'peak_occupancy' and self.__arg_depth > 1:
+            return self.__peak_occupancy / float(self.__arg_depth)
         return 0.0
 
+#------------------------------------------------------------
+# Analytic Solver
+#------------------------------------------------------------
+class SteadyStateSolver():
+    """
+    Steady State Solver:
+    Computes the steady state bandwidth utilization and latency of a
+    static dataflow network without ticking the simulator:
+    1. Firing rates (pushes per tick) are propagated forward from the
+       producers and acceptance rates backward from the consumers until
+       they agree. A function fires at most once every ticks_per_exec and
+       no faster than its slowest input, and a full argument throttles
+       everything upstream of it.
+    2. One set of streams is pushed through the network in topological
+       order (every function is evaluated exactly once) to find the bytes
+       moved per firing and the latency along every path.
+    Transients (queueing while the network fills up) and the packet
+    queues of packetized channels are not modeled.
+    Use verify() to cross-check the results with a simulation run.
+    """
+
+    def __init__(self, sim_core):
+        self.__sim_core = sim_core
+        self.__util_db = sim_core.get_util_db()
+        self.__fire_rates = dict()
+        self.__byte_rates = dict()
+        self.__item_db = dict()
+        self.__solve_ticks = 0
+
+    def solve(self):
+        core = self.__sim_core
+        comps = dict()
+        for ctype in [comptype.producer, comptype.channel, comptype.function, comptype.consumer]:
+            for n in core.list_components(ctype):
+                comps[n] = core.lookup(n)
+        (dests, srcs) = self.__get_edges(comps)
+        order = self.__sort(comps, dests, srcs)
+        self.__fire_rates = self.__solve_rates(comps, dests, srcs, order)
+        self.__propagate(comps, dests, order)
+        return self
+
+    def __get_edges(self, comps):
+        # dests[n] is a list of (output port, dest name, dest arg) and
+        # srcs[(n, arg)] is the name of the component that drives n
+        dests = dict()
+        srcs = dict()
+        for n in comps:
+            c = comps[n]
+            if c.type == comptype.consumer:
+                dests[n] = []
+                continue
+            outs = c.get_dests()
+            if c.type == comptype.function:
+                ports = [(i, [outs[i]]) for i in range(len(outs)) if outs[i] is not None]
+            else:
+                ports = [(0, outs)]
+            dests[n] = []
+            for (port, port_dests) in ports:
+                for d in port_dests:
+                    if isinstance(d, Function.Arg):
+                        edge = (port, d.get_func().name, d.get_num())
+                    else:
+                        edge = (port, d.name, None)
+                    if edge[1] not in comps:
+                        raise RuntimeError('Analytic solver cannot model ' + edge[1])
+                    dests[n].append(edge)
+                    srcs[(edge[1], edge[2])] = n
+        return (dests, srcs)
+
+    def __sort(self, comps, dests, srcs):
+        indegree = dict((n, 0) for n in comps)
+        for (n, arg) in srcs:
+            indegree[n] += 1
+        order = sorted(n for n in comps if indegree[n] == 0)
+        i = 0
+        while i < len(order):
+            for (port, d, arg) in dests[order[i]]:
+                indegree[d] -= 1
+                if indegree[d] == 0:
+                    order.append(d)
+            i += 1
+        if len(order) != len(comps):
+            raise RuntimeError('Analytic solver does not support networks with cycles')
+        return order
+
+    def __solve_rates(self, comps, dests, srcs, order):
+        prod_rates = dict((n, 1.0 if dests[n] else 0.0)
+                          for n in order if comps[n].type == comptype.producer)
+        fire = dict()
+        # Rates only ever go down so this converges in a few iterations
+        for iteration in range(len(order) + 1):
+            for n in order:
+                c = comps[n]
+                if c.type == comptype.producer:
+                    fire[n] = prod_rates[n]
+                elif c.type == comptype.function:
+                    rate = 1.0 / c.get_ticks_per_exec()
+                    for i in range(len(c.get_in_args())):
+                        src = srcs.get((n, i))
+                        rate = min(rate, fire[src] if src else 0.0)
+                    fire[n] = rate
+                else:
+                    src = srcs.get((n, None))
+                    fire[n] = fire[src] if src else 0.0
+            accept = dict()
+            for n in reversed(order):
+                c = comps[n]
+                dest_accept = min([accept[d] for (port, d, arg) in dests[n]] or [float('inf')])
+                if c.type == comptype.consumer:
+                    accept[n] = float('inf')
+                elif c.type == comptype.channel:
+                    if not dests[n]:
+                        accept[n] = float('inf') if c.is_lossy() else 0.0
+                    else:
+                        accept[n] = dest_accept
+                elif c.type == comptype.function:
+                    accept[n] = min(fire[n], dest_accept) if dests[n] else 0.0
+            converged = True
+            for n in prod_rates:
+                rate = min([prod_rates[n]] + [accept[d] for (port, d, arg) in dests[n]])
+                if rate != prod_rates[n]:
+                    prod_rates[n] = rate
+                    converged = False
+            if converged:
+                return fire
+        raise RuntimeError('Analytic solver did not converge')
+
+    def __propagate(self, comps, dests, order):
+        latencies = self.__util_db.get_latencies()
+        tick_rate = self.__sim_core.get_tick_rate()
+        self.__solve_ticks = self.__sim_core.get_ticks()
+        self.__byte_rates = dict()
+        self.__item_db = dict()
+        inbox = dict()
+        for n in order:
+            c = comps[n]
+            if c.type == comptype.consumer:
+                self.__item_db[n] = dict()
+            if self.__fire_rates[n] == 0.0:
+                continue
+            if c.type == comptype.channel and not dests[n]:
+                continue    # Lossy lane with nothing hooked up drops data
+            if c.type == comptype.producer:
+                # A throttled producer is backpressured between pushes
+                outs = [c.create_data_stream(c.get_data_count(),
+                                             fixed_ticks(1.0 / self.__fire_rates[n] - 1.0))]
+            elif c.type == comptype.function:
+                outs = c.evaluate([inbox.pop((n, i)) for i in range(len(c.get_in_args()))])
+            else:
+                data = inbox.pop((n, None))
+                data.add_hop_id(c.loc_id, latencies[self.__util_db.get_id(n)])
+                outs = [data]
+            self.__byte_rates[n] = sum(d.get_bytes() for d in outs) * self.__fire_rates[n] * tick_rate
+            if c.type == comptype.consumer:
+                hop_db = outs[0].get_hop_db()
+                for item in outs[0].items:
+                    self.__item_db[n][item] = hop_db
+            for (port, d, arg) in dests[n]:
+                if port < len(outs):
+                    inbox[(d, arg)] = outs[port].fork()
+
+    def get_fire_rate(self, comp_name):
+        """
+        Returns the number of times a component fires (pushes) per tick
+        """
+        return self.__fire_rates[comp_name]
+
+    def get_byte_rate(self, comp_name):
+        """
+        Returns the number of bytes per second a component moves
+        """
+        return self.__byte_rates.get(comp_name, 0.0)
+
+    def get_utilization(self, comp_names, what):
+        """
+        Same as SimulatorCore.get_utilization() but for the steady state
+        """
+        bws = self.__util_db.get_bandwidths()
+        util = np.zeros(len(comp_names))
+        for (i, n) in enumerate(comp_names):
+            comp_id = self.__util_db.get_id(n)
+            if comp_id is None:
+                util[i] = self.__sim_core.lookup(n).get_utilization(what)
+            elif what == 'bandwidth':
+                util[i] = self.get_byte_rate(n) / bws[comp_id]
+        return util
+
+    def get_items(self, consumer_name):
+        return list(self.__item_db[consumer_name].keys())
+
+    def get_hops(self, consumer_name, item):
+        item_db = self.__item_db[consumer_name]
+        return item_db[DataStream.item_key(item_db, item)].get_hops()
+
+    def get_latency(self, consumer_name, item, hop=None):
+        item_db = self.__item_db[consumer_name]
+        item = DataStream.item_key(item_db, item)
+        if not hop:
+            hop = self.get_hops(consumer_name, item)[-1]
+        return (item_db[item].get_latency(self.__solve_ticks, hop) /
+                self.__sim_core.get_tick_rate())
+
+    def verify(self, time_s, rtol=1e-6):
+        """
+        Runs the simulation for time_s and returns a list of warnings for
+        all utilization and consumer latency values that do not match the
+        analytic solution within a relative tolerance of rtol. Simulated
+        latencies include the age of the last received stream so they are
+        allowed to exceed the analytic latency by one firing period.
+        """
+        self.__sim_core.run(time_s)
+        warnings = []
+        names = self.__util_db.get_names()
+        expected = self.get_utilization(names, 'bandwidth')
+        actual = self.__sim_core.get_utilization(names, 'bandwidth')
+        for i in np.nonzero(~np.isclose(actual, expected, rtol=rtol, atol=0.0))[0]:
+            warnings.append('%s: Simulated bandwidth utilization %g does not match analytic %g' %
+                            (names[i], actual[i], expected[i]))
+        for n in sorted(self.__item_db):
+            consumer = self.__sim_core.lookup(n)
+            sim_items = set(consumer.get_items())
+            period = 0.0
+            if self.__fire_rates[n] > 0.0:
+                period = (1.0 / self.__fire_rates[n] - 1.0) / self.__sim_core.get_tick_rate()
+            for item in sorted(set(self.__item_db[n]) | sim_items, key=str):
+                if item not in sim_items or item not in self.__item_db[n]:
+                    warnings.append('%s: Item %s was only received in the %s' %
+                                    (n, str(item), 'simulation' if item in sim_items else 'analytic solution'))
+                    continue
+                actual = consumer.get_latency(item)
+                expected = self.get_latency(n, item)
+                if not (np.isclose(actual, expected, rtol=rtol, atol=0.0) or
+                        expected <= actual <= (expected + period) * (1.0 + rtol)):
+                    warnings.append('%s: Simulated latency %gs for %s does not match analytic %gs' %
+                                    (n, actual, str(item), expected))
+        return warnings
+
 #------------------------------------------------------------
 # Plotting Functions
 #------------------------------------------------------------
+class RenderPool():
+    """
+    Render Pool:
+    Runs render jobs in a pool of render_workers background processes (or
+    in the calling process if render_workers is 0). A pool can be shared
+    by many Visualizers (ex: one per configuration of a sweep) and is
+    joined once at the end. A deferred pool only records the jobs so that
+    they can be submitted to a pool in another process (see get_jobs).
+    """
+
+    def __init__(self, render_workers=1, deferred=False):
+        self.__render_workers = render_workers
+        self.__deferred = deferred
+        self.__pool = None
+        self.__jobs = []
+
+    def submit(self, func, args):
+        if self.__deferred:
+            self.__jobs.append((func, args))
+        elif self.__render_workers > 0:
+            if self.__pool is None:
+                self.__pool = multiprocessing.Pool(self.__render_workers)
+            self.__jobs.append(self.__pool.apply_async(func, args))
+        else:
+            self.__jobs.append(func(*args))
+
+    def get_jobs(self):
+        """
+        Returns the (func, args) render jobs recorded by a deferred pool
+        """
+        return list(self.__jobs) if self.__deferred else []
+
+    def join(self):
+        """
+        Wait for all renders to finish and return the list of files that
+        were written
+        """
+        if self.__deferred:
+            return []
+        files = []
+        error = None
+        for job in self.__jobs:
+            try:
+                files.extend(job.get() if self.__pool else job)
+            except Exception as e:
+                # Let the other renders finish before reporting the error
+                error = error if error else e
+        self.__jobs = []
+        if self.__pool:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+        if error:
+            raise error
+        return files
+
 class Visualizer():
-    def __init__(self, sim_core):
+    """
+    Visualizer:
+    Plots simulation results. By default, figures are shown interactively
+    and the network is opened in a viewer. If an output_dir is specified,
+    the visualizer runs headless: Figures, the network and dumps are
+    written to output_dir as image files (in all requested formats) plus
+    JSON/CSV data. Rendering is done by a pool of render_workers processes
+    so that it overlaps with the rest of the simulation. Set render_workers
+    to 0 to render in the calling process. Call close() to wait for all
+    renders to finish. To overlap rendering with more simulations, pass a
+    shared render_pool (see RenderPool) instead. Its owner joins it. If a
+    render_cache directory is specified, headless network renders are
+    cached there (keyed by a hash of the network view) so that repeated
+    runs on the same topology skip the layout. Headless network renders
+    that need Graphviz when it is not installed are skipped with a warning
+    (only the Graphviz source is written).
+    """
+
+    def __init__(self, sim_core, output_dir=None, formats=None, render_workers=1,
+                 render_cache=None, render_pool=None):
         self.__sim_core = sim_core
+        self.__render_cache = render_cache
         self.__figure = None
         self.__fig_dims = None
-
-    def show_network(self, engine='fdp'):
+        self.__output_dir = output_dir
+        self.__formats = formats if formats else ['png']
+        self.__shared_pool = render_pool is not None
+        self.__render_pool = render_pool if self.__shared_pool else RenderPool(render_workers)
+        self.__num_figures = 0
+        if output_dir:
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+            plt.switch_backend('Agg')
+
+    def is_headless(self):
+        return self.__output_dir is not None
+
+    def __render(self, func, args):
+        self.__render_pool.submit(func, args)
+
+    def close(self):
+        """
+        Wait for all background renders to finish and return the list
+        of files that were written. Does not wait for a shared render
+        pool (its owner joins it).
+        """
+        if self.__shared_pool:
+            return []
+        return self.__render_pool.join()
+
+    def show_network(self, engine='fdp', name='network'):
+        """
+        Shows all rendered edges of the network flat. Use show_network_view()
+        for networks that are too large to lay out this way.
+        """
         dot = self.__sim_core.network_to_dot()
-        dot.format = 'png'
         dot.engine = engine
-        dot.render('/tmp/rfnoc_sim.dot', view=True, cleanup=True)
+        if self.is_headless():
+            self.__render(_render_network, (dot.source, engine, self.__formats, self.__output_dir,
+                                            name, self.__render_cache))
+        else:
+            dot.format = 'png'
+            dot.render('/tmp/rfnoc_sim.dot', view=True, cleanup=True)
+
+    def show_network_view(self, root='', depth=2, engine='fdp', name=None):
+        """
+        Shows the hierarchical view of the network under root (see
+        SimulatorCore.network_view_to_dot). The view is named after root
+        unless a name is specified.
+        """
+        dot = self.__sim_core.network_view_to_dot(root, depth)
+        dot.engine = engine
+        if name is None:
+            name = 'network_' + (re.sub('[^A-Za-z0-9]+', '_', root).strip('_') if root else 'top')
+        if self.is_headless():
+            self.__render(_render_network, (dot.source, engine, self.__formats, self.__output_dir,
+                                            name, self.__render_cache))
+        else:
+            dot.format = 'png'
+            dot.render('/tmp/rfnoc_sim_%s.dot' % name, view=True, cleanup=True)
 
-    def dump_consumed_streams(self, consumer_filt='.*'):
+    def dump_consumed_streams(self, consumer_filt='.*', name='consumed_streams'):
         comps = self.__sim_core.list_components(comptype.consumer, consumer_filt)
+        streams = []
+        for c in sorted(comps):
+            comp = self.__sim_core.lookup(c)
+            for s in sorted(comp.get_items(), key=str):
+                streams.append({'consumer': c, 'stream': str(s),
+                    'latency': comp.get_latency(s), 'hops': comp.get_hops(s)})
+                if self.__sim_core.get_latency_histograms():
+                    streams[-1]['latency_stats'] = comp.get_latency_stats(s)
+        if self.is_headless():
+            path = os.path.join(self.__output_dir, name)
+            with open(path + '.json', 'w') as f:
+                json.dump({'ticks': self.__sim_core.get_ticks(), 'consumer_filt': consumer_filt,
+                           'streams': streams}, f, indent=1)
+            with open(path + '.csv', 'w') as f:
+                writer = csv.writer(f)
+                stats = ['p50', 'p99', 'p99.9'] if self.__sim_core.get_latency_histograms() else []
+                writer.writerow(['consumer', 'stream', 'latency'] + ['latency_' + p for p in stats] + ['hops'])
+                for st in streams:
+                    writer.writerow([st['consumer'], st['stream'], st['latency']] +
+                        [st['latency_stats'][p] for p in stats] + [';'.join(st['hops'])])
+            return
         print('=================================================================')
         print('Streams Received by Consumers matching (%s) at Tick = %04d'%(consumer_filt,self.__sim_core.get_ticks()))
         print('=================================================================')
-        for c in sorted(comps):
-            comp = self.__sim_core.lookup(c)
-            for s in sorted(comp.get_items()):
-                print(' - %s: (%s) Latency = %gs'%(s,c,comp.get_latency(s)))
+        for st in streams:
+            print(' - %s: (%s) Latency = %gs'%(st['stream'],st['consumer'],st['latency']))
         print('=================================================================')
 
     def dump_debug_audit_log(self, ctype, name_filt='.*'):
@@ -649,30 +3606,51 @@ class Visualizer():
         print('=================================================================')
 
     def new_figure(self, grid_dims=[1,1], fignum=1, figsize=(16, 9), dpi=72):
-        self.__figure = plt.figure(num=fignum, figsize=figsize, dpi=dpi)
+        if self.is_headless():
+            # Figures are recorded and rendered when they are shown
+            self.__figure = {'grid_dims': list(grid_dims), 'figsize': figsize, 'dpi': dpi, 'subplots': []}
+        else:
+            self.__figure = plt.figure(num=fignum, figsize=figsize, dpi=dpi)
         self.__fig_dims = grid_dims
 
-    def show_figure(self):
-        plt.show()
+    def show_figure(self, name=None):
+        if self.is_headless():
+            self.__num_figures += 1
+            name = name if name else 'figure_%02d' % (self.__num_figures)
+            self.__render(_render_figure, (self.__figure, self.__formats, self.__output_dir, name))
+        else:
+            plt.show()
         self.__figure = None
 
+    def __plot(self, draw_func, grid_pos, **data):
+        if not self.__figure:
+            self.new_figure()
+            show = True
+        else:
+            show = False
+        if self.is_headless():
+            self.__figure['subplots'].append((draw_func, grid_pos, data))
+        else:
+            self.__figure.subplots_adjust(bottom=0.25)
+            ax = self.__figure.add_subplot(*(self.__fig_dims + [grid_pos]))
+            getattr(Visualizer, draw_func)(ax, **data)
+        if show:
+            self.show_figure()
+
     def plot_utilization(self, ctype, name_filt='.*', grid_pos=1):
-        colors = ['b','r','g','y']
         comps = self.__sim_core.list_components(ctype, name_filt)
         attrs = set()
         for c in comps:
             attrs |= set(self.__sim_core.lookup(c).get_util_attrs())
         attrs = sorted(list(attrs))
-
-        if not self.__figure:
-            self.new_figure()
-            show = True
-        else:
-            show = False
-        self.__figure.subplots_adjust(bottom=0.25)
-        ax = self.__figure.add_subplot(*(self.__fig_dims + [grid_pos]))
+        utilz = [(self.__sim_core.get_utilization(comps, a) * 100).tolist() for a in attrs]
         title = 'Resource utilization for all %s\ncomponents matching \"%s\"' % \
             (ctype, name_filt)
+        self.__plot('draw_utilization', grid_pos, title=title, comps=comps, attrs=attrs, utilz=utilz)
+
+    @staticmethod
+    def draw_utilization(ax, title, comps, attrs, utilz):
+        colors = ['b','r','g','y']
         ax.set_title(title)
         ax.set_ylabel('Resource Utilization (%)')
         if comps:
@@ -681,69 +3659,133 @@ class Visualizer():
             rects = []
             ymax = 100
             for i in range(len(attrs)):
-                utilz = [self.__sim_core.lookup(c).get_utilization(attrs[i]) * 100 for c in comps]
-                rects.append(ax.bar(ind + width*i, utilz, width, color=colors[i%len(colors)]))
-                ymax = max(ymax, int(math.ceil(max(utilz) / 100.0)) * 100)
+                rects.append(ax.bar(ind + width*i, utilz[i], width, color=colors[i%len(colors)]))
+                ymax = max(ymax, int(math.ceil(max(utilz[i]) / 100.0)) * 100)
             ax.set_ylim([0,ymax])
             ax.set_yticks(list(range(0,ymax,10)))
             ax.set_xticks(ind + 0.5)
             ax.set_xticklabels(comps, rotation=90)
             ax.legend(rects, attrs)
-            ax.grid(b=True, which='both', color='0.65',linestyle='--')
+            ax.grid(True, which='both', color='0.65',linestyle='--')
         ax.plot([0, len(comps)], [100, 100], "k--", linewidth=3.0)
-        if show:
-            self.show_figure()
+
+    def plot_utilization_timeline(self, ctype, name_filt='.*', grid_pos=1):
+        comps = [c for c in self.__sim_core.list_components(ctype, name_filt)
+                 if self.__sim_core.get_util_db().get_id(c) is not None]
+        (times, utilz) = self.__sim_core.get_utilization_series(comps)
+        title = 'Bandwidth utilization over time for all %s\ncomponents matching \"%s\"' % \
+            (ctype, name_filt)
+        self.__plot('draw_utilization_timeline', grid_pos, title=title, comps=comps,
+                    times=times.tolist(), utilz=(utilz.T * 100).tolist())
+
+    @staticmethod
+    def draw_utilization_timeline(ax, title, comps, times, utilz):
+        ax.set_title(title)
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Bandwidth Utilization (%)')
+        for i in range(len(comps)):
+            # Each value holds for the whole interval that ends at its timestamp
+            ax.step([0.0] + times, utilz[i][:1] + utilz[i], where='pre', label=comps[i])
+        if comps and len(comps) <= 16:
+            ax.legend(loc='best', fontsize='small')
+        ax.grid(True, which='both', color='0.65',linestyle='--')
+        if times:
+            ax.plot([0, times[-1]], [100, 100], "k--", linewidth=3.0)
+
+    def plot_telemetry(self, ctype, name_filt='.*', metric='bytes', grid_pos=1):
+        comps = self.__sim_core.list_components(ctype, name_filt)
+        (times, values) = self.__sim_core.get_telemetry(comps, metric)
+        title = 'Telemetry (%s per window) for all %s\ncomponents matching \"%s\"' % \
+            (metric, ctype, name_filt)
+        self.__plot('draw_telemetry', grid_pos, title=title, comps=comps, metric=metric,
+                    times=times.tolist(), values=values.T.tolist())
+
+    @staticmethod
+    def draw_telemetry(ax, title, comps, metric, times, values):
+        ax.set_title(title)
+        ax.set_xlabel('Window End Time (s)')
+        if comps and times:
+            # One row per component, one column per window
+            width = (times[1] - times[0]) if len(times) > 1 else times[0]
+            img = ax.imshow(values, aspect='auto', interpolation='nearest', cmap='viridis',
+                            extent=[times[0] - width, times[-1], len(comps) - 0.5, -0.5])
+            ax.set_yticks(list(range(len(comps))))
+            ax.set_yticklabels(comps, fontsize='small')
+            ax.figure.colorbar(img, ax=ax, label=metric)
 
     def plot_consumption_latency(self, stream_filt='.*', consumer_filt='.*', grid_pos=1):
         streams = list()
         for c in sorted(self.__sim_core.list_components(comptype.consumer, consumer_filt)):
-            for s in sorted(self.__sim_core.lookup(c).get_items()):
-                if (re.match(stream_filt, s)):
-                    streams.append((c, s, c + '/' + s))
-
-        if not self.__figure:
-            self.new_figure()
-            show = True
-        else:
-            show = False
-        self.__figure.subplots_adjust(bottom=0.25)
-        ax = self.__figure.add_subplot(*(self.__fig_dims + [grid_pos]))
+            for s in sorted(self.__sim_core.lookup(c).get_items(), key=str):
+                if (re.match(stream_filt, str(s))):
+                    streams.append((c, s, c + '/' + str(s)))
+        latency = [self.__sim_core.lookup(c_s_d1[0]).get_latency(c_s_d1[1]) for c_s_d1 in streams]
         title = 'Latency of Maximal Path Terminating in\nStream(s) matching \"%s\"\n(Consumer Filter = \"%s\")' % \
             (stream_filt, consumer_filt)
+        self.__plot('draw_consumption_latency', grid_pos, title=title,
+            labels=[c_s_d[2] for c_s_d in streams], latency=latency)
+
+    @staticmethod
+    def draw_consumption_latency(ax, title, labels, latency):
         ax.set_title(title)
         ax.set_ylabel('Maximal Source-to-Sink Latency (s)')
-        if streams:
-            ind = np.arange(len(streams))
-            latency = [self.__sim_core.lookup(c_s_d1[0]).get_latency(c_s_d1[1]) for c_s_d1 in streams]
+        if labels:
+            ind = np.arange(len(labels))
             rects = [ax.bar(ind, latency, 1.0, color='b')]
             ax.set_xticks(ind + 0.5)
-            ax.set_xticklabels([c_s_d[2] for c_s_d in streams], rotation=90)
+            ax.set_xticklabels(labels, rotation=90)
             attrs = ['latency']
             ax.legend(rects, attrs)
             ax.yaxis.set_major_formatter(mticker.FormatStrFormatter('%.2e'))
-            ax.grid(b=True, which='both', color='0.65',linestyle='--')
-        if show:
-            self.show_figure()
+            ax.grid(True, which='both', color='0.65',linestyle='--')
+
+    def plot_latency_percentiles(self, stream_filt='.*', consumer_filt='.*', grid_pos=1,
+                                 percentiles=(50, 99, 99.9)):
+        streams = list()
+        for c in sorted(self.__sim_core.list_components(comptype.consumer, consumer_filt)):
+            for s in sorted(self.__sim_core.lookup(c).get_items(), key=str):
+                if (re.match(stream_filt, str(s))):
+                    streams.append((c, s, c + '/' + str(s)))
+        stats = [self.__sim_core.lookup(c).get_latency_stats(s, percentiles) for (c, s, d) in streams]
+        latency = [[st['p%g' % p] for st in stats] for p in percentiles]
+        title = 'Latency Percentiles of Stream(s) matching \"%s\"\n(Consumer Filter = \"%s\")' % \
+            (stream_filt, consumer_filt)
+        self.__plot('draw_latency_percentiles', grid_pos, title=title,
+            labels=[d for (c, s, d) in streams], percentiles=list(percentiles), latency=latency)
+
+    @staticmethod
+    def draw_latency_percentiles(ax, title, labels, percentiles, latency):
+        ax.set_title(title)
+        ax.set_ylabel('Source-to-Sink Latency on Arrival (s)')
+        if labels:
+            ind = np.arange(len(labels))
+            width = 1.0 / len(percentiles)
+            colors = ['b', 'g', 'r', 'c', 'm', 'y']
+            rects = []
+            for i in range(len(percentiles)):
+                rects.append(ax.bar(ind + i * width, latency[i], width, color=colors[i % len(colors)]))
+            ax.set_xticks(ind + 0.5)
+            ax.set_xticklabels(labels, rotation=90)
+            ax.legend(rects, ['P%g' % p for p in percentiles])
+            ax.yaxis.set_major_formatter(mticker.FormatStrFormatter('%.2e'))
+            ax.grid(True, which='both', color='0.65',linestyle='--')
 
     def plot_path_latency(self, stream_id, consumer_filt = '.*', grid_pos=1):
         path = []
         latencies = []
         for c in self.__sim_core.list_components(comptype.consumer, consumer_filt):
             for s in self.__sim_core.lookup(c).get_items():
-                if (stream_id == s):
+                if (str(stream_id) == str(s)):
                     for h in self.__sim_core.lookup(c).get_hops(s):
                         path.append(h)
                         latencies.append(self.__sim_core.lookup(c).get_latency(s, h))
                     break
-        if not self.__figure:
-            self.new_figure()
-            show = True
-        else:
-            show = False
-        self.__figure.subplots_adjust(bottom=0.25)
-        ax = self.__figure.add_subplot(*(self.__fig_dims + [grid_pos]))
         title = 'Accumulated Latency per Hop for Stream \"%s\"\n(Consumer Filter = \"%s\")' % \
             (stream_id, consumer_filt)
+        self.__plot('draw_path_latency', grid_pos, title=title, path=path, latencies=latencies)
+
+    @staticmethod
+    def draw_path_latency(ax, title, path, latencies):
         ax.set_title(title)
         ax.set_ylabel('Maximal Source-to-Sink Latency (s)')
         if path:
@@ -752,6 +3794,57 @@ class Visualizer():
             ax.set_xticks(ind)
             ax.set_xticklabels(path, rotation=90)
             ax.yaxis.set_major_formatter(mticker.FormatStrFormatter('%.2e'))
-            ax.grid(b=True, which='both', color='0.65',linestyle='--')
-        if show:
-            self.show_figure()
+            ax.grid(True, which='both', color='0.65',linestyle='--')
+
+# Render workers for headless visualization. These run in a separate
+# process so they only take picklable arguments.
+def _render_figure(figure, formats, output_dir, name):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figure['figsize'], dpi=figure['dpi'])
+    FigureCanvasAgg(fig)
+    for (draw_func, grid_pos, data) in figure['subplots']:
+        fig.subplots_adjust(bottom=0.25)
+        ax = fig.add_subplot(*(figure['grid_dims'] + [grid_pos]))
+        getattr(Visualizer, draw_func)(ax, **data)
+    path = os.path.join(output_dir, name)
+    files = []
+    for fmt in formats:
+        fig.savefig(path + '.' + fmt, format=fmt)
+        files.append(path + '.' + fmt)
+    with open(path + '.json', 'w') as f:
+        json.dump([dict(data, plot=draw_func[len('draw_'):], grid_pos=grid_pos)
+                   for (draw_func, grid_pos, data) in figure['subplots']], f, indent=1)
+    files.append(path + '.json')
+    return files
+
+def _render_network(source, engine, formats, output_dir, name, cache_dir=None):
+    files = []
+    key = hashlib.sha1((engine + '\n' + source).encode('utf-8')).hexdigest()
+    dot_missing = False
+    for fmt in formats:
+        cached = os.path.join(cache_dir, key + '.' + fmt) if cache_dir else None
+        dot = Source(source, filename=name + '.gv', directory=output_dir, format=fmt, engine=engine)
+        if cached and os.path.isfile(cached):
+            dot.save()
+            files.append(os.path.join(output_dir, name + '.gv.' + fmt))
+            shutil.copyfile(cached, files[-1])
+            continue
+        if dot_missing:
+            continue
+        try:
+            files.append(dot.render(cleanup=False))
+        except ExecutableNotFound:
+            # Keep writing all other outputs. The source can be rendered later.
+            print('[WARN] Graphviz (%s) is not installed. Skipped rendering %s.' % (engine, name))
+            dot.save()
+            dot_missing = True
+            continue
+        if cached:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # Other processes may be rendering the same view
+            tmp = '%s.%d.tmp' % (cached, os.getpid())
+            shutil.copyfile(files[-1], tmp)
+            os.rename(tmp, cached)
+    return [os.path.join(output_dir, name + '.gv')] + files
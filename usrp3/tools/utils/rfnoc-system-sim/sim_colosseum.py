@@ -20,93 +20,487 @@ import rfnocsim
 import ni_hw_models as hw
 import colosseum_models
 import argparse
+import csv
+import functools
+import gc
+import hashlib
+import itertools
+import json
+import os
+import multiprocessing
 import re
+import time
 
-def main():
-    # Arguments
-    parser = argparse.ArgumentParser(description='Simulate the Colosseum network')
-    parser.add_argument('--topology', type=str, default='flb', choices=['torus','flb'], help='Topology')
-    parser.add_argument('--domain', type=str, default='time', choices=['time','frequency'], help='Domain')
-    parser.add_argument('--fir_taps', type=int, default=4, help='FIR Filter Taps (Time domain only)')
-    parser.add_argument('--fir_dly_line', type=int, default=512, help='FIR Delay Line (Time domain only)')
-    parser.add_argument('--fft_size', type=int, default=512, help='FFT Size (Frequency domain only)')
-    parser.add_argument('--fft_overlap', type=int, default=256, help='FFT Overlap (Frequency domain only)')
-    parser.add_argument('--samp_rate', type=float, default=100e6, help='Radio Channel Sample Rate')
-    parser.add_argument('--coherence_rate', type=float, default=1000, help='Channel coefficient update rate')
-    args = parser.parse_args()
+NUM_USRPS   = 128
+NUM_HOSTS   = 4
+NUM_BLADES  = 16
+NUM_CHANS   = NUM_USRPS * 2
+HOST_SWITCH_PORTS = 16
 
-    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6)
-    NUM_USRPS   = 128
-    NUM_HOSTS   = 4
-    NUM_BLADES  = 16
-    NUM_CHANS   = NUM_USRPS * 2
+# Generic N-dimensional topologies (see colosseum_models.Topology_ND)
+ND_TOPOLOGIES = {'flb_nd': 'flb', 'torus_nd': 'torus'}
 
+# Parameters that define a single simulation configuration
+CONFIG_PARAMS = ['topology', 'dims', 'radix', 'concentration', 'lanes_per_link', 'bcast_dims',
+                 'domain', 'fir_taps', 'fir_dly_line', 'fft_size', 'fft_overlap',
+                 'max_unroll_depth', 'coeff_sets', 'sync_buffers', 'packet_lanes', 'samp_rate', 'coherence_rate', 'scheduler', 'sim_time']
+# Parameters that only affect how a network is simulated, not how it is built
+RUN_PARAMS = ['scheduler', 'sim_time']
+
+def get_app_settings(config):
     # Build an application settings structure
     app_settings = dict()
-    app_settings['domain'] = args.domain
-    app_settings['samp_rate'] = args.samp_rate
-    app_settings['coherence_rate'] = args.coherence_rate
-    if args.domain == 'frequency':
-        app_settings['fft_size'] = args.fft_size
-        app_settings['fft_overlap'] = args.fft_overlap
+    app_settings['domain'] = config['domain']
+    app_settings['samp_rate'] = config['samp_rate']
+    app_settings['coherence_rate'] = config['coherence_rate']
+    app_settings['max_unroll_depth'] = config['max_unroll_depth']
+    app_settings['coeff_sets'] = config['coeff_sets']
+    app_settings['sync_buffers'] = config['sync_buffers']
+    if config['domain'] == 'frequency':
+        app_settings['fft_size'] = config['fft_size']
+        app_settings['fft_overlap'] = config['fft_overlap']
     else:
-        app_settings['fir_taps'] = args.fir_taps
-        app_settings['fir_dly_line'] = args.fir_dly_line
-
-    print('[INFO] Instantiating hardware resources...')
-    # Create USRPs
-    usrps = []
-    for i in range(NUM_USRPS):
-        usrps.append(hw.UsrpX310(sim_core, index=i, app_settings=app_settings))
-    # Create BEE7s
-    bee7blades = []
-    for i in range(NUM_BLADES):
-        bee7blades.append(hw.Bee7Blade(sim_core, index=i))
-    # Create Management Hosts
-    hosts = []
-    for i in range(NUM_HOSTS):
-        hosts.append(hw.ManagementHostandSwitch(sim_core, index=i,
-            num_coeffs=pow(NUM_CHANS,2)/NUM_HOSTS, switch_ports=16, app_settings=app_settings))
-
-    # Build topology
-    print('[INFO] Building topology...')
-    if args.topology == 'torus':
-        colosseum_models.Topology_2D_4x4_Torus.connect(sim_core, usrps, bee7blades, hosts, app_settings)
-    elif args.topology == 'flb':
-        colosseum_models.Topology_3D_4x4_FLB.connect(sim_core, usrps, bee7blades, hosts, app_settings)
+        app_settings['fir_taps'] = config['fir_taps']
+        app_settings['fir_dly_line'] = config['fir_dly_line']
+    return app_settings
+
+def get_topology(config):
+    """
+    Returns (topology, num_usrps, num_blades, num_hosts) for the Colosseum
+    network described by config
+    """
+    if config['topology'] == 'torus':
+        return (colosseum_models.Topology_2D_4x4_Torus, NUM_USRPS, NUM_BLADES, NUM_HOSTS)
+    elif config['topology'] == 'flb':
+        return (colosseum_models.Topology_3D_4x4_FLB, NUM_USRPS, NUM_BLADES, NUM_HOSTS)
+    elif config['topology'] in ND_TOPOLOGIES:
+        topology = colosseum_models.Topology_ND(
+            ND_TOPOLOGIES[config['topology']], config['dims'], config['radix'],
+            config['concentration'], config['lanes_per_link'], config['bcast_dims'] or None)
+        return (topology, topology.get_num_usrps(), topology.get_num_blades(),
+                topology.get_num_hosts(HOST_SWITCH_PORTS))
     else:
-        raise RuntimeError('Invalid topology: ' + args.topology)
+        raise RuntimeError('Invalid topology: ' + config['topology'])
 
-    print('[INFO] Running simulation...')
-    sim_core.run(16e-9)
+def build(config, verbose=True, util_interval=None, telemetry_window=None,
+          retention='latest', reservoir_size=16, latency_histograms=True):
+    """
+    Instantiate the Colosseum network described by config.
+    Returns the simulator core.
+    """
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6, scheduler=config['scheduler'],
+                                      util_interval=util_interval,
+                                      telemetry_window=telemetry_window,
+                                      retention=retention, reservoir_size=reservoir_size,
+                                      latency_histograms=latency_histograms,
+                                      packet_size=colosseum_models.ColGlobals.BPP if config['packet_lanes'] else None)
+    app_settings = get_app_settings(config)
+    (topology, num_usrps, num_blades, num_hosts) = get_topology(config)
+    num_chans = num_usrps * 2
 
-    # Sanity checks
-    print('[INFO] Validating correctness...')
+    # The network is made of tens of thousands of small objects that all
+    # stay alive. Garbage collection passes over them while they are being
+    # created only slow the build down (by about 2x for the FLB).
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if verbose:
+            print('[INFO] Instantiating hardware resources...')
+        # Create USRPs
+        usrps = []
+        for i in range(num_usrps):
+            usrps.append(hw.UsrpX310(sim_core, index=i, app_settings=app_settings))
+        # Create BEE7s
+        bee7blades = []
+        for i in range(num_blades):
+            bee7blades.append(hw.Bee7Blade(sim_core, index=i))
+        # Create Management Hosts
+        hosts = []
+        for i in range(num_hosts):
+            hosts.append(hw.ManagementHostandSwitch(sim_core, index=i,
+                num_coeffs=pow(num_chans,2)/num_hosts, switch_ports=HOST_SWITCH_PORTS, app_settings=app_settings))
+
+        # Build topology
+        if verbose:
+            print('[INFO] Building topology...')
+        topology.connect(sim_core, usrps, bee7blades, hosts, app_settings)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    sim_core.metadata['config'] = dict((p, config[p]) for p in CONFIG_PARAMS if p not in RUN_PARAMS)
+    return sim_core
+
+def load_snapshot(snapshot, config):
+    """
+    Restore a (possibly partially simulated) network from a snapshot.
+    The snapshot defines the network so the build parameters in config
+    are updated to match it. Returns the simulator core.
+    """
+    sim_core = rfnocsim.SimulatorCore.load_snapshot(snapshot)
+    sim_core.set_scheduler(config['scheduler'])
+    config.update(sim_core.metadata.get('config', dict()))
+    return sim_core
+
+def build_and_run(config, verbose=True, util_interval=None, telemetry_window=None):
+    """
+    Instantiate the Colosseum network described by config and simulate it.
+    Returns the simulator core.
+    """
+    sim_core = build(config, verbose, util_interval, telemetry_window)
+    if verbose:
+        print('[INFO] Running simulation...')
+    sim_core.run(config['sim_time'])
+    return sim_core
+
+def get_blade_partitioner(sim_core, num_partitions):
+    """
+    Returns a partition function for SimulatorCore.run_partitioned that
+    splits the network into num_partitions groups of adjacent BEE7 blades.
+    Everything else goes with the blade that it is connected to.
+    """
+    num_blades = len(sim_core.list_components(rfnocsim.comptype.hardware, 'BEE7_.*'))
+    if num_partitions < 1 or num_partitions > num_blades:
+        raise RuntimeError('Cannot split %d blades into %d partitions' % (num_blades, num_partitions))
+    def partition(comp_name):
+        m = re.match(r'BEE7_(\d+)', comp_name)
+        if m:
+            return int(m.group(1)) * num_partitions // num_blades
+        return None
+    return partition
+
+def validate_correctness(sim_core):
     for u in sim_core.list_components(rfnocsim.comptype.hardware, 'USRP.*'):
         sim_core.lookup(u).validate(0)
-    print('[INFO] Validating feasibility...')
-    for u in sim_core.list_components('', '.*'):
-        c = sim_core.lookup(u)
-        for a in c.get_util_attrs():
-            if c.get_utilization(a) > 1.0:
-                print('[WARN] %s: %s overutilized by %.1f%%' % (u,a,(c.get_utilization(a)-1)*100))
-    print('[INFO] Validating BEE7 FPGA image IO consistency...')
-    master_fpga = 'BEE7_000/FPGA_NE'
+
+def get_utilization(sim_core, solver=None):
+    """
+    Returns a list of (component, attribute, utilization) for all
+    resources of all components. If an analytic solver is specified,
+    the steady state utilization is returned.
+    """
+    comps = sim_core.list_components('', '.*')
+    comp_attrs = [sim_core.lookup(u).get_util_attrs() for u in comps]
+    utilz = dict()
+    for a in set(itertools.chain(*comp_attrs)):
+        utilz[a] = (solver or sim_core).get_utilization(comps, a)
+    utilization = []
+    for i in range(len(comps)):
+        for a in comp_attrs[i]:
+            utilization.append((comps[i], a, float(utilz[a][i])))
+    return utilization
+
+def get_overutilized(sim_core, utilization=None):
+    """
+    Returns a list of (component, attribute, utilization) for all
+    overutilized resources
+    """
+    if utilization is None:
+        utilization = get_utilization(sim_core)
+    return [x for x in utilization if x[2] > 1.0]
+
+def check_io_consistency(sim_core, master_fpga='BEE7_000/FPGA_NE', solver=None):
+    """
+    Returns a list of warnings for all SERDES lanes that carry different
+    data than the same lane on master_fpga
+    """
+    warnings = []
     master_stats = dict()
-    for u in sim_core.list_components('', master_fpga + '/.*SER_.*'):
-        c = sim_core.lookup(u)
+    # Group all SERDES lanes by lane name in one pass over the components
+    names = sim_core.list_components('', '.*/SER_')
+    utilz = (solver or sim_core).get_utilization(names, 'bandwidth')
+    lanes = dict()
+    for (u, util) in zip(names, utilz):
         m = re.match('(.+)/(SER_.*)', u)
-        master_stats[m.group(2)] = c.get_utilization('bandwidth')
+        lanes.setdefault(m.group(2), []).append((u, m.group(1), util))
+        if m.group(1) == master_fpga:
+            master_stats[m.group(2)] = util
     for ln in master_stats:
-        for u in sim_core.list_components('', '.*/' + ln):
-            c = sim_core.lookup(u)
-            m = re.match('(.+)/(SER_.*)', u)
-            if (c.get_utilization('bandwidth') != master_stats[ln]):
-                print('[WARN] Data flowing over ' + ln + ' is probably different between ' + master_fpga + ' and ' + m.group(1))
+        for (u, fpga, util) in lanes.get(ln, []):
+            if (util != master_stats[ln]):
+                warnings.append('Data flowing over ' + ln + ' is probably different between ' + master_fpga + ' and ' + fpga)
+    return warnings
+
+def get_max_consumption_latency(sim_core, consumer_filt='.*USRP_.*', solver=None):
+    max_latency = 0.0
+    for c in sim_core.list_components(rfnocsim.comptype.consumer, consumer_filt):
+        if solver:
+            for s in solver.get_items(c):
+                max_latency = max(max_latency, solver.get_latency(c, s))
+        else:
+            comp = sim_core.lookup(c)
+            for s in comp.get_items():
+                max_latency = max(max_latency, comp.get_latency(s))
+    return max_latency
+
+def simulate(config, analytic=False, snapshot=None, output_dir=None, formats=None,
+             render_cache=None):
+    """
+    Sweep worker: Simulates (or solves for the steady state of) a single
+    configuration and returns a picklable result summary (no simulator objects).
+    If a snapshot is specified, the network is restored from it instead of
+    being built. If an output_dir is specified, the plots of a simulation
+    are returned as render jobs so that the sweep can render them.
+    """
+    result = {'config': config, 'error': '', 'max_latency': None,
+              'overutilized': [], 'io_warnings': [], 'utilization': [], 'renders': []}
+    solver = None
+    sim_core = None
+    try:
+        if snapshot:
+            sim_core = load_snapshot(snapshot, dict(config))
+        else:
+            sim_core = build(config, verbose=False)
+        if analytic:
+            solver = rfnocsim.SteadyStateSolver(sim_core).solve()
+        else:
+            sim_core.run(config['sim_time'])
+            validate_correctness(sim_core)
+        result['max_latency'] = get_max_consumption_latency(sim_core, solver=solver)
+        result['utilization'] = get_utilization(sim_core, solver)
+        result['overutilized'] = get_overutilized(sim_core, result['utilization'])
+        result['io_warnings'] = check_io_consistency(sim_core, solver=solver)
+        if output_dir and not analytic:
+            render_pool = rfnocsim.RenderPool(deferred=True)
+            visualize(sim_core, output_dir, formats, render_cache=render_cache,
+                      render_pool=render_pool)
+            result['renders'] = render_pool.get_jobs()
+    except Exception as e:
+        # A bad configuration must not take down the rest of the sweep
+        result['error'] = str(e) if isinstance(e, RuntimeError) else '%s: %s' % (type(e).__name__, str(e))
+    finally:
+        if sim_core is not None:
+            sim_core.release()
+    return result
+
+def get_sweep_configs(base_config, sweep_params, sweep_csv):
+    """
+    Expands the base configuration into a list of configurations.
+    sweep_params is a list of "param=v1,v2,..." strings that are
+    expanded into a grid. Each row in sweep_csv is a configuration
+    which is combined with every point in the grid.
+    """
+    def convert(param, value):
+        if param not in CONFIG_PARAMS:
+            raise RuntimeError('Invalid sweep parameter: ' + param)
+        return type(base_config[param])(value)
+
+    grid = []
+    for p in (sweep_params or []):
+        (param, values) = p.split('=', 1)
+        grid.append([(param, convert(param, v)) for v in values.split(',')])
+    rows = [dict()]
+    if sweep_csv:
+        with open(sweep_csv) as f:
+            rows = [dict((k, convert(k, v)) for (k, v) in row.items() if v != '')
+                    for row in csv.DictReader(f)]
+    configs = []
+    for row in rows:
+        for point in itertools.product(*grid):
+            config = dict(base_config)
+            config.update(row)
+            config.update(dict(point))
+            configs.append(config)
+    return configs
+
+def simulate_sweep_point(point, **kwargs):
+    # Sweep worker for a (config, output_dir) pair
+    return simulate(point[0], output_dir=point[1], **kwargs)
+
+def run_sweep(configs, jobs, results_prefix, analytic=False, snapshot=None,
+              output_dir=None, formats=None, render_cache=None):
+    """
+    Simulates all configurations using a pool of jobs processes and writes
+    a summary of the results. If an output_dir is specified, the plots of
+    each configuration are written to a config_<config_id> subdirectory of
+    it by a single render pool that overlaps with the simulations.
+    """
+    print('[INFO] Sweeping %d configurations using %d processes...' % (len(configs), jobs))
+    points = [(c, os.path.join(output_dir, 'config_%d' % i) if output_dir else None)
+              for (i, c) in enumerate(configs)]
+    render_pool = rfnocsim.RenderPool(jobs) if output_dir else None
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = []
+        for r in pool.imap(functools.partial(simulate_sweep_point, analytic=analytic, snapshot=snapshot,
+                                             formats=formats, render_cache=render_cache), points):
+            for (func, args) in r.pop('renders'):
+                render_pool.submit(func, args)
+            results.append(r)
+            print('[INFO] (%d/%d) %s: %s' % (len(results), len(configs),
+                ', '.join('%s=%s' % (p, r['config'][p]) for p in CONFIG_PARAMS),
+                ('ERROR ' + r['error']) if r['error'] else
+                ('%d overutilized, max latency = %gs' % (len(r['overutilized']), r['max_latency']))))
+    finally:
+        pool.close()
+        pool.join()
+
+    with open(results_prefix + '_summary.csv', 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['config_id'] + CONFIG_PARAMS +
+            ['max_latency', 'num_overutilized', 'max_utilization', 'num_io_warnings', 'error'])
+        for i, r in enumerate(results):
+            max_util = max([u for (c, a, u) in r['utilization']] or [0.0])
+            writer.writerow([i] + [r['config'][p] for p in CONFIG_PARAMS] +
+                [r['max_latency'], len(r['overutilized']), max_util, len(r['io_warnings']), r['error']])
+    with open(results_prefix + '_utilization.csv', 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['config_id', 'component', 'attribute', 'utilization', 'overutilized'])
+        for i, r in enumerate(results):
+            for (c, a, u) in r['utilization']:
+                writer.writerow([i, c, a, u, int(u > 1.0)])
+    print('[INFO] Results written to %s_summary.csv and %s_utilization.csv' % (results_prefix, results_prefix))
+    if render_pool:
+        for f in render_pool.join():
+            print('[INFO] Wrote ' + f)
+
+# FPGA resources that are traded off against latency by the grid evaluator
+GRID_EVAL_RSRCS = ['DSP', 'BRAM_18kb']
 
+def get_config_hash(config):
+    """
+    Returns a hash that identifies the network built from config
+    """
+    build_config = dict((p, config[p]) for p in CONFIG_PARAMS if p not in RUN_PARAMS)
+    return hashlib.sha1(json.dumps(build_config, sort_keys=True).encode('utf-8')).hexdigest()
+
+def evaluate_resources(config):
+    """
+    Grid evaluator worker: Estimates the DSP and BRAM utilization of every
+    BEE7 FPGA from the topology (without building the network). Only if all
+    FPGAs fit, the steady state of the network is solved for (without
+    simulating it) to get the max latency and the IO lane utilization.
+    """
+    result = {'config': config, 'error': '', 'max_latency': None,
+              'num_overutilized': 0, 'fpgas': dict()}
+    try:
+        topology = get_topology(config)[0]
+        result['fpgas'] = colosseum_models.estimate_fpga_utilization(topology, get_app_settings(config))
+    except RuntimeError as e:
+        result['error'] = str(e)
+    for a in GRID_EVAL_RSRCS:
+        result['max_' + a] = max([f[a] for f in result['fpgas'].values()] or [0.0])
+    result['num_overutilized'] = len([u for f in result['fpgas'].values() for u in f.values() if u > 1.0])
+    if not result['error'] and result['num_overutilized'] == 0:
+        r = simulate(config, analytic=True)
+        result['error'] = r['error']
+        result['max_latency'] = r['max_latency']
+        result['num_overutilized'] = len(r['overutilized'])
+    return result
+
+def get_pareto_front(results):
+    """
+    Returns the Pareto front of the results in latency and the worst case
+    utilization of each FPGA resource as a list of groups of result indices.
+    All results in a group have the same objectives. A group is on the front
+    if no other result is at least as good in all objectives and better
+    in one.
+    """
+    objectives = [tuple([r['max_latency']] + [r['max_' + a] for a in GRID_EVAL_RSRCS]) for r in results]
+    groups = dict()
+    for (i, o) in enumerate(objectives):
+        groups.setdefault(o, []).append(i)
+    front = []
+    for o in groups:
+        dominated = False
+        for p in groups:
+            if p != o and all(x <= y for (x, y) in zip(p, o)):
+                dominated = True
+                break
+        if not dominated:
+            front.append(groups[o])
+    return sorted(front)
+
+def run_grid_evaluation(configs, jobs, results_prefix, cache_file=None):
+    """
+    Evaluates the FPGA resource budget of each swept configuration and
+    writes the latency vs. DSP/BRAM utilization Pareto front of the
+    feasible ones (no overutilized resources). Only the given grid is
+    evaluated, nothing is searched. The channels are split over the FPGAs
+    by the concentration (USRPs per router), the radix and the number of
+    dimensions that samples are broadcast along (bcast_dims) so sweep those
+    to explore the split. Evaluations are cached in cache_file by
+    configuration hash so that identical points are only evaluated once.
+    Configurations with the same objectives are reported as one Pareto point.
+    """
+    cache = dict()
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+    hashes = [get_config_hash(c) for c in configs]
+    todo = dict()
+    for (h, c) in zip(hashes, configs):
+        if h not in cache:
+            todo[h] = c
+    print('[INFO] Evaluating %d configurations (%d cached) using %d processes...' %
+          (len(todo), len(set(hashes)) - len(todo), jobs))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for (h, r) in zip(todo.keys(), pool.imap(evaluate_resources, todo.values())):
+            cache[h] = r
+            print('[INFO] (%d/%d) %s: %s' % (len(cache), len(set(hashes)),
+                ', '.join('%s=%s' % (p, r['config'][p]) for p in CONFIG_PARAMS if p not in RUN_PARAMS),
+                ('ERROR ' + r['error']) if r['error'] else format_grid_result(r)))
+    finally:
+        pool.close()
+        pool.join()
+    if cache_file:
+        with open(cache_file, 'w') as f:
+            json.dump(cache, f)
+
+    results = [cache[h] for h in hashes]
+    feasible = [i for (i, r) in enumerate(results) if not r['error'] and r['num_overutilized'] == 0]
+    front = [[feasible[i] for i in group] for group in get_pareto_front([results[i] for i in feasible])]
+    front.sort(key=lambda group: results[group[0]]['max_latency'])
+    if not front:
+        print('[WARN] None of the configurations are feasible')
+    pareto_point = dict((i, p) for (p, group) in enumerate(front) for i in group)
+    with open(results_prefix + '_pareto.csv', 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['config_id'] + CONFIG_PARAMS + ['max_latency'] +
+            ['max_' + a for a in GRID_EVAL_RSRCS] + ['num_overutilized', 'pareto', 'pareto_point', 'error'])
+        for i, r in enumerate(results):
+            writer.writerow([i] + [r['config'][p] for p in CONFIG_PARAMS] + [r['max_latency']] +
+                [r['max_' + a] for a in GRID_EVAL_RSRCS] + [r['num_overutilized'], int(i in pareto_point),
+                pareto_point.get(i, ''), r['error']])
+    with open(results_prefix + '_pareto_fpgas.csv', 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['pareto_point', 'config_id', 'fpga'] + GRID_EVAL_RSRCS)
+        for (p, group) in enumerate(front):
+            for (fpga, rsrcs) in sorted(results[group[0]]['fpgas'].items()):
+                writer.writerow([p, group[0], fpga] + [rsrcs[a] for a in GRID_EVAL_RSRCS])
+    for (p, group) in enumerate(front):
+        print('[INFO] Pareto point %d: %s (configs %s)' % (p, format_grid_result(results[group[0]]),
+            ', '.join(str(i) for i in group)))
+    print('[INFO] Results written to %s_pareto.csv and %s_pareto_fpgas.csv' % (results_prefix, results_prefix))
+    return front
+
+def format_grid_result(result):
+    # One line summary of a grid evaluation (the latency is only known for configurations that fit)
+    return ('max latency = %s, ' % ('%gs' % result['max_latency'] if result['max_latency'] is not None else 'n/a') +
+            ', '.join('max %s = %.1f%%' % (a, result['max_' + a] * 100) for a in GRID_EVAL_RSRCS))
+
+def report_profile(profiler, filename, by='class', top=10):
+    """
+    Prints the components that took the most time and writes all call
+    stacks to filename in the collapsed stack (flamegraph) format
+    """
+    stats = profiler.get_stats(by)
+    print('[INFO] Profile (top %d of %d by self time):' % (min(top, len(stats)), len(stats)))
+    for (label, calls, total, self_time) in stats[:top]:
+        print('[INFO]   %-60s %10d calls %9.3fs total %9.3fs self' % (label, calls, total, self_time))
+    profiler.write_collapsed(filename, by)
+    print('[INFO] Collapsed call stacks written to ' + filename)
+
+def visualize(sim_core, output_dir=None, formats=None, telemetry=False,
+              network_views=None, network_depth=2, render_cache=None, render_pool=None):
     # Visualize various metrics
-    vis = rfnocsim.Visualizer(sim_core)
-    vis.show_network()
+    vis = rfnocsim.Visualizer(sim_core, output_dir, formats, render_cache=render_cache,
+                              render_pool=render_pool)
+    # The flat network is too large to lay out. Show the blade/FPGA
+    # level and only drill into the requested components.
+    vis.show_network_view(depth=network_depth)
+    for root in (network_views or []):
+        vis.show_network_view(root, depth=network_depth)
     vis.new_figure([1,2])
     vis.plot_utilization(rfnocsim.comptype.hardware, 'BEE7.*', 1)
     vis.plot_utilization(rfnocsim.comptype.producer, 'USRP.*', 2)
@@ -136,7 +530,157 @@ def main():
     vis.plot_consumption_latency('.*','.*USRP_.*', 1)
     vis.plot_path_latency('tx[(0)]', '.*', 2)
     vis.show_figure()
+    if sim_core.get_latency_histograms():
+        vis.plot_latency_percentiles('.*', '.*USRP_.*')
     vis.plot_utilization(rfnocsim.comptype.producer, '.*MGMT_HOST.*')
+    if sim_core.get_util_db().get_interval() > 0:
+        vis.new_figure([1,2])
+        vis.plot_utilization_timeline(rfnocsim.comptype.channel, 'BEE7_000.*FPGA_NW.*EXT.*', 1)
+        vis.plot_utilization_timeline(rfnocsim.comptype.producer, '.*MGMT_HOST.*', 2)
+        vis.show_figure()
+    if telemetry:
+        vis.plot_telemetry(rfnocsim.comptype.channel, 'BEE7_000.*FPGA_NW.*EXT.*', 'bytes')
+        vis.plot_telemetry(rfnocsim.comptype.channel, 'BEE7_000.*FPGA_NW.*EXT.*', 'stall_ticks')
+        vis.plot_telemetry(rfnocsim.comptype.producer, '.*MGMT_HOST.*', 'stall_ticks')
+    if vis.is_headless():
+        vis.dump_consumed_streams('.*USRP_.*')
+    for f in vis.close():
+        print('[INFO] Wrote ' + f)
+
+def export_graph(sim_core, prefix, fmt, solver=None):
+    print('[INFO] Exporting the component graph...')
+    for f in sim_core.export_graph(prefix, fmt, solver):
+        print('[INFO] Graph tables written to ' + f)
+
+def solve(config, verify=False, sim_core=None, graph_prefix=None, graph_format='npz'):
+    if not sim_core:
+        sim_core = build(config)
+    print('[INFO] Solving for the steady state...')
+    start = time.time()
+    solver = rfnocsim.SteadyStateSolver(sim_core).solve()
+    print('[INFO] Solved in %.3fs' % (time.time() - start))
+    print('[INFO] Validating feasibility...')
+    for (u, a, util) in get_overutilized(sim_core, get_utilization(sim_core, solver)):
+        print('[WARN] %s: %s overutilized by %.1f%%' % (u,a,(util-1)*100))
+    print('[INFO] Validating BEE7 FPGA image IO consistency...')
+    for w in check_io_consistency(sim_core, solver=solver):
+        print('[WARN] ' + w)
+    print('[INFO] Max consumption latency = %gs' % get_max_consumption_latency(sim_core, solver=solver))
+    if graph_prefix:
+        export_graph(sim_core, graph_prefix, graph_format, solver)
+    if verify:
+        print('[INFO] Verifying the steady state with a simulation...')
+        for w in solver.verify(config['sim_time']):
+            print('[WARN] ' + w)
+
+def main():
+    # Arguments
+    parser = argparse.ArgumentParser(description='Simulate the Colosseum network')
+    parser.add_argument('--topology', type=str, default='flb', choices=['torus','flb'] + sorted(ND_TOPOLOGIES.keys()), help='Topology')
+    parser.add_argument('--dims', type=int, default=3, help='Number of dimensions (N-dimensional topologies only)')
+    parser.add_argument('--radix', type=int, default=4, help='Routers per dimension (N-dimensional topologies only)')
+    parser.add_argument('--concentration', type=int, default=2, help='USRPs per router (N-dimensional topologies only)')
+    parser.add_argument('--lanes_per_link', type=int, default=4, help='IO lanes per link between blades (N-dimensional topologies only)')
+    parser.add_argument('--bcast_dims', type=int, default=0, help='Dimensions that samples are broadcast along, the rest reduce partial products. 0 picks half of them (N-dimensional topologies only)')
+    parser.add_argument('--domain', type=str, default='time', choices=['time','frequency'], help='Domain')
+    parser.add_argument('--fir_taps', type=int, default=4, help='FIR Filter Taps (Time domain only)')
+    parser.add_argument('--fir_dly_line', type=int, default=512, help='FIR Delay Line (Time domain only)')
+    parser.add_argument('--fft_size', type=int, default=512, help='FFT Size (Frequency domain only)')
+    parser.add_argument('--fft_overlap', type=int, default=256, help='FFT Overlap (Frequency domain only)')
+    parser.add_argument('--max_unroll_depth', type=int, default=colosseum_models.PartialContribComputer.MAX_UNROLL_DEPTH, help='Max taps (or FFT bins) computed in parallel by the partial contribution computers')
+    parser.add_argument('--coeff_sets', type=int, default=colosseum_models.PartialContribComputer.COEFF_SETS, help='Coefficient sets stored in BRAM by the partial contribution computers')
+    parser.add_argument('--sync_buffers', type=int, default=0, choices=[0, 1], help='Simulate the sample alignment buffers of the partial product computers and combiners as elastic function argument FIFOs')
+    parser.add_argument('--packet_lanes', type=int, default=0, choices=[0, 1], help='Serialize the data on BEE7 IO lanes as packets and simulate their queueing delay and backpressure')
+    parser.add_argument('--samp_rate', type=float, default=100e6, help='Radio Channel Sample Rate')
+    parser.add_argument('--coherence_rate', type=float, default=1000, help='Channel coefficient update rate')
+    parser.add_argument('--scheduler', type=str, default='tick', choices=rfnocsim.SimulatorCore.SCHEDULERS, help='Simulation scheduler')
+    parser.add_argument('--sim_time', type=float, default=16e-9, help='Simulated time (s)')
+    parser.add_argument('--partitions', type=int, default=1, help='Split the network along BEE7 blades and simulate each partition in its own process')
+    parser.add_argument('--profile', type=str, default=None, help='Profile the simulator and write collapsed call stacks (for flamegraphs) to this file')
+    parser.add_argument('--profile_by', type=str, default='class', choices=rfnocsim.Profiler.GROUPINGS, help='Group profiled calls by component class, name prefix or name')
+    parser.add_argument('--util_interval', type=float, default=None, help='Sample utilization at this interval (s) and plot it over time')
+    parser.add_argument('--telemetry_window', type=float, default=None, help='Record windowed telemetry with this window size (s) and plot it')
+    parser.add_argument('--retention', type=str, default='latest', choices=rfnocsim.Consumer.RETENTION_POLICIES, help='What consumers keep in addition to the latest hops of each item')
+    parser.add_argument('--reservoir_size', type=int, default=16, help='Hop histories sampled per item (reservoir retention only)')
+    parser.add_argument('--no_latency_histograms', action='store_true', help='Do not keep latency histograms in consumers')
+    parser.add_argument('--analytic', action='store_true', help='Solve for the steady state analytically instead of simulating')
+    parser.add_argument('--verify', action='store_true', help='Verify the analytic solution with a simulation run of sim_time')
+    parser.add_argument('--load_snapshot', type=str, default=None, help='Restore the network from this snapshot instead of building it (only run parameters can be changed)')
+    parser.add_argument('--save_snapshot', type=str, default=None, help='Save a snapshot of the network to this file after simulating')
+    parser.add_argument('--sweep', type=str, action='append', metavar='PARAM=V1,V2,...', help='Sweep a parameter over a list of values (can be repeated to sweep a grid)')
+    parser.add_argument('--sweep_csv', type=str, default=None, help='CSV file with one configuration per row (header holds parameter names)')
+    parser.add_argument('--evaluate_grid', action='store_true', help='Evaluate the FPGA resources of every swept configuration and report the Pareto front of latency vs. FPGA resource utilization (analytic). Only the swept grid is evaluated. The per-FPGA channel split is set by sweeping concentration, radix and bcast_dims.')
+    parser.add_argument('--grid_eval_cache', type=str, default=None, help='Cache grid evaluations in this file')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(), help='Number of sweep worker processes')
+    parser.add_argument('--results', type=str, default='sweep', help='Prefix for sweep result files')
+    parser.add_argument('--export_graph', type=str, default=None, metavar='PREFIX', help='Export the component graph with final utilization and latency as node and edge tables')
+    parser.add_argument('--graph_format', type=str, default='npz', choices=rfnocsim.SimulatorCore.GRAPH_FORMATS, help='File format of the exported graph tables (parquet and arrow require pyarrow)')
+    parser.add_argument('--network_view', type=str, action='append', default=[], metavar='ROOT', help='Also show the network under this component (ex: BEE7_000 or BEE7_000/FPGA_NE). Can be repeated.')
+    parser.add_argument('--network_depth', type=int, default=2, help='Hierarchy levels shown in every network view')
+    parser.add_argument('--render_cache', type=str, default=None, help='Cache headless network renders in this directory so that unchanged topologies are not laid out again')
+    parser.add_argument('--output_dir', type=str, default=None, help='Write all plots to this directory instead of showing them (headless). Sweeps write the plots of each configuration to a config_<id> subdirectory.')
+    parser.add_argument('--formats', type=str, default='png', help='Comma separated image formats for headless plots (ex: png,svg)')
+    args = parser.parse_args()
+
+    config = dict((p, getattr(args, p)) for p in CONFIG_PARAMS)
+    sim_core = None
+    if args.load_snapshot:
+        print('[INFO] Loading snapshot...')
+        sim_core = load_snapshot(args.load_snapshot, config)
+    if args.evaluate_grid:
+        if args.load_snapshot:
+            raise RuntimeError('Cannot evaluate a grid when loading a snapshot')
+        configs = get_sweep_configs(config, args.sweep, args.sweep_csv)
+        run_grid_evaluation(configs, args.jobs, args.results, args.grid_eval_cache)
+        return
+    if args.sweep or args.sweep_csv:
+        configs = get_sweep_configs(config, args.sweep, args.sweep_csv)
+        if args.load_snapshot:
+            for c in configs:
+                for p in CONFIG_PARAMS:
+                    if p not in RUN_PARAMS and c[p] != config[p]:
+                        raise RuntimeError('Cannot sweep ' + p + ' when loading a snapshot. Only ' +
+                                           ', '.join(RUN_PARAMS) + ' can be swept.')
+        run_sweep(configs, args.jobs, args.results, args.analytic, args.load_snapshot,
+                  args.output_dir, args.formats.split(','), args.render_cache)
+        return
+    if args.analytic:
+        solve(config, args.verify, sim_core, args.export_graph, args.graph_format)
+        return
+
+    if not sim_core:
+        sim_core = build(config, util_interval=args.util_interval,
+                         telemetry_window=args.telemetry_window,
+                         retention=args.retention, reservoir_size=args.reservoir_size,
+                         latency_histograms=not args.no_latency_histograms)
+    if args.profile:
+        sim_core.enable_profiling()
+    print('[INFO] Running simulation...')
+    if args.partitions > 1:
+        sim_core.run_partitioned(config['sim_time'], get_blade_partitioner(sim_core, args.partitions))
+    else:
+        sim_core.run(config['sim_time'])
+    if args.profile:
+        report_profile(sim_core.disable_profiling(), args.profile, args.profile_by)
+    if args.save_snapshot:
+        print('[INFO] Saving snapshot...')
+        sim_core.save_snapshot(args.save_snapshot)
+
+    # Sanity checks
+    print('[INFO] Validating correctness...')
+    validate_correctness(sim_core)
+    print('[INFO] Validating feasibility...')
+    for (u, a, util) in get_overutilized(sim_core):
+        print('[WARN] %s: %s overutilized by %.1f%%' % (u,a,(util-1)*100))
+    print('[INFO] Validating BEE7 FPGA image IO consistency...')
+    for w in check_io_consistency(sim_core):
+        print('[WARN] ' + w)
+    if args.export_graph:
+        export_graph(sim_core, args.export_graph, args.graph_format)
+
+    visualize(sim_core, args.output_dir, args.formats.split(','),
+              telemetry=bool(args.telemetry_window), network_views=args.network_view,
+              network_depth=args.network_depth, render_cache=args.render_cache)
 
 if __name__ == '__main__':
     main()
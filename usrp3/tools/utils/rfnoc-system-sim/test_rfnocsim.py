@@ -0,0 +1,1009 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Ettus Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Equivalence tests for the simulation engine (run with pytest). Every
+test simulates a tiny network (usually a flattened butterfly) in two
+ways that must give the same results.
+"""
+
+import csv
+import fnmatch
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import sys
+import numpy as np
+import pytest
+import rfnocsim
+import colosseum_models
+import sim_colosseum
+import bench_rfnocsim
+from bench_rfnocsim import BENCH_CONFIG, build_chain
+
+SIM_TIME = 2e-6
+
+def build(sim_args=None, **params):
+    # A 2x2 flattened butterfly (2 blades) with the benchmark settings.
+    # sim_args are passed on to sim_colosseum.build.
+    config = dict(BENCH_CONFIG)
+    config.update(topology='flb_nd', dims=2, radix=2, sim_time=SIM_TIME)
+    config.update(params)
+    return sim_colosseum.build(config, verbose=False, **(sim_args or {}))
+
+def get_results(sim_core):
+    # Returns the latency and hops of every consumed item and the byte
+    # count of every channel
+    consumed = dict()
+    for c in sim_core.list_components(rfnocsim.comptype.consumer):
+        consumer = sim_core.lookup(c)
+        for item in consumer.get_items():
+            consumed[(c, str(item))] = (consumer.get_latency(item), tuple(consumer.get_hops(item)))
+    channel_bytes = dict((c, sim_core.lookup(c).get_bytes())
+                         for c in sim_core.list_components(rfnocsim.comptype.channel))
+    return (consumed, channel_bytes)
+
+def assert_same_results(sim_core, ref_core):
+    (consumed, channel_bytes) = get_results(sim_core)
+    (ref_consumed, ref_channel_bytes) = get_results(ref_core)
+    assert ref_consumed
+    assert consumed == ref_consumed
+    assert channel_bytes == ref_channel_bytes
+
+@pytest.mark.parametrize('packet_lanes', [0, 1])
+def test_event_scheduler(packet_lanes):
+    tick_core = build(scheduler='tick', packet_lanes=packet_lanes)
+    tick_core.run(SIM_TIME)
+    event_core = build(scheduler='event', packet_lanes=packet_lanes)
+    event_core.run(SIM_TIME)
+    assert event_core.get_ticks() == tick_core.get_ticks()
+    assert_same_results(event_core, tick_core)
+
+def get_histograms(sim_core):
+    histograms = dict()
+    for c in sim_core.list_components(rfnocsim.comptype.consumer):
+        consumer = sim_core.lookup(c)
+        for item in consumer.get_items():
+            histograms[(c, str(item))] = consumer.get_latency_stats(item, percentiles=(1, 50, 99))
+    return histograms
+
+def test_latency_histograms_event_scheduler():
+    # Coalesced pushes must count for all the periods that they stand for
+    tick_core = build_chain()
+    tick_core.run(1e-5)
+    event_core = build_chain()
+    event_core.set_scheduler('event')
+    event_core.run(1e-5)
+    histograms = get_histograms(tick_core)
+    assert histograms[('SINK', 'samp')]['count'] == 1000
+    assert get_histograms(event_core) == histograms
+
+@pytest.mark.parametrize('packet_lanes', [0, 1])
+def test_latency_histograms_network(packet_lanes):
+    tick_core = build(scheduler='tick', packet_lanes=packet_lanes)
+    tick_core.run(SIM_TIME)
+    event_core = build(scheduler='event', packet_lanes=packet_lanes)
+    event_core.run(SIM_TIME)
+    assert get_histograms(event_core) == get_histograms(tick_core)
+
+def get_reservoirs(sim_core):
+    reservoirs = dict()
+    for c in sim_core.list_components(rfnocsim.comptype.consumer):
+        consumer = sim_core.lookup(c)
+        for item in consumer.get_items():
+            reservoirs[(c, str(item))] = (consumer.get_sample_count(item),
+                [(t, l, tuple(h)) for (t, l, h) in consumer.get_latency_history(item)])
+    return reservoirs
+
+def test_retention_latest():
+    sim_core = build_chain()
+    sim_core.run(1e-5)
+    sink = sim_core.lookup('SINK')
+    assert sink.get_retention() == 'latest'
+    # Older streams would be older than the pipeline latency by now
+    assert sink.get_latency('samp') == pytest.approx(26 / sim_core.get_tick_rate())
+    assert sink.get_hops('samp')[1:] == ['SRC', 'CH_IN', 'FUNC', 'CH_OUT', 'SINK']
+    with pytest.raises(RuntimeError):
+        sink.get_latency_history('samp')
+
+@pytest.mark.parametrize('reservoir_size', [1, 16])
+def test_retention_reservoir(reservoir_size):
+    reservoirs = []
+    for scheduler in rfnocsim.SimulatorCore.SCHEDULERS:
+        sim_core = build(scheduler=scheduler, sim_args=dict(
+            retention='reservoir', reservoir_size=reservoir_size))
+        sim_core.run(SIM_TIME)
+        reservoirs.append(get_reservoirs(sim_core))
+    assert reservoirs[0]
+    for (count, history) in reservoirs[0].values():
+        assert count > reservoir_size
+        assert len(history) == reservoir_size
+    # The event scheduler must not skip periods that the reservoir samples
+    assert reservoirs[1] == reservoirs[0]
+
+def test_telemetry_event_scheduler():
+    # Telemetry has to observe every period so nothing is coalesced
+    channels = None
+    telemetry = []
+    for scheduler in ['tick', 'event']:
+        sim_core = build({'telemetry_window': 1e-7}, scheduler=scheduler)
+        sim_core.run(SIM_TIME)
+        channels = sim_core.list_components(rfnocsim.comptype.channel, 'BEE7_000.*EXT.*')
+        telemetry.append(sim_core.get_telemetry(channels, 'bytes'))
+    assert channels
+    assert (telemetry[1][0] == telemetry[0][0]).all()
+    assert telemetry[1][1] == pytest.approx(telemetry[0][1], rel=1e-9)
+
+@pytest.mark.parametrize('scheduler', ['tick', 'event'])
+def test_analytic_verify(scheduler):
+    # Same as sim_colosseum.py --analytic --verify
+    sim_core = build(scheduler=scheduler)
+    solver = rfnocsim.SteadyStateSolver(sim_core).solve()
+    assert solver.verify(SIM_TIME) == []
+
+@pytest.mark.skipif(sys.version_info[0] < 3, reason='Snapshots require Python 3')
+@pytest.mark.parametrize('scheduler', ['tick', 'event'])
+@pytest.mark.parametrize('packet_lanes', [0, 1])
+def test_snapshot_resume(scheduler, packet_lanes, tmp_path):
+    ref_core = build(scheduler=scheduler, packet_lanes=packet_lanes)
+    ref_core.run(SIM_TIME)
+    sim_core = build(scheduler=scheduler, packet_lanes=packet_lanes)
+    sim_core.run(SIM_TIME / 2)
+    sim_core.save_snapshot(str(tmp_path / 'snapshot.gz'))
+    sim_core = rfnocsim.SimulatorCore.load_snapshot(str(tmp_path / 'snapshot.gz'))
+    sim_core.run(SIM_TIME / 2)
+    assert sim_core.get_ticks() == ref_core.get_ticks()
+    assert_same_results(sim_core, ref_core)
+
+def test_ready_tracker_unpickle_order():
+    # The destination is restored after its watcher when unpickling
+    # starts at the destination and it refers back to the watcher
+    watcher = rfnocsim.ReadyTracker()
+    dest = rfnocsim.ReadyTracker()
+    watcher.watch(dest)
+    dest.watcher = watcher
+    dest = pickle.loads(pickle.dumps(dest))
+    assert dest.watcher.is_ready(0)
+    dest.update(busy=True)
+    assert not dest.watcher.is_ready(0)
+
+START_METHODS = (multiprocessing.get_all_start_methods()
+                 if hasattr(multiprocessing, 'get_all_start_methods') else [None])
+
+def partition_by_blade_parity(comp_name):
+    # Only the first two blades carry data in the test networks
+    m = re.match(r'BEE7_(\d+)', comp_name)
+    return int(m.group(1)) % 2 if m else None
+
+@pytest.mark.parametrize('start_method', START_METHODS)
+@pytest.mark.parametrize('packet_lanes', [0, 1])
+def test_partitioned(start_method, packet_lanes):
+    # A 2x2x2 network, the 2x2 one is not connected across blades
+    ref_core = build(dims=3, packet_lanes=packet_lanes)
+    ref_core.run(SIM_TIME)
+    sim_core = build(dims=3, packet_lanes=packet_lanes)
+    default_method = multiprocessing.get_start_method() if start_method else None
+    if start_method:
+        multiprocessing.set_start_method(start_method, force=True)
+    try:
+        sim_core.run_partitioned(SIM_TIME, partition_by_blade_parity)
+    finally:
+        if start_method:
+            multiprocessing.set_start_method(default_method, force=True)
+    assert sim_core.get_ticks() == ref_core.get_ticks()
+    assert_same_results(sim_core, ref_core)
+
+def build_cut(bw):
+    # SRC -> CH_CUT | CH_SLOW -> SINK with the cut after CH_CUT. CH_SLOW
+    # is not ready while its buffer is full.
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6, packet_size=64)
+    src = rfnocsim.Producer(sim_core, 'SRC', 4, ['samp'], latency=1)
+    cut = rfnocsim.Channel(sim_core, 'CH_CUT', latency=10)
+    slow = rfnocsim.Channel(sim_core, 'CH_SLOW', bw=bw, latency=10, buff_size=256)
+    sink = rfnocsim.Consumer(sim_core, 'SINK')
+    sim_core.connect(src, 0, cut, 0)
+    sim_core.connect(cut, 0, slow, 0)
+    sim_core.connect(slow, 0, sink, 0)
+    return sim_core
+
+def partition_cut(comp_name):
+    return 0 if comp_name in ['SRC', 'CH_CUT'] else 1
+
+def test_partitioned_saturated_cut(capsys):
+    # A cut with enough bandwidth behind it matches a sequential simulation
+    ref_core = build_cut(1e9)
+    ref_core.run(1e-5)
+    sim_core = build_cut(1e9)
+    sim_core.run_partitioned(1e-5, partition_cut, strict=True)
+    assert sim_core.get_blocked_cuts() == dict()
+    assert_same_results(sim_core, ref_core)
+    # A saturated cut would have blocked (sequentially, SRC stalls)
+    ref_core = build_cut(100e6)
+    ref_core.run(1e-5)
+    assert ref_core.lookup('CH_CUT').get_bytes() < 4000
+    sim_core = build_cut(100e6)
+    capsys.readouterr()
+    sim_core.run_partitioned(1e-5, partition_cut)
+    assert sim_core.lookup('CH_CUT').get_bytes() == 4000
+    blocked = sim_core.get_blocked_cuts()
+    assert list(blocked.keys()) == [('CH_CUT', 'CH_SLOW')]
+    (ticks, first_tick) = blocked[('CH_CUT', 'CH_SLOW')]
+    assert ticks > 0 and 0 < first_tick < sim_core.get_ticks()
+    assert '[WARN] The partition cut CH_CUT -> CH_SLOW would have blocked' in capsys.readouterr().out
+    with pytest.raises(RuntimeError, match='CH_CUT -> CH_SLOW would have blocked'):
+        build_cut(100e6).run_partitioned(1e-5, partition_cut, strict=True)
+
+class Combine(rfnocsim.Function):
+    """
+    Function that outputs one stream with the items of all its inputs
+    """
+    def __init__(self, sim_core, name, num_in_args, ticks_per_exec=1, arg_depth=1):
+        rfnocsim.Function.__init__(self, sim_core, name, num_in_args, 1, ticks_per_exec, arg_depth)
+
+    def do_func(self, args):
+        items = sum([tuple(a.items) for a in args], tuple())
+        return [self.create_outdata_stream(args[0].bpi, items, args[0].count)]
+
+def build_fifo_chain(scheduler, arg_depth=4, **sim_args):
+    # FAST -> CH_A ----------> FUNC[0] -> SINK
+    # SLOW -> DIV -> CH_B ---> FUNC[1]
+    # DIV only fires every other tick so the first FIFO of FUNC fills up
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6, scheduler=scheduler, **sim_args)
+    fast = rfnocsim.Producer(sim_core, 'FAST', 4, ['a'], latency=1)
+    slow = rfnocsim.Producer(sim_core, 'SLOW', 4, ['b'], latency=3)
+    div = Combine(sim_core, 'DIV', 1, ticks_per_exec=2)
+    ch_a = rfnocsim.Channel(sim_core, 'CH_A', latency=2)
+    ch_b = rfnocsim.Channel(sim_core, 'CH_B', latency=7)
+    func = Combine(sim_core, 'FUNC', 2, arg_depth=arg_depth)
+    sink = rfnocsim.Consumer(sim_core, 'SINK')
+    sim_core.connect(fast, 0, ch_a, 0)
+    sim_core.connect(slow, 0, div, 0)
+    sim_core.connect(div, 0, ch_b, 0)
+    sim_core.connect(ch_a, 0, func, 0)
+    sim_core.connect(ch_b, 0, func, 1)
+    sim_core.connect(func, 0, sink, 0)
+    return sim_core
+
+def run_fifo_chain(sim_core, ticks):
+    # Returns the occupancy of the first FIFO of FUNC after every tick
+    occupancy = []
+    for i in range(ticks):
+        sim_core.run(1.0 / sim_core.get_tick_rate())
+        occupancy.append(sim_core.lookup('FUNC').get_in_args()[0].get_occupancy())
+    return occupancy
+
+def test_fixed_point_rates():
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6)
+    src = rfnocsim.Producer(sim_core, 'SRC', 4, ['samp'])
+    src.set_rate(100e6 / 3)
+    scale = 1 << rfnocsim.TICK_FRAC_BITS
+    assert src.get_data_count() * scale == int(src.get_data_count() * scale)
+    # Very low rates are not rounded down to nothing
+    src.set_rate(1)
+    assert src.get_data_count() > 0
+    # A function fires on the first tick at which a full execution is done
+    assert Combine(sim_core, 'FUNC', 1, ticks_per_exec=1.5).get_ticks_per_exec() == 2
+    assert Combine(sim_core, 'FAST', 1, ticks_per_exec=0.5).get_ticks_per_exec() == 1
+
+def test_fifo_args():
+    tick_core = build_fifo_chain('tick')
+    occupancy = run_fifo_chain(tick_core, 50)
+    assert max(occupancy) == 4
+    event_core = build_fifo_chain('event')
+    assert run_fifo_chain(event_core, 50) == occupancy
+    assert_same_results(event_core, tick_core)
+
+@pytest.mark.skipif(sys.version_info[0] < 3, reason='Snapshots require Python 3')
+def test_fifo_args_telemetry():
+    # The bytes traced by FUNC are those of the stream pushed into each
+    # argument, not those of the oldest stream in its FIFO
+    sim_core = build_fifo_chain('tick', telemetry_window=1e-7)
+    run_fifo_chain(sim_core, 20)
+    sim_core.lookup('FAST').set_rate(3 * sim_core.get_tick_rate())
+    run_fifo_chain(sim_core, 20)
+    (times, values) = sim_core.get_telemetry(['FUNC', 'CH_A', 'CH_B'], 'bytes')
+    assert values[:, 0].sum() == values[:, 1].sum() + values[:, 2].sum()
+
+@pytest.mark.parametrize('telemetry_window', [None, 1e-7])
+def test_fifo_args_event_scheduler(telemetry_window):
+    # Bytes into each argument of FUNC (the channels feeding them) and
+    # bytes traced by FUNC match with the tick scheduler
+    results = []
+    for scheduler in rfnocsim.SimulatorCore.SCHEDULERS:
+        sim_core = build_fifo_chain(scheduler, arg_depth=4, telemetry_window=telemetry_window)
+        sim_core.run(1e-6)
+        sim_core.lookup('FAST').set_rate(3 * sim_core.get_tick_rate())
+        sim_core.run(1e-6)
+        bytes_in = [sim_core.lookup(c).get_bytes() for c in ['CH_A', 'CH_B', 'SINK']]
+        telemetry = None
+        if telemetry_window:
+            telemetry = sim_core.get_telemetry(['FUNC', 'CH_A', 'CH_B'], 'bytes')[1].tolist()
+        results.append((bytes_in, telemetry))
+    assert results[0][0][2] > 0
+    assert results[1] == results[0]
+
+def test_fifo_args_snapshot(tmp_path):
+    ref_core = build_fifo_chain('tick')
+    occupancy = run_fifo_chain(ref_core, 50)
+    sim_core = build_fifo_chain('tick')
+    run_fifo_chain(sim_core, 25)
+    sim_core.save_snapshot(str(tmp_path / 'snapshot.gz'))
+    sim_core = rfnocsim.SimulatorCore.load_snapshot(str(tmp_path / 'snapshot.gz'))
+    assert run_fifo_chain(sim_core, 25) == occupancy[25:]
+    assert_same_results(sim_core, ref_core)
+
+def test_sync_buffers():
+    tick_core = build(sync_buffers=1)
+    tick_core.run(SIM_TIME)
+    event_core = build(sync_buffers=1, scheduler='event')
+    event_core.run(SIM_TIME)
+    assert_same_results(event_core, tick_core)
+    sim_colosseum.validate_correctness(event_core)
+    solver = rfnocsim.SteadyStateSolver(build(sync_buffers=1)).solve()
+    assert solver.verify(SIM_TIME) == []
+
+def test_packet_lanes():
+    # Packets must actually queue up for the other packet_lanes tests to
+    # mean anything
+    sim_core = build(packet_lanes=1)
+    sim_core.run(SIM_TIME)
+    channels = [sim_core.lookup(c) for c in sim_core.list_components(rfnocsim.comptype.channel)]
+    lanes = [c for c in channels if 'peak_occupancy' in c.get_util_attrs()]
+    assert lanes
+    assert max(c.get_utilization('peak_occupancy') for c in lanes) > 0.0
+
+@pytest.mark.parametrize('params', [
+    dict(),
+    dict(domain='frequency'),
+    dict(topology='torus_nd', radix=4),
+    dict(dims=3, bcast_dims=1),
+    dict(dims=3, bcast_dims=2),
+    dict(topology='torus_nd', dims=3, radix=3, bcast_dims=2, concentration=1),
+    dict(topology='flb')])
+def test_estimate_fpga_utilization(params):
+    # The grid evaluator estimates the FPGA resources without building the
+    # network. They must match the resources of the built network.
+    config = dict(BENCH_CONFIG)
+    config.update(topology='flb_nd', dims=2, radix=2)
+    config.update(params)
+    topology = sim_colosseum.get_topology(config)[0]
+    estimate = colosseum_models.estimate_fpga_utilization(topology, sim_colosseum.get_app_settings(config))
+    built = dict()
+    for (c, a, u) in sim_colosseum.get_utilization(sim_colosseum.build(config, verbose=False)):
+        if a in sim_colosseum.GRID_EVAL_RSRCS:
+            built.setdefault(c, dict())[a] = u
+    assert estimate == built
+
+def test_estimate_narrow_link():
+    # A link that cannot carry all streams fails the estimate like the build
+    config = dict(BENCH_CONFIG)
+    config.update(topology='torus_nd', dims=3, radix=3, bcast_dims=2)
+    topology = sim_colosseum.get_topology(config)[0]
+    with pytest.raises(RuntimeError, match='needs 6 IO lanes but only has 4'):
+        colosseum_models.estimate_fpga_utilization(topology, sim_colosseum.get_app_settings(config))
+    with pytest.raises(RuntimeError, match='needs 6 IO lanes but only has 4'):
+        sim_colosseum.build(config, verbose=False)
+
+def test_grid_evaluation(tmp_path):
+    # Configurations that only differ in parameters that do not change the
+    # objectives are one Pareto point. More FIR taps need more DSPs but do
+    # not change the latency so that point is dominated.
+    config = dict(BENCH_CONFIG)
+    config.update(topology='flb_nd', dims=2, radix=2)
+    configs = sim_colosseum.get_sweep_configs(config, ['coherence_rate=1000,2000', 'fir_taps=4,8'], None)
+    front = sim_colosseum.run_grid_evaluation(configs, 1, str(tmp_path / 'grid'))
+    assert front == [[i for (i, c) in enumerate(configs) if c['fir_taps'] == 4]]
+    with open(str(tmp_path / 'grid_pareto.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert [r['pareto_point'] for r in rows] == [('0' if c['fir_taps'] == 4 else '') for c in configs]
+
+def test_bench_compare():
+    def results(**workloads):
+        return {'workloads': workloads}
+    base = {'ticks_per_s': 1000.0, 'build_time_s': 1.0, 'peak_rss_mb': 100.0, 'retained_blocks_per_tick': 0.0}
+    thresholds = bench_rfnocsim.parse_thresholds(['build_time_s=0.5'])
+    # Improvements, changes within the thresholds and changes below the
+    # noise floor are not regressions
+    same = dict(base, ticks_per_s=2000.0, build_time_s=1.4, peak_rss_mb=100.5, retained_blocks_per_tick=0.5)
+    assert bench_rfnocsim.compare(results(flb=base), results(flb=same), thresholds) == []
+    # Missing workloads and metrics are skipped
+    assert bench_rfnocsim.compare(results(flb=base), results(torus=base), thresholds) == []
+    assert bench_rfnocsim.compare(results(flb=base), results(flb=dict(base, ticks_per_s=None)), thresholds) == []
+    # Regressions are reported in the bad direction of every metric
+    worse = dict(base, ticks_per_s=800.0, build_time_s=1.6, retained_blocks_per_tick=2.0)
+    regressions = dict(((n, m), (old, new, rel)) for (n, m, old, new, rel) in
+                       bench_rfnocsim.compare(results(flb=base), results(flb=worse), thresholds))
+    assert sorted(regressions) == [('flb', 'build_time_s'), ('flb', 'retained_blocks_per_tick'), ('flb', 'ticks_per_s')]
+    assert regressions[('flb', 'ticks_per_s')] == (1000.0, 800.0, pytest.approx(0.2))
+    assert regressions[('flb', 'build_time_s')] == (1.0, 1.6, pytest.approx(0.6))
+    assert regressions[('flb', 'retained_blocks_per_tick')] == (0.0, 2.0, float('inf'))
+    with pytest.raises(RuntimeError):
+        bench_rfnocsim.parse_thresholds(['alloc_blocks_per_tick=0.1'])
+
+def test_submatrix_ordering():
+    # Streams can mix submatrices and plain string items. They must sort
+    # like their string representations no matter which side is compared.
+    gen = rfnocsim.DataStream.submatrix_gen
+    items = ['zz', gen('pp', [1, 0]), 'aa', gen('pp', [0, 1]), 'pp[(0);(1)]x', gen('tx', [3])]
+    assert [str(i) for i in sorted(items)] == sorted(str(i) for i in items)
+    assert [str(i) for i in sorted(reversed(items))] == sorted(str(i) for i in items)
+    assert 'aa' < gen('pp', [0]) < 'zz'
+    assert 'zz' > gen('pp', [0]) > 'aa'
+    assert gen('pp', [0]) <= gen('pp', [0]) and gen('pp', [0]) >= gen('pp', [0])
+    assert sorted([gen('pp', [2]), gen('pp', [0, 1]), gen('pp', [1])]) == \
+        [gen('pp', [0, 1]), gen('pp', [1]), gen('pp', [2])]
+
+def test_datastream_fork():
+    # Forks share the hop chain and items of their parent but adding hops
+    # or assigning items only changes the fork
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6)
+    src = rfnocsim.Producer(sim_core, 'SRC', 4, ['a', 'b'])
+    data = rfnocsim.DataStream(4, ['a', 'b'], 3, producer=src)
+    data.add_hop('CH', 5)
+    fork = data.fork()
+    assert fork.get_last_hop() is data.get_last_hop()
+    assert fork.items is data.items
+    fork.add_hop('CH_A', 2)
+    data.add_hop('CH_B', 7)
+    fork.items = ('c',)
+    assert [h.location for h in data.get_hops()] == ['Gen@SRC', 'CH', 'CH_B']
+    assert [h.location for h in fork.get_hops()] == ['Gen@SRC', 'CH', 'CH_A']
+    assert fork.get_last_hop().parent is data.get_last_hop().parent
+    assert data.items == ('a', 'b')
+    assert (data.get_latency(100), fork.get_latency(100)) == (112, 107)
+    assert (data.get_bytes(), fork.get_bytes()) == (24, 12)
+
+def test_datastream_fanout():
+    # Every consumer of a broadcast sees its own route
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6)
+    src = rfnocsim.Producer(sim_core, 'SRC', 4, ['samp'])
+    for (name, latency) in [('A', 3), ('B', 9)]:
+        ch = rfnocsim.Channel(sim_core, 'CH_' + name, latency=latency)
+        sink = rfnocsim.Consumer(sim_core, 'SINK_' + name)
+        sim_core.connect(src, 0, ch, 0)
+        sim_core.connect(ch, 0, sink, 0)
+    sim_core.run(1e-7)
+    for (name, latency) in [('A', 3), ('B', 9)]:
+        sink = sim_core.lookup('SINK_' + name)
+        assert sink.get_hops('samp')[1:] == ['SRC', 'CH_' + name, 'SINK_' + name]
+        assert sink.get_latency('samp') == pytest.approx(latency / 100e6)
+
+def test_hop_db():
+    # HopDb answers latency queries from interned routes and prefix sums.
+    # The answers must match a linear scan over the hops.
+    sim_core = rfnocsim.SimulatorCore(tick_rate=100e6)
+    src = rfnocsim.Producer(sim_core, 'SRC', 4, ['a'])
+    rfnocsim.DataStream.clear_intern_caches()
+    hops = [('CH', 5), ('FUNC', 2), ('CH', 7), ('SINK', 1)]
+    data = rfnocsim.DataStream(4, ['a'], 1, producer=src)
+    for (loc, latency) in hops:
+        data.add_hop(loc, latency)
+    hop_db = data.get_hop_db()
+    assert hop_db.get_hops() == ['Gen@SRC'] + [h[0] for h in hops]
+    assert (hop_db.get_src(), hop_db.get_dst()) == ('Gen@SRC', 'SINK')
+    # Latency up to the first visit of a location (or the end of the route)
+    for (loc, latency) in [('Gen@SRC', 0), ('CH', 5), ('FUNC', 7), ('SINK', 15), ('', 15)]:
+        assert hop_db.get_latency(100, loc) == 100 + latency
+    # The same route with the same latencies is interned once and a
+    # HopDb can be updated in place for it
+    other = rfnocsim.DataStream(4, ['a'], 1, producer=src)
+    for (loc, latency) in hops[:-1]:
+        other.add_hop(loc, latency)
+    assert other.get_hop_db().get_hops() == hop_db.get_hops()[:-1]
+    assert rfnocsim.DataStream.get_intern_cache_sizes() == (2, 2)
+    other.add_hop('SINK', 1)
+    other.get_hop_db()
+    assert rfnocsim.DataStream.get_intern_cache_sizes() == (2, 2)
+    sink_id = rfnocsim.DataStream.intern_location('SINK')
+    assert hop_db.update(other.get_last_hop().parent, sink_id, 1)
+    assert not hop_db.update(other.get_last_hop().parent, sink_id, 2)
+    assert not hop_db.update(other.get_last_hop().parent.parent, sink_id, 1)
+    hop_db.rebase(-10)
+    assert hop_db.get_latency(100) == 125
+    rfnocsim.DataStream.clear_intern_caches()
+    assert rfnocsim.DataStream.get_intern_cache_sizes() == (0, 0)
+    assert hop_db.get_latency(100, 'FUNC') == 117
+
+def test_sweep(tmp_path):
+    # A sweep over a grid and CSV rows must give the same results as
+    # simulating every configuration on its own. Bad configurations are
+    # reported as errors without stopping the sweep.
+    with open(str(tmp_path / 'rows.csv'), 'w') as f:
+        f.write('dims,lanes_per_link\n2,4\n3,1\n')
+    config = dict(BENCH_CONFIG)
+    config.update(topology='flb_nd', radix=2, sim_time=SIM_TIME)
+    configs = sim_colosseum.get_sweep_configs(config, ['fir_taps=4,8'], str(tmp_path / 'rows.csv'))
+    assert [(c['dims'], c['lanes_per_link'], c['fir_taps']) for c in configs] == \
+        [(2, 4, 4), (2, 4, 8), (3, 1, 4), (3, 1, 8)]
+    sim_colosseum.run_sweep(configs, 1, str(tmp_path / 'sweep'))
+    with open(str(tmp_path / 'sweep_summary.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert [r['config_id'] for r in rows] == ['0', '1', '2', '3']
+    for (c, r) in zip(configs, rows):
+        expected = sim_colosseum.simulate(c)
+        assert r['error'] == expected['error']
+        assert (r['error'] != '') == (c['dims'] == 3)
+        if not r['error']:
+            assert float(r['max_latency']) == pytest.approx(expected['max_latency'])
+            assert int(r['num_overutilized']) == len(expected['overutilized'])
+    with open(str(tmp_path / 'sweep_utilization.csv')) as f:
+        utilization = list(csv.DictReader(f))
+    assert set(u['config_id'] for u in utilization) == set(['0', '1'])
+
+def test_visualizer_missing_graphviz(tmp_path, monkeypatch):
+    # Without Graphviz, headless network renders are skipped (the source
+    # is still written) and all other outputs are written
+    monkeypatch.setenv('PATH', str(tmp_path / 'empty'))
+    sim_core = build()
+    sim_core.run(SIM_TIME)
+    output_dir = str(tmp_path / 'out')
+    vis = rfnocsim.Visualizer(sim_core, output_dir, render_workers=0)
+    vis.show_network_view(depth=1)
+    vis.plot_utilization(rfnocsim.comptype.hardware, 'BEE7.*')
+    vis.dump_consumed_streams()
+    files = vis.close()
+    assert sorted(os.path.basename(f) for f in files) == \
+        ['figure_01.json', 'figure_01.png', 'network_top.gv']
+    assert sorted(os.listdir(output_dir)) == \
+        ['consumed_streams.csv', 'consumed_streams.json', 'figure_01.json', 'figure_01.png', 'network_top.gv']
+
+def test_visualizer_headless(tmp_path):
+    # Rendering in the background, in the calling process and from the
+    # deferred jobs of a sweep worker must write the same files
+    sim_core = build(sim_args=dict(util_interval=5e-7))
+    sim_core.run(SIM_TIME)
+    outputs = dict()
+    for mode in ['pool', 'inline', 'deferred']:
+        output_dir = str(tmp_path / mode)
+        render_pool = rfnocsim.RenderPool(deferred=True) if mode == 'deferred' else None
+        vis = rfnocsim.Visualizer(sim_core, output_dir, ['png', 'svg'],
+                                  render_workers=(1 if mode == 'pool' else 0), render_pool=render_pool)
+        vis.new_figure([1, 2])
+        vis.plot_utilization(rfnocsim.comptype.hardware, 'BEE7.*', 1)
+        vis.plot_utilization_timeline(rfnocsim.comptype.producer, 'USRP.*', 2)
+        vis.show_figure('utilization')
+        vis.plot_consumption_latency('.*', '.*USRP_.*')
+        vis.dump_consumed_streams('.*USRP_.*')
+        files = vis.close()
+        if mode == 'deferred':
+            assert files == []
+            pool = rfnocsim.RenderPool(1)
+            for (func, args) in render_pool.get_jobs():
+                pool.submit(func, args)
+            files = pool.join()
+        assert sorted(files) == sorted(os.path.join(output_dir, f) for f in
+            ['utilization.png', 'utilization.svg', 'utilization.json',
+             'figure_02.png', 'figure_02.svg', 'figure_02.json'])
+        with open(os.path.join(output_dir, 'utilization.json')) as f:
+            outputs[mode] = json.load(f)
+        assert os.path.isfile(os.path.join(output_dir, 'consumed_streams.csv'))
+    assert outputs['pool'] == outputs['inline'] == outputs['deferred']
+    (util, timeline) = outputs['pool']
+    assert (util['plot'], timeline['plot']) == ('utilization', 'utilization_timeline')
+    assert util['comps'] == sim_core.list_components(rfnocsim.comptype.hardware, 'BEE7.*')
+    assert util['utilz'] == [(sim_core.get_utilization(util['comps'], a) * 100).tolist() for a in util['attrs']]
+    with open(str(tmp_path / 'pool' / 'consumed_streams.json')) as f:
+        streams = json.load(f)['streams']
+    usrps = sim_core.list_components(rfnocsim.comptype.consumer, '.*USRP_.*')
+    assert len(streams) == sum(len(sim_core.lookup(c).get_items()) for c in usrps) > 0
+
+def read_view(dot):
+    # Parses a network view into ({label: style}, {(src, dst): weight})
+    nodes = dict(re.findall(r'^\s*(\d+) \[label="?([^" ]*)', dot.source, re.M))
+    styles = dict((nodes[i], s) for (i, s) in re.findall(r'^\s*(\d+) \[.*style=(\w+)', dot.source, re.M))
+    edges = dict(((nodes[s], nodes[d]), int(w)) for (s, d, w) in
+                 re.findall(r'^\s*(\d+) -> (\d+) \[.*weight=(\d+)', dot.source, re.M))
+    return (dict((l, styles.get(l)) for l in nodes.values()), edges)
+
+def count_edges(sim_core, src, dst):
+    (_, edges) = sim_core.get_graph_tables()
+    return sum(1 for (s, d) in zip(edges['src'], edges['dst']) if s.startswith(src) and d.startswith(dst))
+
+def test_network_view():
+    # The top view collapses lanes into FPGAs and drill-down views show
+    # the lanes. Edge weights count the collapsed connections.
+    sim_core = build()
+    (nodes, edges) = read_view(sim_core.network_view_to_dot())
+    fpgas = ['FPGA_NE', 'FPGA_NW', 'FPGA_SE', 'FPGA_SW']
+    assert set(fpgas + ['USRP_%03d' % i for i in range(8)]) <= set(nodes)
+    assert not [n for n in nodes if 'SER_' in n]
+    for src in fpgas:
+        for dst in fpgas:
+            if src != dst:
+                assert edges[(src, dst)] == count_edges(
+                    sim_core, 'BEE7_000/%s/' % src, 'BEE7_000/%s/' % dst) > 0
+    assert edges[('USRP_000', 'FPGA_NW')] == 1
+    (nodes, edges) = read_view(sim_core.network_view_to_dot('BEE7_000/FPGA_NW', 1))
+    assert set('SER_EW_%02d' % i for i in range(16)) <= set(nodes)
+    assert nodes['BEE7_000/FPGA_NE'] == nodes['USRP_000'] == 'dashed'
+    assert 'BEE7_000/FPGA_NW' not in nodes
+    assert sum(w for ((s, d), w) in edges.items() if s == 'BEE7_000/FPGA_NE') == \
+        count_edges(sim_core, 'BEE7_000/FPGA_NE/', 'BEE7_000/FPGA_NW/')
+    # Views are deterministic, so they can be used as render cache keys
+    assert sim_core.network_view_to_dot().source == build().network_view_to_dot().source
+
+def test_network_view_cache(tmp_path, monkeypatch):
+    # Cached renders are copied without running Graphviz
+    monkeypatch.setenv('PATH', str(tmp_path / 'empty'))
+    sim_core = build()
+    cache_dir = str(tmp_path / 'cache')
+    output_dir = str(tmp_path / 'out')
+    vis = rfnocsim.Visualizer(sim_core, output_dir, ['png', 'svg'], render_workers=0, render_cache=cache_dir)
+    vis.show_network_view(depth=1)
+    assert vis.close() == [os.path.join(output_dir, 'network_top.gv')]
+    assert not os.path.isdir(cache_dir)
+    # Seed the cache with a render of the same view
+    source = sim_core.network_view_to_dot(depth=1).source
+    key = hashlib.sha1(('fdp\n' + source).encode('utf-8')).hexdigest()
+    os.makedirs(cache_dir)
+    with open(os.path.join(cache_dir, key + '.png'), 'wb') as f:
+        f.write(b'cached png')
+    vis = rfnocsim.Visualizer(sim_core, output_dir, ['png', 'svg'], render_workers=0, render_cache=cache_dir)
+    vis.show_network_view(depth=1)
+    # A different view misses the cache
+    vis.show_network_view(depth=2)
+    assert vis.close() == [os.path.join(output_dir, f) for f in
+                           ['network_top.gv', 'network_top.gv.png', 'network_top.gv']]
+    with open(os.path.join(output_dir, 'network_top.gv.png'), 'rb') as f:
+        assert f.read() == b'cached png'
+    # Nothing is added to the cache without Graphviz
+    assert sorted(os.listdir(cache_dir)) == [key + '.png']
+
+def test_component_index():
+    # Indexed queries must return what a re.match / fnmatch scan over all
+    # components returns
+    sim_core = sim_colosseum.build(dict(BENCH_CONFIG), verbose=False)
+    names = sim_core.list_components()
+    types = dict((n, sim_core.lookup(n).type) for n in names)
+    assert len(names) == len(types) > 10000
+    for pattern in ['', 'ab?', 'BEE7_010.*FPGA_NW.*SER_EW_.*', 'BEE7_01[0-2]/FPGA_N./SER_EXT_0',
+                    'USRP_00*1', '.*coeff', 'BEE7_000/FPGA_NE/SER_EXT_00/I', 'BEE7_00\\d/FPGA_SE$',
+                    '(BEE7)_001/FPGA_NW/pp', 'BEE7_000/FPGA_NE/SER_EXT_0|USRP_12', 'BEE7_015/FPGA_SE/',
+                    'BEE7_0{2}3', 'MGMT_HOST_.+/']:
+        regex = re.compile(pattern)
+        for ctype in ['', rfnocsim.comptype.channel, rfnocsim.comptype.hardware]:
+            assert sim_core.list_components(ctype, pattern) == \
+                [n for n in names if (not ctype or types[n] == ctype) and regex.match(n)], pattern
+    for pattern in ['BEE7_010/FPGA_NW/SER_EW_*', 'BEE7_01?/FPGA_[NS]E', 'USRP_*', '*/FPGA_NW/SER_EXT_1*/O',
+                    'BEE7_000', 'BEE7_000/FPGA_NE/SER_EW_00/I/x', '*']:
+        segs = pattern.split('/')
+        for ctype in ['', rfnocsim.comptype.channel]:
+            assert sim_core.glob_components(pattern, ctype) == \
+                [n for n in names if (not ctype or types[n] == ctype) and len(n.split('/')) >= len(segs) and
+                 all(fnmatch.fnmatchcase(s, p) for (s, p) in zip(n.split('/'), segs))], pattern
+
+def test_component_index_updates():
+    # Names that are added after a query are found by the next one
+    index = rfnocsim.ComponentIndex()
+    for name in ['a', 'ab', 'abb', 'ac', 'b/a']:
+        index.add(name, 'x')
+    assert sorted(index.find('', 'ab?')) == ['a', 'ab', 'abb', 'ac']
+    assert sorted(index.find('', 'ab?$')) == ['a', 'ab']
+    index.add('a/b', 'y')
+    index.add('abc', 'y')
+    assert sorted(index.find('', 'ab?')) == ['a', 'a/b', 'ab', 'abb', 'abc', 'ac']
+    assert sorted(index.find('y', '')) == ['a/b', 'abc']
+    assert sorted(index.glob('a*')) == ['a', 'a/b', 'ab', 'abb', 'abc', 'ac']
+    assert index.glob('b/?', 'x') == ['b/a']
+
+def test_utilization_db():
+    # Vectorized utilization must match the per-component utilization and
+    # a coalesced span must be sampled like the ticks it stands for
+    dbs = [rfnocsim.UtilizationDb(tick_rate=100, interval=10) for i in range(2)]
+    for db in dbs:
+        (a, b) = (db.add('A', 1000.0, 1), db.add('B', 500.0, 2))
+    counts = dbs[0].get_byte_counts()
+    for tick in range(1, 31):
+        counts[a] += 10
+        counts[b] += 10 if tick <= 15 else 0
+        dbs[0].advance(tick)
+    (times, util) = dbs[0].get_utilization_series()
+    assert times.tolist() == pytest.approx([0.1, 0.2, 0.3])
+    assert util == pytest.approx(np.array([[1.0, 2.0], [1.0, 1.0], [1.0, 0.0]]))
+    assert dbs[0].get_utilization(30).tolist() == pytest.approx([1.0, 1.0])
+    assert dbs[0].get_utilization(30, ids=[b]).tolist() == [dbs[0].get_comp_utilization(b, 30)]
+    assert dbs[0].get_utilization(30, 'peak_occupancy').tolist() == [0.0, 0.0]
+    # Coalesced: B is done after tick 15, A moves 10 bytes per tick until tick 30
+    counts = dbs[1].get_byte_counts()
+    for tick in range(1, 16):
+        counts[a] += 10
+        counts[b] += 10
+        dbs[1].advance(tick)
+    dbs[1].begin_coalesce(15)
+    counts[a] += 150
+    dbs[1].end_coalesce(30)
+    assert dbs[1].get_utilization_series()[1] == pytest.approx(util)
+    # Components that are added later have no bytes in the earlier samples
+    c = dbs[0].add('C', 100.0, 0)
+    dbs[0].get_byte_counts()[c] += 10
+    dbs[0].advance(40)
+    (times, util) = dbs[0].get_utilization_series(ids=[c])
+    assert util == pytest.approx(np.array([[0.0], [0.0], [0.0], [1.0]]))
+    assert dbs[0].get_names() == ['A', 'B', 'C'] and dbs[0].get_id('C') == c
+
+def test_core_utilization():
+    # The simulator core answers for all components at once
+    sim_core = build(sim_args=dict(util_interval=5e-7))
+    sim_core.run(SIM_TIME)
+    comps = [c for c in sim_core.list_components()
+             if 'bandwidth' in sim_core.lookup(c).get_util_attrs()]
+    assert len(comps) > 100
+    util = sim_core.get_utilization(comps, 'bandwidth')
+    assert util.tolist() == [sim_core.lookup(c).get_utilization('bandwidth') for c in comps]
+    assert max(util) > 0.0
+    (times, series) = sim_core.get_utilization_series(comps)
+    assert times.tolist() == pytest.approx([5e-7, 1e-6, 1.5e-6, 2e-6])
+    # The windows add up to the total
+    assert series.mean(axis=0).tolist() == pytest.approx(util.tolist())
+
+def test_telemetry_ring():
+    # The ring buffer keeps the last depth completed windows, also across
+    # gaps that are longer than the ring
+    BYTES = rfnocsim.TelemetryRecorder.BYTES
+    STALL_TICKS = rfnocsim.TelemetryRecorder.STALL_TICKS
+    rec = rfnocsim.TelemetryRecorder(10, 3)
+    for tick in range(1, 46):
+        rec.add(BYTES, tick, 1)
+    (ends, values) = rec.get_windows(45)
+    assert ends.tolist() == [20, 30, 40]
+    assert values[:, BYTES].tolist() == [10, 10, 10]
+    rec.add(BYTES, 1000, 1)
+    (ends, values) = rec.get_windows(1000)
+    assert ends.tolist() == [980, 990, 1000]
+    assert values[:, BYTES].tolist() == [0, 0, 1]
+    rec.add_span(STALL_TICKS, 1000, 1032, 2.0)
+    (ends, values) = rec.get_windows(1040)
+    assert ends.tolist() == [1020, 1030, 1040]
+    assert values[:, STALL_TICKS].tolist() == [20, 20, 4]
+    assert values[:, BYTES].tolist() == [0, 0, 0]
+    # Spans longer than the ring only fill the windows that are kept
+    rec.add_span(STALL_TICKS, 1040, 1200)
+    (ends, values) = rec.get_windows(1200)
+    assert ends.tolist() == [1180, 1190, 1200]
+    assert values[:, STALL_TICKS].tolist() == [10, 10, 10]
+
+def test_telemetry_depth():
+    # A short ring holds the last windows of a long one
+    telemetry = []
+    for depth in [4, 1024]:
+        sim_core = rfnocsim.SimulatorCore(tick_rate=100e6, telemetry_window=1e-7, telemetry_depth=depth)
+        src = rfnocsim.Producer(sim_core, 'SRC', 4, ['samp'])
+        ch = rfnocsim.Channel(sim_core, 'CH', 100e6, latency=10)
+        sink = rfnocsim.Consumer(sim_core, 'SINK')
+        sim_core.connect(src, 0, ch, 0)
+        sim_core.connect(ch, 0, sink, 0)
+        sim_core.run(1e-6)
+        telemetry.append(sim_core.get_telemetry(['SRC', 'CH'], 'bytes'))
+    assert telemetry[0][0] == pytest.approx(np.array([7e-7, 8e-7, 9e-7, 1e-6]))
+    assert len(telemetry[1][0]) == 10
+    assert (telemetry[0][0] == telemetry[1][0][-4:]).all()
+    assert (telemetry[0][1] == telemetry[1][1][-4:]).all()
+    assert telemetry[0][1].all()
+
+@pytest.mark.parametrize('params', [
+    dict(dims=2, radix=3),
+    dict(dims=2, radix=4, concentration=3),
+    dict(dims=3, radix=2, bcast_dims=2),
+    dict(topology='torus_nd', dims=2, radix=4),
+    dict(topology='torus_nd', dims=2, radix=5, concentration=1),
+    dict(topology='torus_nd', dims=3, radix=3, bcast_dims=2, concentration=1)])
+def test_nd_topology(params):
+    # Every USRP must get back the fully reduced TX samples of its channels
+    config = dict(BENCH_CONFIG)
+    config.update(topology='flb_nd', scheduler='event', sim_time=4e-6)
+    config.update(params)
+    (topology, num_usrps, num_blades, num_hosts) = sim_colosseum.get_topology(config)
+    radix = config['radix']
+    assert num_usrps == pow(radix, config['dims']) * config['concentration']
+    assert num_blades == -(-pow(radix, config['dims']) // 4)
+    # Links are symmetric and only go to the neighbors of a router
+    for addr in topology.get_addrs():
+        (router_map, terminal_lane) = topology.get_portmap(addr)
+        for dim in range(config['dims']):
+            neighbors = set(router_map[dim].keys())
+            if config['topology'] == 'flb_nd':
+                assert neighbors == set(range(radix)) - set([addr[dim]])
+            else:
+                assert neighbors == set([(addr[dim] + 1) % radix, (addr[dim] - 1) % radix])
+            for coord in neighbors:
+                peer = addr[:dim] + (coord,) + addr[dim+1:]
+                assert addr[dim] in topology.get_portmap(peer)[0][dim]
+    sim_core = sim_colosseum.build(config, verbose=False)
+    usrps = sim_core.list_components(rfnocsim.comptype.hardware, 'USRP_.*')
+    assert len(usrps) == num_usrps
+    sim_core.run(config['sim_time'])
+    sim_colosseum.validate_correctness(sim_core)
+
+def test_profiler(tmp_path, monkeypatch):
+    # Time is attributed to call stacks of instrumented methods. The fake
+    # clock only advances in the methods so all times are exact.
+    clock = [0.0]
+    monkeypatch.setattr(rfnocsim.timeit, 'default_timer', lambda: clock[0])
+    class Comp(object):
+        def outer(self):
+            clock[0] += 1
+            self.inner()
+            self.inner()
+            clock[0] += 1
+        def inner(self):
+            clock[0] += 2
+        def rec(self, n):
+            clock[0] += 1
+            if n:
+                self.rec(n - 1)
+    comp = Comp()
+    profiler = rfnocsim.Profiler()
+    for method in ['outer', 'inner', 'rec']:
+        profiler.instrument(comp, method, ('Comp', method, 'BEE7_000/FPGA_NW/func'))
+    comp.outer()
+    comp.outer()
+    comp.rec(2)
+    profiler.restore()
+    comp.outer()
+    # Recursive calls only count once in the total time
+    assert profiler.get_stats() == [('Comp.inner', 4, 8.0, 8.0), ('Comp.outer', 2, 12.0, 4.0),
+                                    ('Comp.rec', 3, 3.0, 3.0)]
+    assert profiler.get_stats('prefix')[0][0] == 'BEE7_000/FPGA_NW:Comp.inner'
+    filename = str(tmp_path / 'profile.txt')
+    profiler.write_collapsed(filename)
+    with open(filename) as f:
+        assert f.read().splitlines() == [
+            'Comp.outer 4000000', 'Comp.outer;Comp.inner 8000000', 'Comp.rec 1000000',
+            'Comp.rec;Comp.rec 1000000', 'Comp.rec;Comp.rec;Comp.rec 1000000']
+    profiler.write_collapsed(filename, 'prefix', 1)
+    with open(filename) as f:
+        assert f.read().splitlines()[1] == 'BEE7_000:Comp.outer;BEE7_000:Comp.inner 8000000'
+    with pytest.raises(RuntimeError):
+        profiler.get_stats('module')
+
+def test_profiler_simulation(tmp_path):
+    # Every profiled call of a simulation happens under SimulatorCore.run
+    sim_core = build_chain()
+    sim_core.enable_profiling()
+    sim_core.run(1e-6)
+    profiler = sim_core.disable_profiling()
+    sim_core.run(1e-6)
+    stats = dict((s[0], s[1]) for s in profiler.get_stats())
+    assert stats['SimulatorCore.run'] == 1
+    assert stats['SimulatorCore.tick'] == 100
+    assert stats['Producer.tick'] == 100
+    filename = str(tmp_path / 'profile.txt')
+    profiler.write_collapsed(filename, 'name')
+    with open(filename) as f:
+        stacks = [line.rsplit(' ', 1)[0].split(';') for line in f.read().splitlines()]
+    assert stacks and all(s[0] == 'SimulatorCore.run' for s in stacks)
+    assert ['SimulatorCore.run', 'SimulatorCore.tick', 'SRC:Producer.tick'] in stacks
+
+class CountingTracker(rfnocsim.ReadyTracker):
+    # Counts how often the state is queried (by watchers or directly)
+    def __init__(self):
+        rfnocsim.ReadyTracker.__init__(self)
+        self.queries = 0
+
+    def get_state(self):
+        self.queries += 1
+        return rfnocsim.ReadyTracker.get_state(self)
+
+def test_ready_tracker():
+    # a -> b -> d and a -> c -> d (diamond) plus an unrelated tracker
+    (a, b, c, d, other) = [CountingTracker() for i in range(5)]
+    a.watch(b)
+    a.watch(c)
+    b.watch(d)
+    c.watch(d)
+    assert a.is_ready(0) and a.get_ready_tick(5) == 5
+    d.update(tick=10)
+    assert not a.is_ready(9) and a.is_ready(10) and a.get_ready_tick(5) == 10
+    c.update(busy=True)
+    assert not a.is_ready(10) and a.get_ready_tick(10) == 11 and b.is_ready(10)
+    b.update(dead=True)
+    assert a.get_ready_tick(10) is None and not c.is_ready(100)
+    # Cached states are not recomputed until something downstream changes
+    queries = [t.queries for t in (b, c, d)]
+    for i in range(10):
+        a.is_ready(20)
+    b.update(dead=True)
+    other.update(busy=True)
+    a.is_ready(20)
+    assert [t.queries for t in (b, c, d)] == queries
+    d.update(tick=0)
+    c.update()
+    b.update()
+    assert a.is_ready(0)
+    assert [t.queries for t in (b, c, d)] == [q + 1 for q in queries[:2]] + [queries[2] + 2]
+    a.unwatch(c)
+    c.update(dead=True)
+    assert a.is_ready(0)
+
+@pytest.mark.parametrize('scheduler', ['tick', 'event'])
+def test_ready_tracker_network(scheduler):
+    # The cached readiness of every component must match readiness that
+    # is computed from scratch (unpickled trackers have no cached states)
+    sim_core = build(packet_lanes=1, scheduler=scheduler)
+    trackers = [sim_core.lookup(c).get_ready_tracker() for c in sim_core.list_components()
+                if hasattr(sim_core.lookup(c), 'get_ready_tracker')]
+    trackers = [t for t in trackers if t is not None]
+    assert len(trackers) > 100
+    not_ready = 0
+    for i in range(20):
+        sim_core.run(SIM_TIME / 20)
+        states = [t.get_state() for t in trackers]
+        assert [t.get_state() for t in pickle.loads(pickle.dumps(trackers))] == states
+        not_ready += len([t for t in trackers if not t.is_ready(sim_core.get_ticks())])
+    assert not_ready > 0
+
+def read_graph(files, fmt):
+    # Reads exported (nodes, edges) tables back as dicts of NumPy columns
+    if fmt == 'npz':
+        archive = np.load(files[0])
+        return [dict((k[len(t) + 1:], archive[k]) for k in archive.files if k.startswith(t + '_'))
+                for t in ['nodes', 'edges']]
+    import pyarrow.feather
+    import pyarrow.parquet
+    read = pyarrow.parquet.read_table if fmt == 'parquet' else pyarrow.feather.read_table
+    return [dict((k, np.array(v)) for (k, v) in read(f).to_pydict().items()) for f in files]
+
+@pytest.mark.parametrize('fmt', rfnocsim.SimulatorCore.GRAPH_FORMATS)
+def test_graph_export(fmt, tmp_path):
+    # Exported tables must read back as the in-memory tables
+    if fmt != 'npz':
+        pytest.importorskip('pyarrow')
+    sim_core = build()
+    sim_core.run(SIM_TIME)
+    tables = sim_core.get_graph_tables()
+    files = sim_core.export_graph(str(tmp_path / 'graph'), fmt)
+    assert all(os.path.isfile(f) for f in files)
+    for (table, read) in zip(tables, read_graph(files, fmt)):
+        assert list(read.keys()) == list(table.keys())
+        for (k, v) in table.items():
+            if v.dtype.kind == 'f':
+                np.testing.assert_array_equal(read[k], v)
+            else:
+                assert read[k].tolist() == v.tolist(), k
+    (nodes, edges) = tables
+    names = nodes['name'].tolist()
+    assert names == sim_core.list_components()
+    assert [names[i] for i in edges['src_id']] == edges['src'].tolist()
+    assert [names[i] for i in edges['dst_id']] == edges['dst'].tolist()
+    # Every channel has one edge per destination that carries its bytes
+    for c in sim_core.list_components(rfnocsim.comptype.channel, 'BEE7_000/FPGA_NW/SER_EXT_0'):
+        i = names.index(c)
+        rate = sim_core.lookup(c).get_bytes() / SIM_TIME
+        assert nodes['byte_rate'][i] == pytest.approx(rate)
+        assert edges['byte_rate'][edges['src'] == c].tolist() == [pytest.approx(rate)] * len(
+            [d for d in sim_core.lookup(c).get_dests() if d is not None])
+    hardware = nodes['type'] == rfnocsim.comptype.hardware
+    assert np.isnan(nodes['byte_rate'][hardware]).all()
+    assert (nodes['util_DSP'][nodes['cls'] == 'Bee7Fpga'] > 0).all()
+
+def test_graph_export_analytic(tmp_path):
+    # With a solver, the tables hold the steady state
+    sim_core = build()
+    solver = rfnocsim.SteadyStateSolver(sim_core).solve()
+    (nodes, edges) = sim_core.get_graph_tables(solver)
+    sim_core.run(SIM_TIME)
+    (sim_nodes, sim_edges) = sim_core.get_graph_tables()
+    assert nodes['name'].tolist() == sim_nodes['name'].tolist()
+    assert edges['src'].tolist() == sim_edges['src'].tolist()
+    consumers = nodes['type'] == rfnocsim.comptype.consumer
+    np.testing.assert_allclose(nodes['max_item_latency'][consumers], sim_nodes['max_item_latency'][consumers])
+    sim_core.export_graph(str(tmp_path / 'graph'), 'npz', solver)
+    np.testing.assert_array_equal(read_graph([str(tmp_path / 'graph.npz')], 'npz')[0]['byte_rate'],
+                                  nodes['byte_rate'])